@@ -14,26 +14,31 @@
 
 """Activation API endpoints."""
 
-import json
 import logging
-from typing import List
+from typing import AsyncIterator, List, Optional
 
 import aiodocker.exceptions
 import sqlalchemy as sa
 from asyncpg_lostream.lostream import PGLargeObject
-from fastapi import APIRouter, Depends, Response, status
+from fastapi import APIRouter, Depends, Header, Query, Response, status
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from eda_server import schema
+from eda_server import logstore, schema
 from eda_server.auth import requires_permission
 from eda_server.config import Settings, get_settings
+from eda_server.containers import ImageNotPresentError
 from eda_server.db import models
 from eda_server.db.dependency import get_db_session, get_db_session_factory
-from eda_server.managers import updatemanager
+from eda_server.db.sql import activation as asql
+from eda_server.managers import (
+    bootstrapcache,
+    ingestmanager,
+    updatemanager,
+)
 from eda_server.messages import ActivationErrorMessage
-from eda_server.ruleset import activate_rulesets, inactivate_rulesets
+from eda_server.supervisor import ActivationSpec, supervisor
 from eda_server.types import Action, ResourceType
 
 logger = logging.getLogger("eda_server")
@@ -271,9 +276,8 @@ async def read_output(proc, activation_instance_id, db_session_factory):
                 done = True
                 continue
             line = line.decode()
-            await updatemanager.broadcast(
-                f"/activation_instance/{activation_instance_id}",
-                json.dumps(["Stdout", {"stdout": line}]),
+            await updatemanager.broadcast_stdout(
+                f"/activation_instance/{activation_instance_id}", line
             )
             query = sa.insert(models.activation_instance_logs).values(
                 line_number=line_number,
@@ -318,6 +322,7 @@ async def create_activation_instance(
             working_directory=a.working_directory,
             execution_environment=a.execution_environment,
             project_id=a.project_id,
+            restart_policy=a.restart_policy,
         )
         .returning(
             models.activation_instances.c.id,
@@ -356,21 +361,22 @@ async def create_activation_instance(
     )
     activation_data = (await db.execute(query)).first()
 
+    spec = ActivationSpec(
+        settings.deployment_type,
+        id_,
+        large_data_id,
+        a.execution_environment,
+        activation_data.rulesets,
+        activation_data.inventory,
+        activation_data.extra_var,
+        a.working_directory,
+        settings.server_name,
+        settings.port,
+        a.restart_policy,
+    )
     try:
-        await activate_rulesets(
-            settings.deployment_type,
-            id_,
-            large_data_id,
-            a.execution_environment,
-            activation_data.rulesets,
-            activation_data.inventory,
-            activation_data.extra_var,
-            a.working_directory,
-            settings.server_name,
-            settings.port,
-            db_factory,
-        )
-    except aiodocker.exceptions.DockerError as e:
+        await supervisor.start(spec, db_factory)
+    except (aiodocker.exceptions.DockerError, ImageNotPresentError) as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={
@@ -395,8 +401,14 @@ async def create_activation_instance(
         ),
     ],
 )
-async def deactivate(activation_instance_id: int):
-    await inactivate_rulesets(activation_instance_id)
+async def deactivate(
+    activation_instance_id: int, db: AsyncSession = Depends(get_db_session)
+):
+    await supervisor.stop(activation_instance_id)
+    # Also when supervised by a server process that is gone, which would
+    # otherwise have it recovered.
+    await asql.stop_activation_instance(db, activation_instance_id)
+    await db.commit()
 
 
 @router.get(
@@ -452,6 +464,30 @@ async def read_activation_instance(
     return result.first()
 
 
+@router.get(
+    "/api/activation_instance/{activation_instance_id}/ingest",
+    response_model=schema.ActivationInstanceIngest,
+    operation_id="read_activation_instance_ingest",
+    dependencies=[
+        Depends(
+            requires_permission(ResourceType.ACTIVATION_INSTANCE, Action.READ)
+        ),
+    ],
+)
+async def read_activation_instance_ingest(activation_instance_id: int):
+    stats = ingestmanager.get_stats(activation_instance_id)
+    if stats is None:
+        return {
+            "activation_instance_id": activation_instance_id,
+            "connected": False,
+        }
+    return {
+        "activation_instance_id": activation_instance_id,
+        "connected": True,
+        **stats,
+    }
+
+
 @router.delete(
     "/api/activation_instance/{activation_instance_id}",
     status_code=status.HTTP_204_NO_CONTENT,
@@ -467,6 +503,8 @@ async def read_activation_instance(
 async def delete_activation_instance(
     activation_instance_id: int, db: AsyncSession = Depends(get_db_session)
 ):
+    # Otherwise the supervisor keeps restarting the deleted instance.
+    await supervisor.stop(activation_instance_id, record=False)
     query = sa.delete(models.activation_instances).where(
         models.activation_instances.c.id == activation_instance_id
     )
@@ -474,6 +512,7 @@ async def delete_activation_instance(
     if results.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     await db.commit()
+    bootstrapcache.invalidate(activation_instance_id=activation_instance_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -489,23 +528,180 @@ async def delete_activation_instance(
 )
 async def stream_activation_instance_logs(
     activation_instance_id: int,
+    tail: int = 65536,
     db: AsyncSession = Depends(get_db_session),
 ):
+    """Return the last lines of the output of an activation instance.
+
+    At most ``tail`` bytes are read from the end of the output. Live
+    output, and its recent tail, is sent over the activation instance
+    websocket.
+    """
+    query = sa.select(models.activation_instances.c.large_data_id).where(
+        models.activation_instances.c.id == activation_instance_id
+    )
+    row = (await db.execute(query)).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if tail <= 0:
+        return []
+
+    read = await logstore.read_tail(db, activation_instance_id, tail)
+    if read is not None:
+        output, truncated = read
+    elif row.large_data_id is not None:
+        # Output captured before segments were used, or by a server
+        # configured to store it in the large object.
+        async with PGLargeObject(
+            db, oid=row.large_data_id, mode="r"
+        ) as lobject:
+            lobject.pos = max(lobject.length - tail, 0)
+            truncated = lobject.pos > 0
+            output = b"".join([buff async for buff in lobject])
+    else:
+        return []
+
+    lines = output.decode(errors="replace").splitlines(keepends=True)
+    if truncated:
+        # The first line was cut by the read range.
+        lines = lines[1:]
+    return [
+        {"activation_instance_id": activation_instance_id, "log": line}
+        for line in lines
+    ]
+
+
+async def open_activation_instance_log(
+    db: AsyncSession, activation_instance_id: int
+) -> Optional[logstore.LogReader]:
     query = sa.select(models.activation_instances.c.large_data_id).where(
         models.activation_instances.c.id == activation_instance_id
     )
-    cur = await db.execute(query)
-    large_data_id = cur.first().large_data_id
-
-    async with PGLargeObject(db, oid=large_data_id, mode="r") as lobject:
-        async for buff in lobject:
-            await updatemanager.broadcast(
-                f"/activation_instance/{activation_instance_id}",
-                json.dumps(["Stdout", {"stdout": buff.decode()}]),
+    row = (await db.execute(query)).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    reader = await logstore.LogReader.open(db, activation_instance_id)
+    if reader is None and row.large_data_id is not None:
+        async with PGLargeObject(
+            db, oid=row.large_data_id, mode="r"
+        ) as lobject:
+            length = lobject.length
+        if length:
+            reader = await logstore.LogReader.open_large_object(
+                db, row.large_data_id, length
             )
+    return reader
 
-    # Empty list return to satisfy the UI get() call
-    return []
+
+def format_log_event(line: bytes, offset: int) -> str:
+    data = "".join(
+        f"data: {part}\n" for part in line.decode(errors="replace").split("\r")
+    )
+    return f"id: {offset}\n{data}\n"
+
+
+async def iter_log_events(chunks: AsyncIterator[bytes], offset: int):
+    """Turn output into server-sent events, one per line.
+
+    The id of each event is the offset following its line, to be passed
+    back as ``offset``, or as the Last-Event-ID header on reconnection.
+    """
+    partial = b""
+    async for chunk in chunks:
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            yield format_log_event(line, offset)
+    if partial:
+        yield format_log_event(partial, offset + len(partial))
+
+
+@router.get(
+    "/api/activation_instance/{activation_instance_id}/log",
+    operation_id="read_activation_instance_log",
+    response_class=StreamingResponse,
+    dependencies=[
+        Depends(
+            requires_permission(ResourceType.ACTIVATION_INSTANCE, Action.READ)
+        ),
+    ],
+)
+async def read_activation_instance_log(
+    activation_instance_id: int,
+    offset: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    start_line: Optional[int] = Query(None, ge=0),
+    end_line: Optional[int] = Query(None, ge=0),
+    tail_lines: Optional[int] = Query(None, ge=0),
+    accept: Optional[str] = Header(None),
+    last_event_id: Optional[int] = Header(None),
+    db: AsyncSession = Depends(get_db_session),
+    db_factory=Depends(get_db_session_factory),
+):
+    """Stream a range of the output of an activation instance.
+
+    The range is either ``limit`` bytes from ``offset``, the lines from
+    ``start_line`` up to ``end_line`` excluded, or the last ``tail_lines``
+    lines; the whole output by default. Lines are numbered from 0.
+
+    The ``X-Log-Offset`` and ``X-Log-Line`` headers give the offset and
+    line number where the range starts, ``X-Log-End`` the offset where it
+    ends, from which to read what comes next. The output is sent as plain
+    text, or as server-sent events, one per line, when the client accepts
+    ``text/event-stream``.
+    """
+    if offset is None and last_event_id is not None:
+        offset = last_event_id
+    modes = [
+        offset is not None or limit is not None,
+        start_line is not None or end_line is not None,
+        tail_lines is not None,
+    ]
+    if sum(modes) > 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either a byte range, a line range or tail_lines.",
+        )
+
+    reader = await open_activation_instance_log(db, activation_instance_id)
+    if reader is None:
+        reader = logstore.LogReader.from_bytes(b"")
+    if tail_lines is not None:
+        start, end = await reader.tail_offset(tail_lines), reader.end
+    elif start_line is not None or end_line is not None:
+        start = await reader.line_offset(start_line or 0)
+        end = reader.end
+        if end_line is not None:
+            end = max(await reader.line_offset(end_line), start)
+    else:
+        start = max(offset or 0, reader.start)
+        end = reader.end if limit is None else min(start + limit, reader.end)
+    start = min(start, end)
+
+    headers = {
+        "X-Log-Offset": str(start),
+        "X-Log-Line": str(await reader.line_at(start)),
+        "X-Log-End": str(end),
+    }
+
+    async def read_chunks():
+        # The request session is closed once the response is returned,
+        # the output is streamed with a session of its own.
+        async with db_factory() as stream_db:
+            async for chunk in reader.bind(stream_db).iter_bytes(start, end):
+                yield chunk
+
+    chunks = read_chunks()
+    if accept and "text/event-stream" in accept:
+        return StreamingResponse(
+            iter_log_events(chunks, start),
+            media_type="text/event-stream",
+            headers={**headers, "Cache-Control": "no-cache"},
+        )
+    return StreamingResponse(
+        chunks, media_type="text/plain; charset=utf-8", headers=headers
+    )
 
 
 @router.get(
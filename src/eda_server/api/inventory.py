@@ -22,6 +22,7 @@ from eda_server import schema
 from eda_server.auth import requires_permission
 from eda_server.db import models
 from eda_server.db.dependency import get_db_session
+from eda_server.managers import bootstrapcache
 from eda_server.types import Action, InventorySource, ResourceType
 
 router = APIRouter(tags=["inventories"])
@@ -98,6 +99,7 @@ async def update_inventory(
         )
     )
     await db.commit()
+    bootstrapcache.invalidate(inventory_id=inventory_id)
 
     updated_inventory = (
         await db.execute(
@@ -176,3 +178,4 @@ async def delete_inventory(
             detail="Inventory Not Found.",
         )
     await db.commit()
+    bootstrapcache.invalidate(inventory_id=inventory_id)
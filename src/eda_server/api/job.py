@@ -30,8 +30,10 @@ from eda_server.auth import requires_permission
 from eda_server.config import Settings, get_settings
 from eda_server.db import models
 from eda_server.db.dependency import get_db_session, get_db_session_factory
-from eda_server.managers import taskmanager
-from eda_server.ruleset import activate_rulesets, run_job, write_job_events
+from eda_server.jobengine import JobQueueFull, jobengine
+from eda_server.managers import taskmanager, updatemanager
+from eda_server.ruleset import run_job, submit_job, write_job_events
+from eda_server.supervisor import ActivationSpec, supervisor
 from eda_server.types import Action, ResourceType
 
 logger = logging.getLogger("eda_server")
@@ -64,6 +66,16 @@ async def list_job_instances(db: AsyncSession = Depends(get_db_session)):
     return result.all()
 
 
+@router.get(
+    "/api/job_instances/queue",
+    operation_id="read_job_queue",
+    dependencies=[Depends(requires_permission(ResourceType.JOB, Action.READ))],
+)
+async def read_job_queue():
+    """Return the jobs queued and running in this server process."""
+    return jobengine.stats()
+
+
 @router.post(
     "/api/job_instance",
     response_model=schema.JobInstanceBaseRead,
@@ -76,6 +88,7 @@ async def create_job_instance(
     j: schema.JobInstanceCreate,
     db: AsyncSession = Depends(get_db_session),
     db_factory=Depends(get_db_session_factory),
+    settings: Settings = Depends(get_settings),
 ):
 
     query = sa.select(models.playbooks).where(
@@ -94,31 +107,45 @@ async def create_job_instance(
     extra_var_row = (await db.execute(query)).first()
 
     job_uuid = str(uuid.uuid4())
-
-    query = sa.insert(models.job_instances).values(
-        uuid=job_uuid,
-        name=playbook_row.name,
-    )
-    result = await db.execute(query)
-    await db.commit()
-    (job_instance_id,) = result.inserted_primary_key
-
     event_log = asyncio.Queue()
 
-    task = asyncio.create_task(
-        run_job(
+    try:
+        job = submit_job(
             job_uuid,
             event_log,
             playbook_row.playbook,
             inventory_row.inventory,
             extra_var_row.extra_var,
-            db,
-        ),
+        )
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
+
+    try:
+        query = sa.insert(models.job_instances).values(
+            uuid=job_uuid,
+            name=playbook_row.name,
+        )
+        result = await db.execute(query)
+        await db.commit()
+    except BaseException:
+        jobengine.cancel(job_uuid)
+        raise
+    (job_instance_id,) = result.inserted_primary_key
+
+    task = asyncio.create_task(
+        run_job(job, event_log),
         name=f"run_job {job_instance_id}",
     )
     taskmanager.tasks.append(task)
     task = asyncio.create_task(
-        write_job_events(event_log, job_instance_id, db_factory),
+        write_job_events(
+            event_log,
+            job_instance_id,
+            db_factory,
+            batch_size=settings.ingest_batch_size,
+        ),
         name=f"write_job_events {job_instance_id}",
     )
     taskmanager.tasks.append(task)
@@ -201,20 +228,21 @@ async def rerun_job_instance(
 
     rerun_data = (await db.execute(query)).first()
 
+    spec = ActivationSpec(
+        settings.deployment_type,
+        activation_instance.id,
+        activation_instance.large_data_id,
+        activation_instance.execution_environment,
+        rerun_data.rulesets,
+        rerun_data.inventory,
+        rerun_data.extra_var,
+        activation_instance.working_directory,
+        settings.server_name,
+        settings.port,
+        activation_instance.restart_policy,
+    )
     try:
-        await activate_rulesets(
-            settings.deployment_type,
-            activation_instance.id,
-            activation_instance.large_data_id,
-            activation_instance.execution_environment,
-            rerun_data.rulesets,
-            rerun_data.inventory,
-            rerun_data.extra_var,
-            activation_instance.working_directory,
-            settings.server_name,
-            settings.port,
-            db_factory,
-        )
+        await supervisor.start(spec, db_factory)
     except Exception as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -235,6 +263,35 @@ async def rerun_job_instance(
     }
 
 
+@router.post(
+    "/api/job_instance/{job_instance_id}/cancel",
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="cancel_job_instance",
+    dependencies=[
+        Depends(requires_permission(ResourceType.JOB, Action.UPDATE))
+    ],
+)
+async def cancel_job_instance(
+    job_instance_id: int, db: AsyncSession = Depends(get_db_session)
+):
+    query = sa.select(models.job_instances.c.uuid).where(
+        models.job_instances.c.id == job_instance_id
+    )
+    job_uuid = (await db.execute(query)).scalar()
+    if job_uuid is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if jobengine.cancel(str(job_uuid)):
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    if updatemanager.bus.shared:
+        # The job may run in another server process.
+        updatemanager.send_command("cancel_job", key=str(job_uuid))
+        return Response(status_code=status.HTTP_202_ACCEPTED)
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Job instance {job_instance_id} is not queued or running",
+    )
+
+
 @router.get(
     "/api/job_instance/{job_instance_id}",
     response_model=schema.JobInstanceRead,
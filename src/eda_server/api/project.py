@@ -25,6 +25,7 @@ from eda_server.db.dependency import get_db_session
 from eda_server.db.models.inventory import inventories
 from eda_server.db.models.project import extra_vars, playbooks, projects
 from eda_server.db.models.rulebook import rulebooks
+from eda_server.managers import bootstrapcache
 from eda_server.project import (
     GitCommandFailed,
     import_project,
@@ -111,13 +112,17 @@ async def sync_project(
         )
 
     try:
-        await sync_existing_project(db, project)
+        updated = await sync_existing_project(db, project)
     except GitCommandFailed:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Cannot clone repository.",
         )
     await db.commit()
+    # Only once committed, or a worker bootstrapping in between would
+    # cache the former files again.
+    for ids in updated:
+        bootstrapcache.invalidate(**ids)
 
     return Response(
         status_code=status.HTTP_200_OK,
@@ -209,7 +214,7 @@ async def update_project(
         )
         .label("project_name_count"),
     ).select_from(projects)
-    exists_check = (await (db.execute(query))).one_or_none()
+    exists_check = (await db.execute(query)).one_or_none()
 
     if exists_check.project_id_count == 0:
         raise HTTPException(
@@ -260,6 +265,7 @@ async def delete_project(
     if results.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     await db.commit()
+    bootstrapcache.invalidate(project_id=project_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -13,27 +13,107 @@
 #  limitations under the License.
 
 import base64
+import hashlib
 import json
 import logging
+import re
+import struct
 from datetime import datetime
 from enum import Enum
+from typing import Optional, Tuple
 
 from asyncpg_lostream.lostream import PGLargeObject
 from fastapi import APIRouter, Depends
-from sqlalchemy import cast, insert, select
-from sqlalchemy.dialects import postgresql
+from sqlalchemy import insert, select
+from sqlalchemy.exc import NoResultFound, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
+from eda_server import metrics
 from eda_server.db import models
 from eda_server.db.dependency import get_db_session_factory
-from eda_server.managers import secretsmanager, updatemanager
+from eda_server.db.sql import activation as asql, rulebook as rsql
+from eda_server.ingest import CreditWindow, IngestContext, JobEventBuffer
+from eda_server.managers import (
+    ActivationBootstrap,
+    bootstrapcache,
+    ingestmanager,
+    secretsmanager,
+    updatemanager,
+)
+from eda_server.messages import MessageDecodeError, decode_worker_message
+from eda_server.project import compute_archive_hash
+from eda_server.utils.cache import LRUCache
+from eda_server.workerpool import workerpool
 
 logger = logging.getLogger("eda_server")
 
 router = APIRouter()
 
+JOB_INSTANCE_CACHE_SIZE = 4096
+RULE_ACTION_CACHE_SIZE = 4096
+
+# Maps job uuid reported by rulebook workers to job_instance.id
+job_instance_ids = LRUCache(JOB_INSTANCE_CACHE_SIZE)
+
+# Maps (activation instance id, action type, action name) reported by
+# rulebook workers to the rules firing that action. Rules never change
+# once a rulebook is imported, so entries are not invalidated.
+rule_actions = LRUCache(RULE_ACTION_CACHE_SIZE)
+
+WS2_CONNECTED_WORKERS = metrics.Gauge(
+    "eda_ws2_connected_workers",
+    "Number of rulebook workers connected to /api/ws2.",
+    multiprocess_mode="livesum",
+)
+WS2_MESSAGES = metrics.Counter(
+    "eda_ws2_messages_total",
+    "Messages received from rulebook workers, by type.",
+    ["type"],
+)
+WS2_REJECTED_MESSAGES = metrics.Counter(
+    "eda_ws2_rejected_messages_total",
+    "Messages from rulebook workers that failed to decode.",
+)
+WS2_HANDLER_SECONDS = metrics.Histogram(
+    "eda_ws2_handler_seconds",
+    "Time spent handling a message from a rulebook worker, by type.",
+    ["type"],
+)
+WS2_HANDLER_ERRORS = metrics.Counter(
+    "eda_ws2_handler_errors_total",
+    "Database errors while handling worker messages, by type.",
+    ["type"],
+)
+INGEST_PENDING_EVENTS = metrics.CallbackGauge(
+    "eda_ingest_pending_events",
+    "Job events received and not yet written, by activation instance.",
+    ["activation_instance_id"],
+    lambda: (
+        ((activation_instance_id,), buffer.pending)
+        for activation_instance_id, buffer in ingestmanager.buffers.items()
+    ),
+)
+INGEST_LAG_SECONDS = metrics.CallbackGauge(
+    "eda_ingest_lag_seconds",
+    "Age of the oldest job event not yet written, by activation instance.",
+    ["activation_instance_id"],
+    lambda: (
+        ((activation_instance_id,), buffer.lag)
+        for activation_instance_id, buffer in ingestmanager.buffers.items()
+    ),
+)
+
+# Pages a client of /api/ws-updates may subscribe to
+UPDATE_PAGE_RE = re.compile(r"/jobs|/(activation|job)_instance/\d+")
+EVENT_TIME_FRACTION_RE = re.compile(r"\.(\d+)")
+MAX_PAGE_SUBSCRIPTIONS = 256
+
+# Binary ProjectData frames start with the offset of their payload in the
+# project archive, as an unsigned 64-bit big-endian integer.
+PROJECT_DATA_OFFSET = struct.Struct("!Q")
+
 
 # Determine host status based on event type
 # https://github.com/ansible/awx/blob/devel/awx/main/models/events.py#L164
@@ -67,6 +147,34 @@ host_status_map = {
     Event.NO_REMAINING: "no remaining",
 }
 
+# Host status keyed by raw event name, for lookups on the ingest path
+host_status_by_event = {
+    event.value: status for event, status in host_status_map.items()
+}
+
+
+class WorkerConnection:
+    """State of a rulebook worker connected to /api/ws2."""
+
+    def __init__(self, websocket: WebSocket, ingest: IngestContext):
+        self.websocket = websocket
+        self.ingest = ingest
+        self.credits: Optional[CreditWindow] = None
+        self.job_events: Optional[JobEventBuffer] = None
+        self.activation_instance_id: Optional[int] = None
+        # Placeholder id of a pooled worker, which keeps reporting it
+        # once assigned to an activation instance
+        self.pool_id: Optional[str] = None
+
+    def translate(self, data: dict) -> None:
+        """Replace the placeholder id of a pooled worker in a message."""
+        for key in ("activation_id", "ansible_rulebook_id"):
+            if data.get(key) == self.pool_id:
+                data[key] = self.activation_instance_id
+
+    async def send(self, message: dict) -> None:
+        await self.websocket.send_text(json.dumps(message))
+
 
 @router.websocket("/api/ws2")
 async def websocket_endpoint2(
@@ -74,25 +182,52 @@ async def websocket_endpoint2(
     db_session_factory: sessionmaker = Depends(get_db_session_factory),
 ):
     logger.debug("starting ws2")
+    settings = websocket.app.state.settings
     await websocket.accept()
+    WS2_CONNECTED_WORKERS.inc()
+    ingest = IngestContext(db_session_factory)
+    connection = WorkerConnection(websocket, ingest)
+    credits = CreditWindow(connection.send, settings.ingest_credit_window)
+    job_events = JobEventBuffer(
+        ingest.session,
+        batch_size=settings.ingest_batch_size,
+        flush_interval=settings.ingest_flush_interval,
+        max_pending=settings.ingest_max_pending,
+        on_flush=credits.on_flush,
+    )
+    job_events.start()
+    connection.credits = credits
+    connection.job_events = job_events
     try:
         while True:
-            data = await websocket.receive_text()
-            data = json.loads(data)
-            logger.debug(f"ws2 received: {data}")
-            # TODO(cutwater): Some data validation is needed
-            data_type = data.get("type")
-            async with db_session_factory() as db:
-                if data_type == "Worker":
-                    await handle_workers(websocket, data, db)
-                elif data_type == "Job":
-                    await handle_jobs(data, db)
-                elif data_type == "AnsibleEvent":
-                    await handle_ansible_rulebook(data, db)
-                elif data_type == "Action":
-                    await handle_actions(data, db)
+            raw = await websocket.receive_text()
+            try:
+                data = decode_worker_message(raw)
+            except MessageDecodeError as exc:
+                logger.warning("ws2 rejected message: %s", exc)
+                WS2_REJECTED_MESSAGES.inc()
+                continue
+            logger.debug("ws2 received: %s", data)
+            if connection.pool_id is not None:
+                connection.translate(data)
+            data_type = data["type"]
+            WS2_MESSAGES.labels(type=data_type).inc()
+            try:
+                with WS2_HANDLER_SECONDS.labels(type=data_type).time():
+                    await WORKER_MESSAGE_HANDLERS[data_type](connection, data)
+            except SQLAlchemyError:
+                logger.exception("ws2 failed to handle %s message", data_type)
+                WS2_HANDLER_ERRORS.labels(type=data_type).inc()
     except WebSocketDisconnect:
         pass
+    finally:
+        if connection.activation_instance_id is not None:
+            ingestmanager.unregister(
+                connection.activation_instance_id, job_events
+            )
+        await job_events.close()
+        await ingest.close()
+        WS2_CONNECTED_WORKERS.dec()
 
 
 @router.websocket("/api/ws-activation/{activation_instance_id}")
@@ -133,6 +268,47 @@ async def websocket_job_endpoint(websocket: WebSocket, job_instance_id):
         updatemanager.disconnect(page, websocket)
 
 
+@router.websocket("/api/ws-updates")
+async def websocket_updates_endpoint(websocket: WebSocket):
+    """Stream updates of any number of pages over a single websocket.
+
+    The client sends ``{"type": "subscribe", "page": <page>}`` and
+    ``{"type": "unsubscribe", "page": <page>}`` messages, where a page is
+    ``/jobs``, ``/activation_instance/<id>`` or ``/job_instance/<id>``,
+    and receives ``{"page": <page>, "message": <message>}`` for each
+    message of a subscribed page. A client that has been silent for a
+    while is sent ``{"type": "Ping"}`` and must answer with any message,
+    e.g. ``{"type": "Pong"}``, to stay connected.
+    """
+    subscriber = await updatemanager.connect_multiplexed(websocket)
+    try:
+        while True:
+            data = await websocket.receive_text()
+            updatemanager.touch(subscriber)
+            try:
+                data = json.loads(data)
+                data_type = data["type"]
+                if data_type == "Pong":
+                    continue
+                page = data["page"]
+            except (ValueError, TypeError, KeyError):
+                logger.debug("ws-updates rejected message: %s", data)
+                continue
+            if not isinstance(page, str) or not UPDATE_PAGE_RE.fullmatch(page):
+                logger.debug("ws-updates rejected page: %s", page)
+            elif data_type == "subscribe":
+                if len(subscriber.pages) < MAX_PAGE_SUBSCRIPTIONS:
+                    updatemanager.subscribe(subscriber, page)
+                else:
+                    logger.warning("ws-updates subscription limit reached")
+            elif data_type == "unsubscribe":
+                updatemanager.unsubscribe(subscriber, page)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        updatemanager.release(subscriber)
+
+
 async def send_project_data(
     large_data_id, websocket: WebSocket, db: AsyncSession
 ):
@@ -154,137 +330,268 @@ async def send_project_data(
         )
 
 
-async def handle_workers(websocket: WebSocket, data: dict, db: AsyncSession):
-    await websocket.send_text(json.dumps({"type": "Hello"}))
-    query = select(models.activation_instances).where(
-        models.activation_instances.c.id == data.get("activation_id")
-    )
-    activation = (await db.execute(query)).first()
-
-    query = select(models.projects).where(
-        models.projects.c.id == activation.project_id
-    )
-    project_row = (await db.execute(query)).first()
-    if project_row:
-        if project_row.large_data_id:
-            await send_project_data(project_row.large_data_id, websocket, db)
-        else:
-            logger.debug("no project large_data_id")
-    else:
-        logger.debug("no project row")
-
-    query = select(models.rulebooks).where(
-        models.rulebooks.c.id == activation.rulebook_id
-    )
-    rulebook_row = (await db.execute(query)).first()
+async def send_project_data_binary(
+    large_data_id: int,
+    archive_hash: str,
+    websocket: WebSocket,
+    db: AsyncSession,
+    offset: int = 0,
+):
+    """Stream the project archive as binary frames, starting at offset.
+
+    A ``ProjectData`` text message announces the archive hash and the
+    starting offset, then each chunk is sent as a binary frame prefixed
+    with its offset in the archive (see ``PROJECT_DATA_OFFSET``). A final
+    ``ProjectData`` text message with ``more`` set to false ends the
+    transfer.
+    """
     await websocket.send_text(
         json.dumps(
             {
-                "type": "Rulebook",
-                "data": base64.b64encode(
-                    rulebook_row.rulesets.encode()
-                ).decode(),
+                "type": "ProjectData",
+                "encoding": "binary",
+                "hash": archive_hash,
+                "offset": offset,
+                "more": True,
             }
         )
     )
 
-    query = select(models.inventories).where(
-        models.inventories.c.id == activation.inventory_id
-    )
-    inventory_row = (await db.execute(query)).first()
+    async with PGLargeObject(db, oid=large_data_id, mode="r") as lobject:
+        lobject.pos = offset
+        async for buff in lobject:
+            await websocket.send_bytes(PROJECT_DATA_OFFSET.pack(offset) + buff)
+            offset += len(buff)
+
     await websocket.send_text(
         json.dumps(
             {
-                "type": "Inventory",
-                "data": base64.b64encode(
-                    inventory_row.inventory.encode()
-                ).decode(),
+                "type": "ProjectData",
+                "hash": archive_hash,
+                "size": offset,
+                "data": None,
+                "more": False,
             }
         )
     )
 
-    query = select(models.extra_vars).where(
-        models.extra_vars.c.id == activation.extra_var_id
-    )
-    extra_var_row = (await db.execute(query)).first()
-    await websocket.send_text(
-        json.dumps(
-            {
-                "type": "ExtraVars",
-                "data": base64.b64encode(
-                    extra_var_row.extra_var.encode()
-                ).decode(),
-            }
+
+def get_project_transfer(data: dict) -> Tuple[bool, Optional[str], int]:
+    """Return binary mode, held archive hash and resume offset of a worker.
+
+    Workers opt into the binary transfer by sending ``project_transfer``
+    set to ``"binary"`` with their Worker message, optionally along with
+    the ``project_hash`` of the archive they already hold and, if that
+    archive is incomplete, the ``project_offset`` to resume from.
+    """
+    binary = data.get("project_transfer") == "binary"
+    project_hash = data.get("project_hash")
+    if not isinstance(project_hash, str):
+        project_hash = None
+    project_offset = data.get("project_offset")
+    if not isinstance(project_offset, int) or project_offset < 0:
+        project_offset = None
+    return binary, project_hash, project_offset
+
+
+async def send_project(
+    bootstrap: ActivationBootstrap,
+    data: dict,
+    websocket: WebSocket,
+    db: AsyncSession,
+):
+    binary, project_hash, project_offset = get_project_transfer(data)
+    if not binary:
+        await send_project_data(bootstrap.project_large_data_id, websocket, db)
+        return
+
+    archive_hash = bootstrap.project_archive_hash
+    if archive_hash is None:
+        archive_hash = await compute_archive_hash(
+            db, bootstrap.project_large_data_id
         )
-    )
-    if secretsmanager.has_secret("ssh-private-key"):
+        await db.commit()
+        bootstrapcache.set(
+            bootstrap._replace(project_archive_hash=archive_hash)
+        )
+
+    if project_hash != archive_hash:
+        project_offset = 0
+    elif project_offset is None:
         await websocket.send_text(
             json.dumps(
                 {
-                    "type": "SSHPrivateKey",
-                    "data": base64.b64encode(
-                        secretsmanager.get_secret("ssh-private-key").encode()
-                    ).decode(),
+                    "type": "ProjectData",
+                    "hash": archive_hash,
+                    "data": None,
+                    "more": False,
+                    "skip": True,
                 }
             )
         )
+        return
+
+    await send_project_data_binary(
+        bootstrap.project_large_data_id,
+        archive_hash,
+        websocket,
+        db,
+        project_offset,
+    )
+
+
+def encode_payload(message_type: str, payload: Optional[str]) -> str:
+    return json.dumps(
+        {
+            "type": message_type,
+            "data": base64.b64encode((payload or "").encode()).decode(),
+        }
+    )
+
+
+def build_bootstrap(row) -> ActivationBootstrap:
+    payloads = (
+        ("Rulebook", row.rulesets),
+        ("Inventory", row.inventory),
+        ("ExtraVars", row.extra_var),
+    )
+    digest = hashlib.sha256()
+    for _, payload in payloads:
+        digest.update((payload or "").encode())
+        digest.update(b"\0")
+    return ActivationBootstrap(
+        activation_instance_id=row.id,
+        project_id=row.project_id,
+        rulebook_id=row.rulebook_id,
+        inventory_id=row.inventory_id,
+        extra_var_id=row.extra_var_id,
+        project_large_data_id=row.project_large_data_id,
+        project_archive_hash=row.project_archive_hash,
+        digest=digest.hexdigest(),
+        frames=tuple(
+            encode_payload(message_type, payload)
+            for message_type, payload in payloads
+        ),
+    )
+
+
+async def handle_workers(websocket: WebSocket, data: dict, db: AsyncSession):
+    await websocket.send_text(json.dumps({"type": "Hello"}))
+    activation_instance_id = int(data["activation_id"])
+
+    bootstrap = bootstrapcache.get(activation_instance_id)
+    if bootstrap is None:
+        row = await asql.get_activation_instance_bootstrap(
+            db, activation_instance_id
+        )
+        if row is None:
+            logger.error(
+                "Activation instance %s not found", activation_instance_id
+            )
+            return
+        bootstrap = build_bootstrap(row)
+        bootstrapcache.set(bootstrap)
+    logger.debug(
+        "bootstrap activation instance %s: %s",
+        activation_instance_id,
+        bootstrap.digest,
+    )
+
+    if bootstrap.project_id is None:
+        logger.debug("no project row")
+    elif bootstrap.project_large_data_id:
+        await send_project(bootstrap, data, websocket, db)
+    else:
+        logger.debug("no project large_data_id")
+
+    for frame in bootstrap.frames:
+        await websocket.send_text(frame)
+
+    if secretsmanager.has_secret("ssh-private-key"):
+        await websocket.send_text(
+            encode_payload(
+                "SSHPrivateKey", secretsmanager.get_secret("ssh-private-key")
+            )
+        )
     else:
         await websocket.send_text(
             json.dumps({"type": "SSHPrivateKey", "data": ""})
         )
 
 
-async def handle_ansible_rulebook(data: dict, db: AsyncSession):
+def parse_event_time(value: str) -> datetime:
+    """Parse the ISO 8601 time at which a job event was created.
+
+    Before Python 3.11, fromisoformat only accepts fractions of a second
+    of 3 or 6 digits, others are padded or cut to microseconds.
+    """
+    value = EVENT_TIME_FRACTION_RE.sub(
+        lambda match: "." + match.group(1)[:6].ljust(6, "0"), value, count=1
+    )
+    return datetime.fromisoformat(value)
+
+
+async def get_job_instance_id(db: AsyncSession, job_uuid: str) -> int:
+    job_instance_id = job_instance_ids.get(job_uuid)
+    if job_instance_id is None:
+        query = select(models.job_instances.c.id).where(
+            models.job_instances.c.uuid == job_uuid
+        )
+        job_instance_id = (await db.execute(query)).scalar_one()
+        job_instance_ids.set(job_uuid, job_instance_id)
+    return job_instance_id
+
+
+async def handle_ansible_rulebook(
+    data: dict, ingest: IngestContext, job_events: JobEventBuffer
+):
     event_data = data.get("event", {})
     if event_data.get("stdout"):
-        query = select(models.job_instances).where(
-            models.job_instances.c.uuid == event_data.get("job_id")
-        )
-        result = await db.execute(query)
-        job_instance_id = result.first().job_instance_id
+        async with ingest.session() as db:
+            job_instance_id = await get_job_instance_id(
+                db, event_data.get("job_id")
+            )
 
-        await updatemanager.broadcast(
-            f"/job_instance/{job_instance_id}",
-            json.dumps(["Stdout", {"stdout": event_data.get("stdout")}]),
+        await updatemanager.broadcast_stdout(
+            f"/job_instance/{job_instance_id}", event_data.get("stdout")
         )
 
     created = event_data.get("created")
     if created:
-        created = datetime.strptime(created, "%Y-%m-%dT%H:%M:%S.%f")
-
-    query = insert(models.job_instance_events).values(
-        job_uuid=event_data.get("job_id"),
-        counter=event_data.get("counter"),
-        stdout=event_data.get("stdout"),
-        type=event_data.get("event"),
-        created_at=created,
-    )
-    await db.execute(query)
+        created = parse_event_time(created)
+
+    job_event = {
+        "job_uuid": event_data.get("job_id"),
+        "counter": event_data.get("counter"),
+        "stdout": event_data.get("stdout"),
+        "type": event_data.get("event"),
+        "created_at": created,
+    }
+    job_host = None
 
     event = event_data.get("event")
-    if event and event in [item.value for item in host_status_map]:
+    status = host_status_by_event.get(event)
+    if status is not None:
         data = event_data.get("event_data", {})
 
         host = data.get("play_pattern")
         playbook = data.get("playbook")
         play = data.get("play")
         task = data.get("task")
-        status = host_status_map[Event(event)]
 
         if event == "runner_on_ok" and data.get("res", {}).get("changed"):
             status = "changed"
 
-        query = insert(models.job_instance_hosts).values(
-            job_uuid=event_data.get("job_id"),
-            host=host,
-            playbook=playbook,
-            play=play,
-            task=task,
-            status=status,
-        )
-        await db.execute(query)
+        job_host = {
+            "job_uuid": event_data.get("job_id"),
+            "host": host,
+            "playbook": playbook,
+            "play": play,
+            "task": task,
+            "status": status,
+        }
 
-    await db.commit()
+    await job_events.add(job_event, job_host)
 
 
 async def handle_jobs(data: dict, db: AsyncSession):
@@ -299,6 +606,7 @@ async def handle_jobs(data: dict, db: AsyncSession):
     result = await db.execute(query)
     await db.commit()
     (job_instance_id,) = result.inserted_primary_key
+    job_instance_ids.set(data.get("job_id"), job_instance_id)
 
     activation_instance_id = int(data.get("ansible_rulebook_id"))
     query = insert(models.activation_instance_job_instances).values(
@@ -309,12 +617,26 @@ async def handle_jobs(data: dict, db: AsyncSession):
     await db.commit()
     await updatemanager.broadcast(
         f"/activation_instance/{activation_instance_id}",
-        json.dumps(["Job", {"job_instance_id": job_instance_id}]),
-    )
-    await updatemanager.broadcast(
-        "/jobs",
-        json.dumps(["Job", {"id": job_instance_id}]),
+        ["Job", {"job_instance_id": job_instance_id}],
     )
+    await updatemanager.broadcast("/jobs", ["Job", {"id": job_instance_id}])
+
+
+async def get_rule_actions(
+    db: AsyncSession,
+    activation_instance_id: int,
+    action_type: str,
+    action_name: str,
+) -> Tuple[dict, ...]:
+    key = (activation_instance_id, action_type, action_name)
+    actions = rule_actions.get(key)
+    if actions is None:
+        rows = await rsql.get_activation_instance_rule_actions(
+            db, activation_instance_id, action_type, action_name
+        )
+        actions = tuple(row._asdict() for row in rows)
+        rule_actions.set(key, actions)
+    return actions
 
 
 async def handle_actions(data: dict, db: AsyncSession):
@@ -330,93 +652,93 @@ async def handle_actions(data: dict, db: AsyncSession):
         )
         status = data.get("status")
 
+        if playbook_name is None:
+            return
+        actions = await get_rule_actions(
+            db, activation_id, action_name, playbook_name
+        )
+        if not actions:
+            return
+
+        job_instance_id = None
         if job_id:
-            sel = (
-                select(
-                    models.activation_instances.c.id.label(
-                        "activation_instance_id"
-                    ),
-                    models.rulesets.c.id.label("ruleset_id"),
-                    models.rules.c.id.label("rule_id"),
-                    models.rules.c.name,
-                    models.rules.c.action.label("definition"),
-                    models.job_instances.c.id.label("job_instance_id"),
-                    cast(fired_date, postgresql.TIMESTAMP).label("fired_date"),
-                    cast(status, postgresql.VARCHAR).label("status"),
-                )
-                .join(
-                    models.rulesets,
-                    models.rulesets.c.rulebook_id
-                    == models.activation_instances.c.rulebook_id,
-                )
-                .join(
-                    models.rules,
-                    models.rules.c.ruleset_id == models.rulesets.c.id,
-                )
-                .join(
-                    models.job_instances,
-                    models.job_instances.c.uuid
-                    == cast(job_id, postgresql.UUID),
-                )
-                .where(
-                    models.activation_instances.c.id == activation_id,
-                    models.rules.c.action[action_name].is_not(None),
-                    models.rules.c.action[action_name]["name"].astext
-                    == playbook_name,
-                    models.job_instances.c.id.is_not(None),
-                )
-            )
-            ins_cols = [
-                "activation_instance_id",
-                "ruleset_id",
-                "rule_id",
-                "name",
-                "definition",
-                "job_instance_id",
-                "fired_date",
-                "status",
-            ]
-        else:
-            sel = (
-                select(
-                    models.activation_instances.c.id.label(
-                        "activation_instance_id"
-                    ),
-                    models.rulesets.c.id.label("ruleset_id"),
-                    models.rules.c.id.label("rule_id"),
-                    models.rules.c.name,
-                    models.rules.c.action.label("definition"),
-                    cast(fired_date, postgresql.TIMESTAMP).label("fired_date"),
-                    cast(status, postgresql.VARCHAR).label("status"),
-                )
-                .join(
-                    models.rulesets,
-                    models.rulesets.c.rulebook_id
-                    == models.activation_instances.c.rulebook_id,
-                )
-                .join(
-                    models.rules,
-                    models.rules.c.ruleset_id == models.rulesets.c.id,
-                )
-                .where(
-                    models.activation_instances.c.id == activation_id,
-                    models.rules.c.action[action_name].is_not(None),
-                    models.rules.c.action[action_name]["name"].astext
-                    == playbook_name,
-                )
+            try:
+                job_instance_id = await get_job_instance_id(db, job_id)
+            except NoResultFound:
+                logger.warning("Job instance %s not found", job_id)
+                return
+
+        await db.execute(
+            insert(models.audit_rules).values(
+                [
+                    {
+                        **action,
+                        "activation_instance_id": activation_id,
+                        "job_instance_id": job_instance_id,
+                        "fired_date": fired_date,
+                        "status": status,
+                    }
+                    for action in actions
+                ]
             )
-            ins_cols = [
-                "activation_instance_id",
-                "ruleset_id",
-                "rule_id",
-                "name",
-                "definition",
-                "fired_date",
-                "status",
-            ]
-
-        ins = insert(models.audit_rules).from_select(ins_cols, sel)
-        # End build insert-from-select query
-
-        await db.execute(ins)
+        )
         await db.commit()
+
+
+async def on_worker_message(connection: WorkerConnection, data: dict):
+    if workerpool.is_pool_id(data["activation_id"]):
+        # A pre-started worker waits here until it is assigned an
+        # activation instance, then is bootstrapped for it.
+        activation_instance_id = await workerpool.park(data["activation_id"])
+        if activation_instance_id is None:
+            logger.warning("Unknown pooled worker %s", data["activation_id"])
+            return
+        connection.pool_id = data["activation_id"]
+        data["activation_id"] = activation_instance_id
+
+    async with connection.ingest.session() as db:
+        await handle_workers(connection.websocket, data, db)
+
+    activation_instance_id = int(data["activation_id"])
+    if connection.activation_instance_id is not None:
+        ingestmanager.unregister(
+            connection.activation_instance_id, connection.job_events
+        )
+    connection.activation_instance_id = activation_instance_id
+    ingestmanager.register(activation_instance_id, connection.job_events)
+    # Workers that opt into flow control are granted their credit window
+    # once bootstrapped, and send one AnsibleEvent message per credit.
+    if data.get("flow_control"):
+        await connection.credits.enable()
+
+
+async def on_job_message(connection: WorkerConnection, data: dict):
+    async with connection.ingest.session() as db:
+        await handle_jobs(data, db)
+
+
+async def on_ansible_event_message(connection: WorkerConnection, data: dict):
+    # NOTE: Must not hold the ingest session here, adding to a full
+    #   job event buffer waits for a flush that needs it.
+    connection.credits.consume()
+    try:
+        await handle_ansible_rulebook(
+            data, connection.ingest, connection.job_events
+        )
+    except Exception:
+        # The event was not queued, its credit comes back right away.
+        await connection.credits.release()
+        raise
+
+
+async def on_action_message(connection: WorkerConnection, data: dict):
+    async with connection.ingest.session() as db:
+        await handle_actions(data, db)
+
+
+WORKER_MESSAGE_HANDLERS = {
+    "Worker": on_worker_message,
+    "Job": on_job_message,
+    "AnsibleEvent": on_ansible_event_message,
+    "Action": on_action_message,
+}
@@ -14,13 +14,24 @@
 
 import logging
 
-from fastapi import APIRouter, FastAPI
+from fastapi import APIRouter, FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
+from eda_server import metrics
 from eda_server.api import router as api_router
+from eda_server.bus import create_bus
 from eda_server.config import load_settings
+from eda_server.containers import containerclient
 from eda_server.db.dependency import get_db_session_factory
 from eda_server.db.provider import DatabaseProvider
+from eda_server.jobengine import jobengine
+from eda_server.logsink import logsinks
+from eda_server.managers import bootstrapcache, updatemanager
+from eda_server.ruleset import local_worker_command
+from eda_server.supervisor import supervisor
+from eda_server.workerpool import workerpool
+
+logger = logging.getLogger("eda_server")
 
 ALLOWED_ORIGINS = [
     "http://localhost",
@@ -39,6 +50,15 @@ def ping():
     return {"ping": "pong!"}
 
 
+@root_router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    # Callback gauges read state owned by the event loop, they are
+    # collected on it rather than in the threadpool.
+    return Response(
+        content=metrics.render(), media_type=metrics.CONTENT_TYPE
+    )
+
+
 def setup_cors(app: FastAPI) -> None:
     app.add_middleware(
         CORSMiddleware,
@@ -54,13 +74,125 @@ def setup_routes(app: FastAPI) -> None:
     app.include_router(api_router)
 
 
-def setup_database(app: FastAPI) -> None:
+def setup_database(app: FastAPI) -> DatabaseProvider:
     settings = app.state.settings
     provider = DatabaseProvider(settings.database_url)
     app.add_event_handler("shutdown", provider.close)
     app.dependency_overrides[
         get_db_session_factory
     ] = lambda: provider.session_factory
+    return provider
+
+
+def setup_supervisor(app: FastAPI, provider: DatabaseProvider) -> None:
+    settings = app.state.settings
+    supervisor.configure(
+        max_concurrent_starts=settings.activation_max_concurrent_starts,
+        backoff_base=settings.activation_restart_backoff,
+        backoff_max=settings.activation_restart_backoff_max,
+        lease=settings.activation_supervisor_lease,
+    )
+    supervision = (
+        provider.session_factory,
+        settings.deployment_type,
+        settings.server_name,
+        settings.port,
+    )
+
+    async def recover():
+        await supervisor.recover(*supervision)
+
+    async def keep_leases():
+        supervisor.keep_leases(
+            *supervision, recover=settings.activation_recover_on_startup
+        )
+
+    if settings.activation_recover_on_startup:
+        app.add_event_handler("startup", recover)
+    app.add_event_handler("startup", keep_leases)
+    app.add_event_handler("shutdown", supervisor.close)
+
+
+def setup_worker_pool(app: FastAPI) -> None:
+    settings = app.state.settings
+    if settings.deployment_type != "local" or settings.worker_pool_size <= 0:
+        return
+    if settings.workers > 1:
+        # A pooled worker may connect to another process than its own.
+        logger.warning("Worker pool is disabled with several workers")
+        return
+
+    workerpool.configure(settings.worker_pool_size, local_worker_command)
+    app.add_event_handler("startup", workerpool.start)
+    app.add_event_handler("shutdown", workerpool.close)
+
+
+def setup_containers(app: FastAPI) -> None:
+    settings = app.state.settings
+    containerclient.configure(settings.image_pull_policy)
+    app.add_event_handler("shutdown", containerclient.close)
+
+
+def setup_commands(app: FastAPI) -> None:
+    """Run commands sent by the other server processes."""
+    updatemanager.commands.update(
+        stop_activation=supervisor.stop_local,
+        cancel_job=jobengine.cancel,
+        invalidate_bootstrap=bootstrapcache.drop,
+    )
+
+
+def setup_job_engine(app: FastAPI) -> None:
+    settings = app.state.settings
+    jobengine.configure(
+        settings.job_workers,
+        queue_size=settings.job_queue_size,
+        timeout=settings.job_timeout,
+    )
+    app.add_event_handler("shutdown", jobengine.close)
+
+
+def setup_managers(app: FastAPI) -> None:
+    settings = app.state.settings
+    updatemanager.configure(
+        queue_size=settings.broadcast_queue_size,
+        overflow_policy=settings.broadcast_overflow_policy,
+        stdout_window=settings.stdout_coalesce_window,
+        stdout_max_bytes=settings.stdout_coalesce_bytes,
+        history_bytes=settings.broadcast_history_bytes,
+        history_pages=settings.broadcast_history_pages,
+        send_timeout=settings.broadcast_send_timeout,
+        heartbeat_interval=settings.broadcast_heartbeat_interval,
+        heartbeat_timeout=settings.broadcast_heartbeat_timeout,
+    )
+    bus = create_bus(settings.broadcast_backend, settings.database_url)
+
+    async def start_bus():
+        await updatemanager.start(bus)
+
+    app.add_event_handler("startup", start_bus)
+    app.add_event_handler("shutdown", updatemanager.close)
+
+    logsinks.configure(
+        flush_bytes=settings.activation_log_flush_bytes,
+        flush_interval=settings.activation_log_flush_interval,
+        storage=settings.activation_log_storage,
+        segment_bytes=settings.activation_log_segment_bytes,
+        max_bytes=settings.activation_log_max_bytes,
+    )
+    app.add_event_handler("shutdown", logsinks.flush)
+
+
+def setup_metrics(app: FastAPI) -> None:
+    settings = app.state.settings
+    if not metrics.is_multiprocess():
+        return
+
+    async def start_refresh():
+        metrics.callbackgauges.start(settings.metrics_refresh_interval)
+
+    app.add_event_handler("startup", start_refresh)
+    app.add_event_handler("shutdown", metrics.callbackgauges.close)
 
 
 def configure_logging(app):
@@ -87,7 +219,14 @@ def create_app() -> FastAPI:
     configure_logging(app)
     setup_cors(app)
     setup_routes(app)
-
-    setup_database(app)
+    setup_managers(app)
+
+    provider = setup_database(app)
+    setup_supervisor(app, provider)
+    setup_worker_pool(app)
+    setup_containers(app)
+    setup_job_engine(app)
+    setup_commands(app)
+    setup_metrics(app)
 
     return app
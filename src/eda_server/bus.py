@@ -0,0 +1,281 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Publish/subscribe backends carrying live page updates between processes.
+
+A bus delivers every message published by one server process to the
+``deliver`` callback of all the other processes, which forward it to
+their own websocket subscribers. Messages published by a process are
+never delivered back to it; the publisher delivers them locally.
+"""
+
+import asyncio
+import itertools
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+import sqlalchemy.engine
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "Bus",
+    "MemoryBus",
+    "PostgresBus",
+    "create_bus",
+)
+
+Deliver = Callable[[str, str], None]
+
+
+class Bus:
+    """Base class of update buses."""
+
+    # Whether other processes may have subscribers
+    shared = False
+
+    async def start(self, deliver: Deliver) -> None:
+        self.deliver = deliver
+
+    def publish(self, page: str, message: str) -> None:
+        """Queue a message for the other processes, without waiting."""
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBus(Bus):
+    """Bus of a server running as a single process.
+
+    Every subscriber lives in this process, so there is nothing to send.
+    """
+
+
+class PostgresBus(Bus):
+    r"""Bus over PostgreSQL LISTEN/NOTIFY.
+
+    Messages are published by a background task, so :meth:`publish` never
+    waits on the database, and sent in batches of up to ``batch_size``
+    notifications per round trip. A NOTIFY payload is limited to 8000
+    bytes, so larger messages are split into fragments that receivers
+    put back together. Each fragment carries the id of the publishing
+    process, the message number, the fragment index and count, and the
+    page::
+
+        <origin> <message> <index> <count> <page>\n<data>
+
+    Notifications only reach the process while its LISTEN connection is
+    open, so that connection is watched and opened again, listening on
+    the channel, as soon as it is lost. Losses that asyncpg does not see,
+    such as a connection silently dropped by the network, are caught by
+    querying it every ``health_check_interval`` seconds.
+    """
+
+    shared = True
+
+    # Leaves room for the header within the 8000 bytes NOTIFY limit.
+    FRAGMENT_SIZE = 7600
+
+    def __init__(
+        self,
+        database_url: str,
+        *,
+        channel: str = "eda_updates",
+        queue_size: int = 10000,
+        batch_size: int = 100,
+        max_partial: int = 1000,
+        health_check_interval: float = 30.0,
+    ):
+        url = sqlalchemy.engine.make_url(database_url)
+        self.dsn = url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        self.channel = channel
+        self.batch_size = batch_size
+        self.max_partial = max_partial
+        self.health_check_interval = health_check_interval
+        self.origin = uuid.uuid4().hex
+        self._message_ids = itertools.count()
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+        # Fragments received so far, by (origin, message id)
+        self._partial: Dict[Tuple[str, str], List[Optional[str]]] = (
+            OrderedDict()
+        )
+        self._listener: Optional[asyncpg.Connection] = None
+        self._publisher: Optional[asyncpg.Connection] = None
+        self._listener_lost = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        await self._connect_listener()
+        self._publisher = await asyncpg.connect(self.dsn)
+        self._tasks = [
+            asyncio.create_task(self._run(), name="update_bus"),
+            asyncio.create_task(self._listen(), name="update_bus_listener"),
+        ]
+
+    def publish(self, page: str, message: str) -> None:
+        try:
+            self._queue.put_nowait((page, message))
+        except asyncio.QueueFull:
+            logger.warning("Update bus queue is full, dropping %s", page)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._disconnect()
+
+    async def _connect_listener(self) -> None:
+        listener = await asyncpg.connect(self.dsn)
+        try:
+            await listener.add_listener(self.channel, self._on_notify)
+        except BaseException:
+            listener.terminate()
+            raise
+        listener.add_termination_listener(self._on_listener_lost)
+        self._listener = listener
+        # Termination listeners of the previous connection run later.
+        self._listener_lost.clear()
+
+    def _on_listener_lost(self, connection) -> None:
+        if connection is self._listener:
+            self._listener_lost.set()
+
+    async def _listener_alive(self) -> bool:
+        try:
+            await asyncio.wait_for(
+                self._listener.fetchval("SELECT 1"),
+                self.health_check_interval,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return False
+        return True
+
+    async def _disconnect(self) -> None:
+        for connection in (self._listener, self._publisher):
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        self._listener = self._publisher = None
+
+    def encode(self, page: str, message: str) -> List[str]:
+        """Split a message into NOTIFY payloads."""
+        data = message.encode()
+        chunks = []
+        start = 0
+        while True:
+            end = min(start + self.FRAGMENT_SIZE, len(data))
+            # Do not cut through a multi-byte character.
+            while end < len(data) and (data[end] & 0xC0) == 0x80:
+                end -= 1
+            chunks.append(data[start:end].decode())
+            if end >= len(data):
+                break
+            start = end
+        message_id = next(self._message_ids)
+        return [
+            f"{self.origin} {message_id} {index} {len(chunks)} {page}\n{chunk}"
+            for index, chunk in enumerate(chunks)
+        ]
+
+    def decode(self, payload: str) -> Optional[Tuple[str, str]]:
+        """Return the page and message once all fragments arrived."""
+        header, _, chunk = payload.partition("\n")
+        origin, message_id, index, count, page = header.split(" ", 4)
+        if origin == self.origin:
+            return None
+        index, count = int(index), int(count)
+        if count == 1:
+            return page, chunk
+
+        key = (origin, message_id)
+        fragments = self._partial.get(key)
+        if fragments is None:
+            fragments = self._partial[key] = [None] * count
+            if len(self._partial) > self.max_partial:
+                self._partial.popitem(last=False)
+        fragments[index] = chunk
+        if any(fragment is None for fragment in fragments):
+            return None
+        del self._partial[key]
+        return page, "".join(fragments)
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        try:
+            decoded = self.decode(payload)
+        except ValueError:
+            logger.warning("Update bus received a malformed notification")
+            return
+        if decoded is not None:
+            self.deliver(*decoded)
+
+    async def _listen(self) -> None:
+        """Open the LISTEN connection again whenever it is lost."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._listener_lost.wait(), self.health_check_interval
+                )
+            except asyncio.TimeoutError:
+                if await self._listener_alive():
+                    continue
+            logger.warning("Update bus listener lost, reconnecting")
+            self._listener.terminate()
+            delay = 1.0
+            while True:
+                try:
+                    await self._connect_listener()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception(
+                        "Failed to reconnect the update bus listener"
+                    )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.health_check_interval)
+
+    async def _run(self) -> None:
+        while True:
+            payloads = self.encode(*await self._queue.get())
+            while len(payloads) < self.batch_size and not self._queue.empty():
+                payloads.extend(self.encode(*self._queue.get_nowait()))
+            try:
+                if self._publisher.is_closed():
+                    self._publisher = await asyncpg.connect(self.dsn)
+                await self._publisher.executemany(
+                    "SELECT pg_notify($1, $2)",
+                    [(self.channel, payload) for payload in payloads],
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(
+                    "Failed to publish %d update notifications", len(payloads)
+                )
+
+
+def create_bus(backend: str, database_url: str) -> Bus:
+    if backend == "memory":
+        return MemoryBus()
+    if backend == "postgres":
+        return PostgresBus(database_url)
+    raise ValueError(f"Unknown broadcast backend: {backend}")
@@ -36,6 +36,79 @@ class Settings(BaseSettings):
     deployment_type: str = "docker"
     server_name: str = "localhost"
 
+    # Activation instances started at once, by the supervisor
+    activation_max_concurrent_starts: int = 4
+    # Delay before restarting an activation instance, doubled on each
+    # failure in a row, in seconds
+    activation_restart_backoff: float = 1.0
+    activation_restart_backoff_max: float = 300.0
+    # Restart activation instances left running when the server stopped,
+    # and those of server processes that are gone: their supervisor lease
+    # was not renewed for activation_supervisor_lease seconds.
+    activation_recover_on_startup: bool = True
+    activation_supervisor_lease: float = 30.0
+    # Rulebook workers started ahead of time for the local deployment,
+    # assigned to activation instances as they start. 0 disables the pool.
+    worker_pool_size: int = 0
+    # Activation output is written to the database once this many bytes
+    # are buffered, or after this many seconds at most.
+    activation_log_flush_bytes: int = 65536
+    activation_log_flush_interval: float = 1.0
+    # Where activation output is stored: "segments", compressed segments
+    # of at most activation_log_segment_bytes, or "large-object". Once
+    # the output of an activation instance exceeds activation_log_max_bytes
+    # its oldest segments are deleted; 0 keeps everything.
+    activation_log_storage: str = "segments"
+    activation_log_segment_bytes: int = 1048576
+    activation_log_max_bytes: int = 104857600
+    # When container activations pull their execution environment image:
+    # "always", "if-not-present" or "never".
+    image_pull_policy: str = "if-not-present"
+    # Playbook jobs run at most this many at a time; others wait in a
+    # queue of this size, submissions beyond it are refused. Jobs are
+    # stopped after the timeout in seconds, 0 means no timeout.
+    job_workers: int = 4
+    job_queue_size: int = 1000
+    job_timeout: float = 0
+
+    # Write-behind ingestion of job events received over /api/ws2; the
+    # batch size also applies to the events of playbook jobs.
+    ingest_batch_size: int = 500
+    ingest_flush_interval: float = 0.5
+    ingest_max_pending: int = 5000
+    ingest_credit_window: int = 1000
+
+    # Outbound queue of each UI websocket subscriber, and what to do when
+    # it is full: "drop-oldest", "drop-newest" or "disconnect".
+    broadcast_queue_size: int = 1000
+    broadcast_overflow_policy: str = "drop-oldest"
+    # Stdout broadcast to a page is merged for up to this many seconds or
+    # characters. A window of 0 sends every fragment as it comes.
+    stdout_coalesce_window: float = 0.1
+    stdout_coalesce_bytes: int = 65536
+    # Recent output of activation and job instance pages kept in memory,
+    # in characters per page, and replayed to new subscribers.
+    broadcast_history_bytes: int = 65536
+    broadcast_history_pages: int = 256
+    # UI websocket subscribers are evicted when a send takes longer than
+    # the send timeout. Multiplexed ones are pinged after the heartbeat
+    # interval and evicted after the heartbeat timeout without a reply.
+    broadcast_send_timeout: float = 10.0
+    broadcast_heartbeat_interval: float = 20.0
+    broadcast_heartbeat_timeout: float = 60.0
+    # Websocket protocol pings sent by the server, in seconds
+    ws_ping_interval: float = 20.0
+    ws_ping_timeout: float = 20.0
+    # Carries live updates and commands, such as stopping an activation
+    # instance or cancelling a job, between server processes: "memory"
+    # for a single process, "postgres" to run several workers.
+    broadcast_backend: str = "memory"
+    workers: int = 1
+    # With several workers, metrics computed from the state of each
+    # process are refreshed this often, in seconds, to be scraped from
+    # any of them.
+    metrics_refresh_interval: float = 5.0
+
     class Config:
         env_prefix = "EDA_"
         env_nested_delimiter = "__"
@@ -0,0 +1,168 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Docker client shared by container activations.
+
+A single client, and its connection pool, is used for every activation
+instead of one per container. Execution environment images are looked up
+once and their ids kept in memory, so that starting activations on an
+image already present does not go through the registry again.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+import aiodocker
+import aiodocker.exceptions
+
+from eda_server import metrics
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "PULL_POLICIES",
+    "ContainerClient",
+    "ImageNotPresentError",
+    "containerclient",
+)
+
+# "always" pulls the image on every start, "if-not-present" only when it
+# is missing locally and "never" fails to start when it is missing.
+PULL_POLICIES = ("always", "if-not-present", "never")
+
+IMAGE_PULLS = metrics.Counter(
+    "eda_image_pulls_total",
+    "Execution environment images pulled, by result.",
+    ["result"],
+)
+IMAGE_CACHE_HITS = metrics.Counter(
+    "eda_image_cache_hits_total",
+    "Container starts whose image was known to be present.",
+)
+
+
+class ImageNotPresentError(Exception):
+    """The image is missing and the pull policy forbids pulling it."""
+
+
+class ContainerClient:
+    """Long-lived Docker client with a cache of local images.
+
+    Concurrent pulls of the same image are coalesced, so that starting
+    many activations on one execution environment pulls it at most once.
+    """
+
+    def __init__(
+        self,
+        pull_policy: str = "if-not-present",
+        factory: Callable[[], aiodocker.Docker] = aiodocker.Docker,
+    ):
+        self._docker: Optional[aiodocker.Docker] = None
+        # Image id of each image reference known to be present
+        self.images: Dict[str, str] = {}
+        self._pulls: Dict[str, asyncio.Task] = {}
+        self.configure(pull_policy, factory)
+
+    def configure(
+        self,
+        pull_policy: str,
+        factory: Callable[[], aiodocker.Docker] = aiodocker.Docker,
+    ) -> None:
+        if pull_policy not in PULL_POLICIES:
+            raise ValueError(f"Unknown image pull policy: {pull_policy}")
+        self.pull_policy = pull_policy
+        self.factory = factory
+
+    @property
+    def docker(self) -> aiodocker.Docker:
+        # Created on first use, within the running event loop.
+        if self._docker is None:
+            self._docker = self.factory()
+        return self._docker
+
+    async def close(self) -> None:
+        tasks = list(self._pulls.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._docker is not None:
+            await self._docker.close()
+            self._docker = None
+        self.images.clear()
+
+    async def ensure_image(self, image: str) -> str:
+        """Make sure an image is present according to the pull policy.
+
+        Returns the image id.
+
+        :raises ImageNotPresentError: If the image is missing and the pull
+            policy is "never".
+        :raises aiodocker.exceptions.DockerError: If the pull fails.
+        """
+        if self.pull_policy == "always":
+            return await self._pull(image)
+
+        image_id = self.images.get(image)
+        if image_id is not None:
+            IMAGE_CACHE_HITS.inc()
+            return image_id
+        image_id = await self._inspect(image)
+        if image_id is not None:
+            return image_id
+        if self.pull_policy == "never":
+            raise ImageNotPresentError(
+                f"Image {image} is not present and the pull policy is never"
+            )
+        return await self._pull(image)
+
+    def forget(self, image: str) -> None:
+        """Drop an image from the cache, e.g. once it was found missing."""
+        self.images.pop(image, None)
+
+    async def _inspect(self, image: str) -> Optional[str]:
+        try:
+            info = await self.docker.images.inspect(image)
+        except aiodocker.exceptions.DockerError as e:
+            if e.status == 404:
+                return None
+            raise
+        self.images[image] = info["Id"]
+        return info["Id"]
+
+    async def _pull(self, image: str) -> str:
+        task = self._pulls.get(image)
+        if task is None:
+            task = asyncio.create_task(
+                self._do_pull(image), name=f"pull {image}"
+            )
+            self._pulls[image] = task
+            task.add_done_callback(lambda _: self._pulls.pop(image, None))
+        # A caller going away must not cancel the pull of the others.
+        return await asyncio.shield(task)
+
+    async def _do_pull(self, image: str) -> str:
+        logger.info("Pulling image %s", image)
+        try:
+            await self.docker.images.pull(image)
+            image_id = await self._inspect(image)
+        except Exception:
+            IMAGE_PULLS.labels(result="failure").inc()
+            self.forget(image)
+            raise
+        IMAGE_PULLS.labels(result="success").inc()
+        return image_id
+
+
+containerclient = ContainerClient()
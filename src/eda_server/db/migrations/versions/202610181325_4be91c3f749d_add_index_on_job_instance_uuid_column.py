@@ -0,0 +1,38 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add index on job_instance uuid column.
+
+Revision ID: 4be91c3f749d
+Revises: 4f5d3c60fbb8
+Create Date: 2026-10-18 13:25:05.640595+00:00
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4be91c3f749d"
+down_revision = "4f5d3c60fbb8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        op.f("ix_job_instance_uuid"), "job_instance", ["uuid"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_job_instance_uuid"), table_name="job_instance")
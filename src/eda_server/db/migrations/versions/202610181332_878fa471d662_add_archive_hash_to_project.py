@@ -0,0 +1,45 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add archive hash to project.
+
+Revision ID: 878fa471d662
+Revises: 4be91c3f749d
+Create Date: 2026-10-18 13:32:44.013736+00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "878fa471d662"
+down_revision = "4be91c3f749d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "project",
+        sa.Column(
+            "archive_hash",
+            sa.String(),
+            nullable=True,
+            comment="SHA-256 of the project archive stored in large_data_id.",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("project", "archive_hash")
@@ -0,0 +1,90 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add rule action index.
+
+Revision ID: 21963c2d96d8
+Revises: 878fa471d662
+Create Date: 2026-10-18 13:35:36.484629+00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "21963c2d96d8"
+down_revision = "878fa471d662"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rule_action",
+        sa.Column(
+            "id", sa.Integer(), sa.Identity(always=True), nullable=False
+        ),
+        sa.Column("rulebook_id", sa.Integer(), nullable=False),
+        sa.Column("ruleset_id", sa.Integer(), nullable=False),
+        sa.Column("rule_id", sa.Integer(), nullable=False),
+        sa.Column("action_type", sa.String(), nullable=False),
+        sa.Column(
+            "action_name",
+            sa.String(),
+            nullable=True,
+            comment="Name of the action target, e.g. the playbook to run.",
+        ),
+        sa.ForeignKeyConstraint(
+            ["rulebook_id"],
+            ["rulebook.id"],
+            name=op.f("fk_rule_action_rulebook_id"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["ruleset_id"],
+            ["ruleset.id"],
+            name=op.f("fk_rule_action_ruleset_id"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["rule_id"],
+            ["rule.id"],
+            name=op.f("fk_rule_action_rule_id"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_rule_action")),
+    )
+    op.create_index(
+        "ix_rule_action_rulebook_id_action_type_action_name",
+        "rule_action",
+        ["rulebook_id", "action_type", "action_name"],
+    )
+    op.execute("""
+        INSERT INTO rule_action (
+            rulebook_id, ruleset_id, rule_id, action_type, action_name
+        )
+        SELECT rs.rulebook_id, r.ruleset_id, r.id, a.key, a.value ->> 'name'
+        FROM rule r
+        JOIN ruleset rs ON rs.id = r.ruleset_id
+        CROSS JOIN LATERAL jsonb_each(r.action) a
+        WHERE jsonb_typeof(r.action) = 'object'
+        """)
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_rule_action_rulebook_id_action_type_action_name",
+        table_name="rule_action",
+    )
+    op.drop_table("rule_action")
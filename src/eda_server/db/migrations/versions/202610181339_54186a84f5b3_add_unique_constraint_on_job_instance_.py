@@ -0,0 +1,52 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add unique constraint on job instance event counter.
+
+Revision ID: 54186a84f5b3
+Revises: 21963c2d96d8
+Create Date: 2026-10-18 13:39:34.524716+00:00
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "54186a84f5b3"
+down_revision = "21963c2d96d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the first copy of events that were stored more than once.
+    op.execute("""
+        DELETE FROM job_instance_event a
+        USING job_instance_event b
+        WHERE a.job_uuid = b.job_uuid
+          AND a.counter = b.counter
+          AND a.id > b.id
+        """)
+    op.create_unique_constraint(
+        op.f("uq_job_instance_event_job_uuid_counter"),
+        "job_instance_event",
+        ["job_uuid", "counter"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        op.f("uq_job_instance_event_job_uuid_counter"),
+        "job_instance_event",
+        type_="unique",
+    )
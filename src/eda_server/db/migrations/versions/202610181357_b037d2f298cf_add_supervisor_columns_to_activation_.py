@@ -0,0 +1,90 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add supervisor columns to activation_instance.
+
+Revision ID: b037d2f298cf
+Revises: 54186a84f5b3
+Create Date: 2026-10-18 13:57:37.786060+00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "b037d2f298cf"
+down_revision = "54186a84f5b3"
+branch_labels = None
+depends_on = None
+
+
+restart_policy_enum = postgresql.ENUM(
+    "always",
+    "on-failure",
+    "never",
+    name="restart_policy_enum",
+    create_type=False,
+)
+
+
+def upgrade() -> None:
+    op.add_column(
+        "activation_instance",
+        sa.Column(
+            "restart_policy",
+            restart_policy_enum,
+            server_default="on-failure",
+            nullable=False,
+        ),
+    )
+    op.add_column(
+        "activation_instance", sa.Column("status", sa.String(), nullable=True)
+    )
+    op.add_column(
+        "activation_instance",
+        sa.Column(
+            "restart_count", sa.Integer(), server_default="0", nullable=False
+        ),
+    )
+    op.add_column(
+        "activation_instance",
+        sa.Column("restarted_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.add_column(
+        "activation_instance",
+        sa.Column("exit_code", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "activation_instance",
+        sa.Column("exited_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index(
+        op.f("ix_activation_instance_status"),
+        "activation_instance",
+        ["status"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_activation_instance_status"),
+        table_name="activation_instance",
+    )
+    op.drop_column("activation_instance", "exited_at")
+    op.drop_column("activation_instance", "exit_code")
+    op.drop_column("activation_instance", "restarted_at")
+    op.drop_column("activation_instance", "restart_count")
+    op.drop_column("activation_instance", "status")
+    op.drop_column("activation_instance", "restart_policy")
@@ -0,0 +1,65 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add activation_instance_log_segment table.
+
+Revision ID: ff60606ae9ca
+Revises: b037d2f298cf
+Create Date: 2026-10-18 14:11:56.257366+00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "ff60606ae9ca"
+down_revision = "b037d2f298cf"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "activation_instance_log_segment",
+        sa.Column(
+            "id", sa.Integer(), sa.Identity(always=True), nullable=False
+        ),
+        sa.Column("activation_instance_id", sa.Integer(), nullable=False),
+        sa.Column("segment", sa.Integer(), nullable=False),
+        sa.Column("byte_start", sa.BigInteger(), nullable=False),
+        sa.Column("byte_count", sa.Integer(), nullable=False),
+        sa.Column("line_start", sa.BigInteger(), nullable=False),
+        sa.Column("line_count", sa.Integer(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["activation_instance_id"],
+            ["activation_instance.id"],
+            name=op.f(
+                "fk_activation_instance_log_segment_activation_instance_id"
+            ),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint(
+            "id", name=op.f("pk_activation_instance_log_segment")
+        ),
+        sa.UniqueConstraint(
+            "activation_instance_id",
+            "segment",
+            name="uq_activation_instance_log_segment",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("activation_instance_log_segment")
@@ -0,0 +1,55 @@
+#  Copyright 2026 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Add supervisor lease to activation_instance.
+
+Revision ID: 00ff777e6ce3
+Revises: ff60606ae9ca
+Create Date: 2026-10-18 14:34:19.166634+00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "00ff777e6ce3"
+down_revision = "ff60606ae9ca"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "activation_instance",
+        sa.Column(
+            "supervisor_id",
+            sa.String(),
+            nullable=True,
+            comment="Server process supervising the activation instance.",
+        ),
+    )
+    op.add_column(
+        "activation_instance",
+        sa.Column(
+            "supervised_at",
+            sa.DateTime(timezone=True),
+            nullable=True,
+            comment="Last renewal of the supervisor lease.",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("activation_instance", "supervised_at")
+    op.drop_column("activation_instance", "supervisor_id")
@@ -13,6 +13,8 @@
 #  limitations under the License.
 
 from .activation import (
+    activation_instance_log_chunks,
+    activation_instance_log_segments,
     activation_instance_logs,
     activation_instances,
     activations,
@@ -28,7 +30,7 @@ from .job import (
     jobs,
 )
 from .project import extra_vars, playbooks, projects
-from .rulebook import audit_rules, rulebooks, rules, rulesets
+from .rulebook import audit_rules, rule_actions, rulebooks, rules, rulesets
 
 __all__ = (
     # base
@@ -43,6 +45,8 @@ __all__ = (
     "activations",
     "activation_instances",
     "activation_instance_logs",
+    "activation_instance_log_segments",
+    "activation_instance_log_chunks",
     # inventory
     "inventories",
     # job
@@ -58,6 +62,7 @@ __all__ = (
     # rulebook
     "rulebooks",
     "rules",
+    "rule_actions",
     "audit_rules",
     "rulesets",
 )
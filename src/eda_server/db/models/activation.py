@@ -24,6 +24,8 @@ __all__ = (
     "activations",
     "activation_instances",
     "activation_instance_logs",
+    "activation_instance_log_segments",
+    "activation_instance_log_chunks",
 )
 
 
@@ -33,6 +35,16 @@ class RestartPolicy(str, Enum):
     NEVER = "never"
 
 
+class ActivationStatus(str, Enum):
+    STARTING = "starting"
+    RUNNING = "running"
+    # Waiting to be started again after exiting
+    RESTARTING = "restarting"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STOPPED = "stopped"
+
+
 activations = sa.Table(
     "activation",
     metadata,
@@ -131,6 +143,38 @@ activation_instances = sa.Table(
         sa.ForeignKey("project.id", ondelete="CASCADE"),
         nullable=True,
     ),
+    sa.Column(
+        "restart_policy",
+        sa.Enum(
+            RestartPolicy,
+            name="restart_policy_enum",
+            values_callable=lambda x: [e.value for e in x],
+        ),
+        default=RestartPolicy.ON_FAILURE,
+        server_default=RestartPolicy.ON_FAILURE.value,
+        nullable=False,
+    ),
+    sa.Column("status", sa.String, index=True),
+    sa.Column(
+        "restart_count",
+        sa.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    ),
+    sa.Column("restarted_at", sa.DateTime(timezone=True)),
+    sa.Column("exit_code", sa.Integer),
+    sa.Column("exited_at", sa.DateTime(timezone=True)),
+    sa.Column(
+        "supervisor_id",
+        sa.String,
+        comment="Server process supervising the activation instance.",
+    ),
+    sa.Column(
+        "supervised_at",
+        sa.DateTime(timezone=True),
+        comment="Last renewal of the supervisor lease.",
+    ),
 )
 
 
@@ -150,3 +194,60 @@ activation_instance_logs = sa.Table(
     sa.Column("line_number", sa.Integer),
     sa.Column("log", sa.String),
 )
+
+
+# Output of an activation instance, as zlib compressed segments of at most
+# a configured size. Offsets and line numbers are counted from the start
+# of the output, so they remain valid once older segments are deleted.
+activation_instance_log_segments = sa.Table(
+    "activation_instance_log_segment",
+    metadata,
+    sa.Column(
+        "id",
+        sa.Integer,
+        sa.Identity(always=True),
+        primary_key=True,
+    ),
+    sa.Column(
+        "activation_instance_id",
+        sa.ForeignKey("activation_instance.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    sa.Column("segment", sa.Integer, nullable=False),
+    sa.Column("byte_start", sa.BigInteger, nullable=False),
+    sa.Column("byte_count", sa.Integer, nullable=False),
+    sa.Column("line_start", sa.BigInteger, nullable=False),
+    sa.Column("line_count", sa.Integer, nullable=False),
+    sa.Column("data", sa.LargeBinary, nullable=False),
+    # Named explicitly, the generated name exceeds the identifier limit.
+    sa.UniqueConstraint(
+        "activation_instance_id",
+        "segment",
+        name="uq_activation_instance_log_segment",
+    ),
+)
+
+
+# Output appended to the open segment of an activation instance, the one
+# after its last segment, kept uncompressed until the segment is full.
+activation_instance_log_chunks = sa.Table(
+    "activation_instance_log_chunk",
+    metadata,
+    sa.Column(
+        "id",
+        sa.Integer,
+        sa.Identity(always=True),
+        primary_key=True,
+    ),
+    sa.Column(
+        "activation_instance_id",
+        sa.ForeignKey("activation_instance.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    ),
+    sa.Column("segment", sa.Integer, nullable=False),
+    sa.Column("byte_start", sa.BigInteger, nullable=False),
+    sa.Column("line_start", sa.BigInteger, nullable=False),
+    sa.Column("line_count", sa.Integer, nullable=False),
+    sa.Column("data", sa.LargeBinary, nullable=False),
+)
@@ -46,7 +46,7 @@ job_instances = sa.Table(
         sa.Identity(always=True),
         primary_key=True,
     ),
-    sa.Column("uuid", postgresql.UUID),
+    sa.Column("uuid", postgresql.UUID, index=True),
     sa.Column("action", sa.String),
     sa.Column("name", sa.String),
     sa.Column("ruleset", sa.String),
@@ -87,6 +87,9 @@ job_instance_events = sa.Table(
     sa.Column("stdout", sa.String),
     sa.Column("type", sa.String),
     sa.Column("created_at", sa.DateTime(timezone=True)),
+    # Workers may replay events after a reconnect, the same event must
+    # only be stored once.
+    sa.UniqueConstraint("job_uuid", "counter"),
 )
 
 
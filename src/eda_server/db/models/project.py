@@ -63,6 +63,12 @@ projects = sa.Table(
         nullable=True,
         comment="OID of large object containing project files.",
     ),
+    sa.Column(
+        "archive_hash",
+        sa.String,
+        nullable=True,
+        comment="SHA-256 of the project archive stored in large_data_id.",
+    ),
 )
 
 
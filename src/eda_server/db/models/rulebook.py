@@ -22,6 +22,7 @@ __all__ = (
     "rulebooks",
     "rulesets",
     "rules",
+    "rule_actions",
     "audit_rules",
 )
 
@@ -111,6 +112,44 @@ rules = sa.Table(
     sa.Column("action", postgresql.JSONB(none_as_null=True), nullable=False),
 )
 
+rule_actions = sa.Table(
+    "rule_action",
+    metadata,
+    sa.Column(
+        "id",
+        sa.Integer,
+        sa.Identity(always=True),
+        primary_key=True,
+    ),
+    sa.Column(
+        "rulebook_id",
+        sa.ForeignKey("rulebook.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    sa.Column(
+        "ruleset_id",
+        sa.ForeignKey("ruleset.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    sa.Column(
+        "rule_id",
+        sa.ForeignKey("rule.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    sa.Column("action_type", sa.String, nullable=False),
+    sa.Column(
+        "action_name",
+        sa.String,
+        comment="Name of the action target, e.g. the playbook to run.",
+    ),
+    sa.Index(
+        "ix_rule_action_rulebook_id_action_type_action_name",
+        "rulebook_id",
+        "action_type",
+        "action_name",
+    ),
+)
+
 audit_rules = sa.Table(
     "audit_rule",
     metadata,
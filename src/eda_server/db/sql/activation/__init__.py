@@ -0,0 +1,373 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Query builders and executors for activation instances."""
+
+import datetime
+from typing import List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server.db import models
+from eda_server.db.models.activation import ActivationStatus, RestartPolicy
+
+# Statuses of activation instances a supervisor is responsible for
+ACTIVE_STATUSES = (
+    ActivationStatus.STARTING.value,
+    ActivationStatus.RUNNING.value,
+    ActivationStatus.RESTARTING.value,
+)
+
+
+def build_activation_instance_bootstrap_query(
+    activation_instance_id: int,
+) -> sa.sql.Select:
+    activation_instance = models.activation_instances
+    return (
+        sa.select(
+            activation_instance.c.id,
+            activation_instance.c.project_id,
+            activation_instance.c.rulebook_id,
+            activation_instance.c.inventory_id,
+            activation_instance.c.extra_var_id,
+            models.projects.c.large_data_id.label("project_large_data_id"),
+            models.projects.c.archive_hash.label("project_archive_hash"),
+            models.rulebooks.c.rulesets,
+            models.inventories.c.inventory,
+            models.extra_vars.c.extra_var,
+        )
+        .select_from(activation_instance)
+        .outerjoin(
+            models.projects,
+            models.projects.c.id == activation_instance.c.project_id,
+        )
+        .outerjoin(
+            models.rulebooks,
+            models.rulebooks.c.id == activation_instance.c.rulebook_id,
+        )
+        .outerjoin(
+            models.inventories,
+            models.inventories.c.id == activation_instance.c.inventory_id,
+        )
+        .outerjoin(
+            models.extra_vars,
+            models.extra_vars.c.id == activation_instance.c.extra_var_id,
+        )
+        .where(activation_instance.c.id == activation_instance_id)
+    )
+
+
+async def get_activation_instance_bootstrap(
+    db: AsyncSession, activation_instance_id: int
+) -> Optional[sa.engine.Row]:
+    """Return everything a rulebook worker needs to start, in one query."""
+    query = build_activation_instance_bootstrap_query(activation_instance_id)
+    return (await db.execute(query)).one_or_none()
+
+
+async def claim_activation_instances_to_recover(
+    db: AsyncSession, supervisor_id: str, lease: float
+) -> List[int]:
+    """Claim activation instances no longer supervised, for restart.
+
+    Instances starting, running or waiting to restart whose supervisor
+    lease was not renewed for ``lease`` seconds, left behind by a server
+    process that is gone, are taken over by ``supervisor_id``. They are
+    marked as restarting and returned, unless their restart policy is
+    "never", in which case they are marked as failed.
+
+    Claimed instances hold a fresh lease, and rows being claimed by
+    another process are skipped, so an instance is claimed once.
+    """
+    activation_instance = models.activation_instances
+    claimable = (
+        sa.select(activation_instance.c.id)
+        .where(activation_instance.c.status.in_(ACTIVE_STATUSES))
+        .where(
+            sa.or_(
+                activation_instance.c.supervised_at.is_(None),
+                activation_instance.c.supervised_at
+                < sa.func.now() - datetime.timedelta(seconds=lease),
+            )
+        )
+        .with_for_update(skip_locked=True)
+    )
+    never = activation_instance.c.restart_policy == RestartPolicy.NEVER
+    result = await db.execute(
+        sa.update(activation_instance)
+        .where(activation_instance.c.id.in_(claimable.scalar_subquery()))
+        .values(
+            status=sa.case(
+                (never, ActivationStatus.FAILED.value),
+                else_=ActivationStatus.RESTARTING.value,
+            ),
+            supervisor_id=supervisor_id,
+            supervised_at=sa.func.now(),
+        )
+        .returning(activation_instance.c.id, never.label("never"))
+    )
+    return [row.id for row in result if not row.never]
+
+
+async def stop_activation_instance(
+    db: AsyncSession, activation_instance_id: int
+) -> None:
+    """Mark an activation instance as stopped, unless it is over."""
+    activation_instance = models.activation_instances
+    await db.execute(
+        sa.update(activation_instance)
+        .where(activation_instance.c.id == activation_instance_id)
+        .where(activation_instance.c.status.in_(ACTIVE_STATUSES))
+        .values(status=ActivationStatus.STOPPED.value)
+    )
+
+
+async def renew_supervisor_lease(
+    db: AsyncSession, supervisor_id: str, activation_instance_ids: List[int]
+) -> None:
+    activation_instance = models.activation_instances
+    await db.execute(
+        sa.update(activation_instance)
+        .where(activation_instance.c.id.in_(activation_instance_ids))
+        .where(activation_instance.c.supervisor_id == supervisor_id)
+        .values(supervised_at=sa.func.now())
+    )
+
+
+async def release_supervisor_lease(
+    db: AsyncSession, supervisor_id: str
+) -> None:
+    """Let activation instances of ``supervisor_id`` be claimed at once."""
+    activation_instance = models.activation_instances
+    await db.execute(
+        sa.update(activation_instance)
+        .where(activation_instance.c.supervisor_id == supervisor_id)
+        .values(supervisor_id=None, supervised_at=None)
+    )
+
+
+async def list_activation_instance_run_data(
+    db: AsyncSession, activation_instance_ids: List[int]
+) -> List[sa.engine.Row]:
+    """Return what is needed to start each activation instance."""
+    activation_instance = models.activation_instances
+    query = (
+        sa.select(
+            activation_instance.c.id,
+            activation_instance.c.large_data_id,
+            activation_instance.c.execution_environment,
+            activation_instance.c.working_directory,
+            activation_instance.c.restart_policy,
+            models.rulebooks.c.rulesets,
+            models.inventories.c.inventory,
+            models.extra_vars.c.extra_var,
+        )
+        .select_from(activation_instance)
+        .outerjoin(
+            models.rulebooks,
+            models.rulebooks.c.id == activation_instance.c.rulebook_id,
+        )
+        .outerjoin(
+            models.inventories,
+            models.inventories.c.id == activation_instance.c.inventory_id,
+        )
+        .outerjoin(
+            models.extra_vars,
+            models.extra_vars.c.id == activation_instance.c.extra_var_id,
+        )
+        .where(activation_instance.c.id.in_(activation_instance_ids))
+        .order_by(activation_instance.c.id)
+    )
+    return (await db.execute(query)).all()
+
+
+async def get_last_log_segment(
+    db: AsyncSession, activation_instance_id: int
+) -> Optional[sa.engine.Row]:
+    """Return the most recent log segment of an activation instance."""
+    segments = models.activation_instance_log_segments
+    query = (
+        sa.select(segments)
+        .where(segments.c.activation_instance_id == activation_instance_id)
+        .order_by(segments.c.segment.desc())
+        .limit(1)
+    )
+    return (await db.execute(query)).one_or_none()
+
+
+async def upsert_log_segment(db: AsyncSession, **values) -> None:
+    """Insert a sealed log segment, or replace it."""
+    segments = models.activation_instance_log_segments
+    query = postgresql.insert(segments).values(**values)
+    query = query.on_conflict_do_update(
+        constraint="uq_activation_instance_log_segment",
+        set_={
+            "byte_count": query.excluded.byte_count,
+            "line_count": query.excluded.line_count,
+            "data": query.excluded.data,
+        },
+    )
+    await db.execute(query)
+
+
+async def delete_log_segments_before(
+    db: AsyncSession, activation_instance_id: int, byte_offset: int
+) -> None:
+    """Delete the log segments ending at or before ``byte_offset``."""
+    segments = models.activation_instance_log_segments
+    await db.execute(
+        sa.delete(segments)
+        .where(segments.c.activation_instance_id == activation_instance_id)
+        .where(segments.c.byte_start + segments.c.byte_count <= byte_offset)
+    )
+
+
+async def list_log_segments(
+    db: AsyncSession, activation_instance_id: int
+) -> List[sa.engine.Row]:
+    """Return the index of the log segments of an activation instance."""
+    segments = models.activation_instance_log_segments
+    query = (
+        sa.select(
+            segments.c.segment,
+            segments.c.byte_start,
+            segments.c.byte_count,
+            segments.c.line_start,
+            segments.c.line_count,
+        )
+        .where(segments.c.activation_instance_id == activation_instance_id)
+        .order_by(segments.c.segment)
+    )
+    return (await db.execute(query)).all()
+
+
+async def get_log_segments_data(
+    db: AsyncSession, activation_instance_id: int, segment_numbers: List[int]
+) -> List[sa.engine.Row]:
+    """Return the compressed data of the given log segments, in order."""
+    segments = models.activation_instance_log_segments
+    query = (
+        sa.select(segments.c.segment, segments.c.data)
+        .where(segments.c.activation_instance_id == activation_instance_id)
+        .where(segments.c.segment.in_(segment_numbers))
+        .order_by(segments.c.segment)
+    )
+    return (await db.execute(query)).all()
+
+
+async def insert_log_chunk(db: AsyncSession, **values) -> None:
+    await db.execute(
+        sa.insert(models.activation_instance_log_chunks).values(**values)
+    )
+
+
+async def delete_log_chunks(
+    db: AsyncSession, activation_instance_id: int, segment: int
+) -> None:
+    """Delete the chunks of a log segment once it is stored whole."""
+    chunks = models.activation_instance_log_chunks
+    await db.execute(
+        sa.delete(chunks)
+        .where(chunks.c.activation_instance_id == activation_instance_id)
+        .where(chunks.c.segment == segment)
+    )
+
+
+async def list_log_chunks(
+    db: AsyncSession, activation_instance_id: int
+) -> List[sa.engine.Row]:
+    """Return the chunks of the open log segment, in order."""
+    chunks = models.activation_instance_log_chunks
+    query = (
+        sa.select(
+            chunks.c.segment,
+            chunks.c.byte_start,
+            chunks.c.line_start,
+            chunks.c.data,
+        )
+        .where(chunks.c.activation_instance_id == activation_instance_id)
+        .order_by(chunks.c.byte_start)
+    )
+    return (await db.execute(query)).all()
+
+
+async def get_open_log_segment(
+    db: AsyncSession, activation_instance_id: int
+) -> Optional[sa.engine.Row]:
+    """Return the index entry of the open log segment, from its chunks."""
+    chunks = models.activation_instance_log_chunks
+    query = (
+        sa.select(
+            chunks.c.segment,
+            sa.func.min(chunks.c.byte_start).label("byte_start"),
+            sa.func.sum(sa.func.length(chunks.c.data)).label("byte_count"),
+            sa.func.min(chunks.c.line_start).label("line_start"),
+            sa.func.sum(chunks.c.line_count).label("line_count"),
+        )
+        .where(chunks.c.activation_instance_id == activation_instance_id)
+        .group_by(chunks.c.segment)
+        .order_by(chunks.c.segment.desc())
+        .limit(1)
+    )
+    return (await db.execute(query)).one_or_none()
+
+
+async def get_log_chunks_data(
+    db: AsyncSession, activation_instance_id: int, segment: int
+) -> List[bytes]:
+    """Return the data of the chunks of a log segment, in order."""
+    chunks = models.activation_instance_log_chunks
+    query = (
+        sa.select(chunks.c.data)
+        .where(chunks.c.activation_instance_id == activation_instance_id)
+        .where(chunks.c.segment == segment)
+        .order_by(chunks.c.byte_start)
+    )
+    return (await db.scalars(query)).all()
+
+
+async def list_large_object_windows(
+    db: AsyncSession, oid: int, length: int, window: int
+) -> List[sa.engine.Row]:
+    """Return the offset and number of lines of each window of a large object.
+
+    Newlines are counted by the database, the data itself is not fetched.
+    """
+    if length <= 0:
+        return []
+    byte_start = sa.func.generate_series(
+        0, length - 1, window, type_=sa.BigInteger
+    ).column_valued("byte_start")
+    # The escape encoding keeps newlines as they are.
+    data = sa.func.encode(sa.func.lo_get(oid, byte_start, window), "escape")
+    query = sa.select(
+        byte_start,
+        (
+            sa.func.length(data)
+            - sa.func.length(sa.func.replace(data, "\n", ""))
+        ).label("line_count"),
+    ).order_by(byte_start)
+    return (await db.execute(query)).all()
+
+
+async def read_large_object(
+    db: AsyncSession, oid: int, offset: int, length: int
+) -> bytes:
+    """Return ``length`` bytes of a large object from ``offset``."""
+    query = sa.select(
+        sa.func.lo_get(oid, offset, length, type_=sa.LargeBinary)
+    )
+    return await db.scalar(query) or b""
@@ -703,8 +703,74 @@ async def insert_rulebook_related_data(
         for rsid, rsdata in zip(ruleset_ids, rulebook_data)
         for rule in rsdata["rules"]
     ]
-    query = sa.insert(models.rules).values(rule_values)
-    await db.execute(query)
+    query = (
+        sa.insert(models.rules)
+        .returning(models.rules.c.id)
+        .values(rule_values)
+    )
+    rule_ids = (await db.scalars(query)).all()
+
+    rule_action_values = [
+        {
+            "rulebook_id": rulebook_id,
+            "ruleset_id": rule["ruleset_id"],
+            "rule_id": rule_id,
+            "action_type": action_type,
+            "action_name": action_name,
+        }
+        for rule_id, rule in zip(rule_ids, rule_values)
+        for action_type, action_name in get_rule_action_keys(rule["action"])
+    ]
+    if rule_action_values:
+        await db.execute(
+            sa.insert(models.rule_actions).values(rule_action_values)
+        )
+
+
+def get_rule_action_keys(action) -> List[Tuple[str, Optional[str]]]:
+    """Return the (action type, target name) pairs of a rule action."""
+    if not isinstance(action, dict):
+        return []
+    return [
+        (
+            action_type,
+            target.get("name") if isinstance(target, dict) else None,
+        )
+        for action_type, target in action.items()
+    ]
+
+
+async def get_activation_instance_rule_actions(
+    db: AsyncSession,
+    activation_instance_id: int,
+    action_type: str,
+    action_name: str,
+) -> List[sa.engine.Row]:
+    """Return the rules of an activation instance firing the given action."""
+    query = (
+        sa.select(
+            models.rule_actions.c.ruleset_id,
+            models.rule_actions.c.rule_id,
+            models.rules.c.name,
+            models.rules.c.action.label("definition"),
+        )
+        .join(
+            models.rules,
+            models.rules.c.id == models.rule_actions.c.rule_id,
+        )
+        .join(
+            models.activation_instances,
+            models.activation_instances.c.rulebook_id
+            == models.rule_actions.c.rulebook_id,
+        )
+        .where(
+            models.activation_instances.c.id == activation_instance_id,
+            models.rule_actions.c.action_type == action_type,
+            models.rule_actions.c.action_name == action_name,
+        )
+        .order_by(models.rule_actions.c.rule_id)
+    )
+    return (await db.execute(query)).all()
 
 
 async def import_rulebook_file(
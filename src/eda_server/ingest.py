@@ -0,0 +1,434 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Write-behind ingestion of events sent by rulebook workers."""
+
+import asyncio
+import contextlib
+import logging
+import time
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import sqlalchemy.exc
+import sqlalchemy.orm
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server import metrics
+from eda_server.db import models
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "CreditWindow",
+    "IngestContext",
+    "JobEventBuffer",
+    "insert_job_events",
+    "store_job_events",
+)
+
+# Job event row, optional host row and the monotonic time it was queued
+PendingEvent = Tuple[dict, Optional[dict], float]
+FlushCallback = Callable[[List[dict], bool], Awaitable[None]]
+
+# NOTE: Statements are built once so that the compiled form is reused and
+#   asyncpg keeps them prepared on each pooled connection.
+# Events are keyed on (job_uuid, counter): replayed events are skipped,
+# and only the keys of newly stored events are returned.
+INSERT_JOB_INSTANCE_EVENT = (
+    postgresql.insert(models.job_instance_events)
+    .on_conflict_do_nothing(index_elements=["job_uuid", "counter"])
+    .returning(
+        models.job_instance_events.c.job_uuid,
+        models.job_instance_events.c.counter,
+    )
+)
+INSERT_JOB_INSTANCE_HOST = insert(models.job_instance_hosts)
+
+# The database cannot be reached, writing fewer events does not help.
+UNAVAILABLE_ERRORS = (
+    sqlalchemy.exc.OperationalError,
+    sqlalchemy.exc.InterfaceError,
+    OSError,
+)
+
+INGEST_FLUSH_EVENTS = metrics.Histogram(
+    "eda_ingest_flush_events",
+    "Number of job events written per flush.",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+INGEST_FLUSH_SECONDS = metrics.Histogram(
+    "eda_ingest_flush_seconds",
+    "Time spent writing a batch of job events.",
+)
+INGEST_DROPPED_EVENTS = metrics.Counter(
+    "eda_ingest_dropped_events_total",
+    "Job events dropped because they failed to be written.",
+)
+
+
+async def insert_job_events(
+    db: AsyncSession, events: List[Tuple[dict, Optional[dict]]]
+) -> int:
+    """Insert job events and their host rows, skipping stored events.
+
+    A host row is only inserted along with a newly stored event, so that
+    replaying events does not duplicate host statuses either. Returns
+    the number of events stored.
+    """
+    inserted = (
+        await db.execute(
+            INSERT_JOB_INSTANCE_EVENT.values([event for event, _ in events])
+        )
+    ).all()
+    stored = {(str(job_uuid), counter) for job_uuid, counter in inserted}
+    hosts = []
+    for event, host in events:
+        key = (str(event["job_uuid"]), event["counter"])
+        if key in stored:
+            # Only the first copy of an event in the batch was stored.
+            if event["counter"] is not None:
+                stored.discard(key)
+            if host is not None:
+                hosts.append(host)
+    if hosts:
+        await db.execute(INSERT_JOB_INSTANCE_HOST.values(hosts))
+    return len(inserted)
+
+
+async def store_job_events(
+    db_session_factory: Callable,
+    events: List[Tuple[dict, Optional[dict]]],
+) -> List[Tuple[dict, Optional[dict]]]:
+    """Write job events, returning those that could not be written.
+
+    The events are written in a single transaction, retried once. If the
+    retry fails too because of the data, the events are written in
+    halves, and the halves that fail are split again, down to single
+    events. Only the events that fail on their own are dropped.
+    Rewriting events is safe since stored events are skipped.
+    """
+    error = None
+    for _ in range(2):
+        try:
+            await _store_job_events(db_session_factory, events)
+            return []
+        except Exception as e:
+            error = e
+    if len(events) == 1 or isinstance(error, UNAVAILABLE_ERRORS):
+        logger.error(
+            "Failed to write %d job events",
+            len(events),
+            exc_info=(type(error), error, error.__traceback__),
+        )
+        return events
+    logger.warning(
+        "Failed to write %d job events, writing them in smaller batches",
+        len(events),
+        exc_info=(type(error), error, error.__traceback__),
+    )
+    return await _store_job_events_split(db_session_factory, events)
+
+
+async def _store_job_events_split(
+    db_session_factory: Callable,
+    events: List[Tuple[dict, Optional[dict]]],
+) -> List[Tuple[dict, Optional[dict]]]:
+    middle = len(events) // 2
+    dropped = []
+    for part in (events[:middle], events[middle:]):
+        try:
+            await _store_job_events(db_session_factory, part)
+        except Exception:
+            if len(part) > 1:
+                dropped.extend(
+                    await _store_job_events_split(db_session_factory, part)
+                )
+                continue
+            event, _ = part[0]
+            logger.exception(
+                "Failed to write event %s of job %s",
+                event.get("counter"),
+                event.get("job_uuid"),
+            )
+            dropped.extend(part)
+    return dropped
+
+
+async def _store_job_events(
+    db_session_factory: Callable, events: List[Tuple[dict, Optional[dict]]]
+) -> None:
+    async with db_session_factory() as db:
+        await insert_job_events(db, events)
+        await db.commit()
+
+
+class IngestContext:
+    """Database session scoped to a single rulebook worker connection.
+
+    A session is opened on first use and kept for the life of the worker
+    socket, and access to it is serialized, since a session must not be
+    used concurrently. The transaction left open by a handler is ended
+    once it returns, which hands the connection back to the pool:
+    workers may stay connected for weeks, and must neither hold a pooled
+    connection nor sit idle in a transaction. Statements stay prepared
+    on each pooled connection.
+
+    If an error occurs while the session is in use, the session is
+    discarded and a new one is opened on next use.
+    """
+
+    def __init__(self, db_session_factory: sqlalchemy.orm.sessionmaker):
+        self.db_session_factory = db_session_factory
+        self._db: Optional[AsyncSession] = None
+        self._lock = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        async with self._lock:
+            if self._db is None:
+                self._db = self.db_session_factory()
+            try:
+                yield self._db
+                # Handlers commit what they write, this only ends reads.
+                await self._db.rollback()
+            except Exception:
+                await self._discard()
+                raise
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._discard()
+
+    async def _discard(self) -> None:
+        db, self._db = self._db, None
+        try:
+            if db is not None:
+                await db.close()
+        except Exception:
+            logger.exception("Failed to close ingest database session")
+
+
+class JobEventBuffer:
+    """Per-connection write-behind buffer for job instance events.
+
+    ``db_session_factory`` is called for every write and must return an
+    async context manager yielding a session, e.g. a ``sessionmaker`` or
+    :meth:`IngestContext.session`.
+
+    Events are kept in memory and written with multi-row inserts once
+    ``batch_size`` events are pending or every ``flush_interval`` seconds.
+    The buffer is bounded by ``max_pending``: when it is full, :meth:`add`
+    waits for the background flush to make room, which in turn stops the
+    caller from reading more messages off the socket.
+
+    ``on_flush``, if given, is awaited after each batch with the events
+    of the batch that were written, and then with those that were dropped
+    if any, along with whether they were written.
+
+    :meth:`close` must be called when the connection goes away, it writes
+    every pending event before returning.
+    """
+
+    def __init__(
+        self,
+        db_session_factory: Callable,
+        *,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        max_pending: int = 5000,
+        on_flush: Optional[FlushCallback] = None,
+    ):
+        self.db_session_factory = db_session_factory
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+
+        self._pending: List[PendingEvent] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest pending event has been waiting."""
+        if not self._pending:
+            return 0.0
+        return time.monotonic() - self._pending[0][2]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "pending": self.pending,
+            "lag": self.lag,
+        }
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(
+                self._run(), name="job_event_buffer"
+            )
+
+    async def add(self, event: dict, host: Optional[dict] = None) -> None:
+        """Queue a ``job_instance_event`` row and an optional host row."""
+        if self._closed:
+            raise RuntimeError("Job event buffer is closed.")
+        if len(self._pending) >= self.max_pending:
+            async with self._drained:
+                self._wakeup.set()
+                await self._drained.wait_for(
+                    lambda: len(self._pending) < self.max_pending
+                )
+        self._pending.append((event, host, time.monotonic()))
+        self.received += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Write all pending events."""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+                with INGEST_FLUSH_SECONDS.time():
+                    failed = await store_job_events(
+                        self.db_session_factory,
+                        [(event, host) for event, host, _ in batch],
+                    )
+                failed_ids = {id(event) for event, _ in failed}
+                written = [
+                    event
+                    for event, _, _ in batch
+                    if id(event) not in failed_ids
+                ]
+                self.written += len(written)
+                INGEST_FLUSH_EVENTS.observe(len(written))
+                if failed:
+                    self.dropped += len(failed)
+                    INGEST_DROPPED_EVENTS.inc(len(failed))
+                async with self._drained:
+                    self._drained.notify_all()
+                if self.on_flush is not None:
+                    if written:
+                        await self.on_flush(written, True)
+                    if failed:
+                        await self.on_flush(
+                            [event for event, _ in failed], False
+                        )
+
+    async def close(self) -> None:
+        """Stop the background flush and write all pending events."""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+class CreditWindow:
+    """Credit based flow control of the events sent by a rulebook worker.
+
+    Once enabled, the worker is granted ``size`` credits and may send one
+    AnsibleEvent message per credit. Credits are granted back as events
+    are flushed, along with the highest counter written for each job, so
+    a worker never has more than ``size`` events in flight and knows which
+    ones are persisted.
+
+    ``send`` is called with each ``Credit`` and ``Ack`` message.
+    """
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], size: int):
+        self.send = send
+        self.size = size
+        self.enabled = False
+        self.outstanding = 0
+
+    async def enable(self) -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        await self._send({"type": "Credit", "credits": self.size})
+
+    def consume(self) -> None:
+        if not self.enabled:
+            return
+        self.outstanding += 1
+        if self.outstanding == self.size + 1:
+            logger.warning("Rulebook worker exceeded its credit window")
+
+    async def release(self, count: int = 1) -> None:
+        """Grant back credits of events that were not queued."""
+        if not self.enabled:
+            return
+        credits = min(count, self.outstanding)
+        self.outstanding -= credits
+        if credits:
+            await self._send({"type": "Credit", "credits": credits})
+
+    async def on_flush(self, events: List[dict], written: bool) -> None:
+        if not self.enabled:
+            return
+        credits = min(len(events), self.outstanding)
+        self.outstanding -= credits
+        message = {"type": "Ack", "credits": credits, "events": {}}
+        if written:
+            acks = message["events"]
+            for event in events:
+                job_uuid, counter = event["job_uuid"], event["counter"]
+                if job_uuid is None or counter is None:
+                    continue
+                if counter > acks.get(job_uuid, -1):
+                    acks[job_uuid] = counter
+        await self._send(message)
+
+    async def _send(self, message: dict) -> None:
+        try:
+            await self.send(message)
+        except Exception:
+            # The worker went away, nothing left to grant credits to.
+            logger.debug("Failed to send %s message", message["type"])
@@ -0,0 +1,266 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Process-wide execution of playbook jobs.
+
+Jobs are admitted into a bounded queue and run by a fixed number of
+workers, each running one blocking job at a time on a thread. Jobs of
+higher priority are started first, and jobs of equal priority in the
+order they were submitted. A burst of jobs waits in the queue instead of
+starting all at once, and submissions beyond its capacity are refused.
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from eda_server import metrics
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "Job",
+    "JobEngine",
+    "JobQueueFull",
+    "jobengine",
+)
+
+# Called on a worker thread with a callable telling whether the job was
+# cancelled or timed out, which the job should poll to stop early.
+JobFunction = Callable[[Callable[[], bool]], Any]
+
+JOBS_QUEUED = metrics.CallbackGauge(
+    "eda_jobs_queued",
+    "Jobs waiting for a worker.",
+    [],
+    lambda: [((), len(jobengine.queued))],
+)
+JOBS_RUNNING = metrics.CallbackGauge(
+    "eda_jobs_running",
+    "Jobs being run by a worker.",
+    [],
+    lambda: [((), len(jobengine.running))],
+)
+JOBS_FINISHED = metrics.Counter(
+    "eda_jobs_finished_total",
+    "Jobs finished, by result.",
+    ["result"],
+)
+JOB_QUEUE_SECONDS = metrics.Histogram(
+    "eda_job_queue_seconds",
+    "Time jobs waited for a worker.",
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+
+
+class JobQueueFull(Exception):
+    """The job queue is at capacity."""
+
+
+class Job:
+    """A job submitted to the engine."""
+
+    def __init__(
+        self,
+        key: str,
+        function: JobFunction,
+        priority: int,
+        timeout: Optional[float],
+    ):
+        self.key = key
+        self.function = function
+        self.priority = priority
+        self.timeout = timeout
+        self.state = "queued"
+        self.result: Optional[str] = None
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.future: asyncio.Future = (
+            asyncio.get_running_loop().create_future()
+        )
+        # Set from the event loop, read from the worker thread
+        self._cancel = threading.Event()
+        self._deadline: Optional[float] = None
+
+    def cancelled(self) -> bool:
+        """Return whether the job should stop, thread safe."""
+        if self._cancel.is_set():
+            return True
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    def info(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        info = {
+            "key": self.key,
+            "priority": self.priority,
+            "state": self.state,
+            "waited": (self.started_at or now) - self.submitted_at,
+        }
+        if self.started_at is not None:
+            info["running"] = now - self.started_at
+        return info
+
+
+class JobEngine:
+    """Runs jobs on ``workers`` threads, from a queue of ``queue_size``.
+
+    A job running longer than its timeout, ``timeout`` seconds unless
+    given at submission, or cancelled while running is asked to stop
+    through the callable it is given; a job cancelled while queued never
+    starts. A timeout of 0 means no timeout.
+    """
+
+    def __init__(
+        self, workers: int = 4, queue_size: int = 1000, timeout: float = 0
+    ):
+        self.queued: Dict[str, Job] = {}
+        self.running: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._workers: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self.configure(workers, queue_size, timeout)
+
+    def configure(
+        self, workers: int, queue_size: int = 1000, timeout: float = 0
+    ) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self.workers, thread_name_prefix="job"
+        )
+        self._workers = [
+            asyncio.create_task(self._run(), name=f"job_worker {i}")
+            for i in range(self.workers)
+        ]
+
+    async def close(self) -> None:
+        """Cancel every job and stop the workers."""
+        for key in list(self.queued) + list(self.running):
+            self.cancel(key)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor is not None:
+            # Running jobs were asked to stop, do not wait for them.
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.queued.clear()
+        self.running.clear()
+
+    def submit(
+        self,
+        key: str,
+        function: JobFunction,
+        *,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Job:
+        """Queue a job, to be awaited through ``job.future``.
+
+        :raises JobQueueFull: If ``queue_size`` jobs are already queued.
+        """
+        if len(self.queued) >= self.queue_size:
+            JOBS_FINISHED.labels(result="rejected").inc()
+            raise JobQueueFull(f"{len(self.queued)} jobs are queued.")
+        if key in self.queued or key in self.running:
+            raise ValueError(f"Job {key} is already submitted.")
+        self.start()
+        if timeout is None:
+            timeout = self.timeout
+        job = Job(key, function, priority, timeout or None)
+        self.queued[key] = job
+        # Higher priority first, then first submitted first.
+        self._queue.put_nowait((-priority, next(self._sequence), job))
+        return job
+
+    def cancel(self, key: str) -> bool:
+        """Cancel a queued or running job, return whether it was found."""
+        job = self.queued.pop(key, None)
+        if job is not None:
+            self._finish(job, "canceled")
+            job.future.cancel()
+            return True
+        job = self.running.get(key)
+        if job is not None:
+            job._cancel.set()
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": [job.info() for job in self.queued.values()],
+            "running": [job.info() for job in self.running.values()],
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self._queue.get()
+            if self.queued.pop(job.key, None) is not job:
+                # Cancelled while queued.
+                continue
+            job.state = "running"
+            job.started_at = time.monotonic()
+            JOB_QUEUE_SECONDS.observe(job.started_at - job.submitted_at)
+            if job.timeout:
+                job._deadline = job.started_at + job.timeout
+            self.running[job.key] = job
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, job.function, job.cancelled
+                )
+            except asyncio.CancelledError:
+                job._cancel.set()
+                self._forget(job, "canceled")
+                job.future.cancel()
+                raise
+            except Exception as e:
+                logger.exception("Job %s failed", job.key)
+                self._forget(job, "failed")
+                job.future.set_exception(e)
+            else:
+                if job._cancel.is_set():
+                    outcome = "canceled"
+                elif job.cancelled():
+                    outcome = "timeout"
+                else:
+                    outcome = "completed"
+                self._forget(job, outcome)
+                job.future.set_result(result)
+
+    def _forget(self, job: Job, result: str) -> None:
+        if self.running.get(job.key) is job:
+            del self.running[job.key]
+        self._finish(job, result)
+
+    def _finish(self, job: Job, result: str) -> None:
+        job.state = "finished"
+        job.result = result
+        JOBS_FINISHED.labels(result=result).inc()
+
+
+jobengine = JobEngine()
@@ -0,0 +1,267 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Write-behind capture of activation output.
+
+The output of an activation used to be written and committed chunk by
+chunk, one transaction per read from the process or container. A
+:class:`LogSink` buffers the output in memory instead and writes it with
+a single commit once ``flush_bytes`` bytes are buffered or the oldest
+buffered byte is ``flush_interval`` seconds old, which bounds the output
+lost if the server dies.
+
+Output is stored either in the large object of the activation instance
+or, by default, as compressed segments (see :mod:`eda_server.logstore`).
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from typing import AsyncIterator, Callable, List, Optional, Set, Union
+
+from asyncpg_lostream.lostream import PGLargeObject
+
+from eda_server import metrics
+from eda_server.logstore import LargeObjectStore, SegmentStore
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "LOG_STORAGES",
+    "LogSink",
+    "LogSinks",
+    "logsinks",
+)
+
+LOG_STORAGES = ("large-object", "segments")
+
+LOG_FLUSH_SECONDS = metrics.Histogram(
+    "eda_activation_log_flush_seconds",
+    "Time spent writing buffered activation output.",
+)
+LOG_FLUSH_BYTES = metrics.Histogram(
+    "eda_activation_log_flush_bytes",
+    "Bytes of activation output written per flush.",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+LOG_DROPPED_BYTES = metrics.Counter(
+    "eda_activation_log_dropped_bytes_total",
+    "Activation output dropped because it failed to be written.",
+)
+LOG_BUFFERED_BYTES = metrics.CallbackGauge(
+    "eda_activation_log_buffered_bytes",
+    "Activation output received and not yet written.",
+    [],
+    lambda: [((), sum(sink.pending for sink in logsinks.sinks))],
+)
+
+
+class LogSink:
+    """Buffered writer of the output of an activation.
+
+    Output goes to ``store``, on a session held for the life of the sink,
+    and every flush is a single transaction. A flush that fails
+    is rolled back and retried with the next one; output is dropped only
+    once more than ``max_buffer`` bytes are waiting.
+
+    :meth:`close` must be called once the output ends, it writes whatever
+    is still buffered.
+    """
+
+    def __init__(
+        self,
+        db,
+        store: Union[LargeObjectStore, SegmentStore],
+        *,
+        flush_bytes: int = 65536,
+        flush_interval: float = 1.0,
+        max_buffer: Optional[int] = None,
+    ):
+        self.db = db
+        self.store = store
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_buffer = max(max_buffer or 16 * flush_bytes, flush_bytes)
+
+        self._buffer: List[bytes] = []
+        self._pending = 0
+        self._since: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="log_sink")
+
+    async def write(self, data: bytes) -> None:
+        if not data:
+            return
+        if self._since is None:
+            self._since = time.monotonic()
+        self._buffer.append(data)
+        self._pending += len(data)
+        if self._pending >= self.flush_bytes:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write and commit the buffered output."""
+        async with self._lock:
+            if not self._buffer:
+                return
+            # Output may be added while writing, it goes to the next flush.
+            count = len(self._buffer)
+            data = b"".join(self._buffer)
+            mark = self.store.mark()
+            try:
+                with LOG_FLUSH_SECONDS.time():
+                    await self.store.append(data)
+                    await self.db.commit()
+            except Exception:
+                logger.exception(
+                    "Failed to write %d bytes of activation output", len(data)
+                )
+                await self.db.rollback()
+                self.store.reset(mark)
+                if self._pending > self.max_buffer:
+                    LOG_DROPPED_BYTES.inc(len(data))
+                    self._consume(count, len(data))
+                return
+            LOG_FLUSH_BYTES.observe(len(data))
+            self._consume(count, len(data))
+
+    async def close(self) -> None:
+        """Stop the background flush and write the buffered output."""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            LOG_DROPPED_BYTES.inc(self._pending)
+            self._consume(len(self._buffer), self._pending)
+
+    def _consume(self, count: int, size: int) -> None:
+        del self._buffer[:count]
+        self._pending -= size
+        self._since = time.monotonic() if self._buffer else None
+
+    async def _run(self) -> None:
+        while not self._closed:
+            timeout = self.flush_interval
+            if self._since is not None:
+                timeout -= time.monotonic() - self._since
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if (
+                self._since is not None
+                and time.monotonic() - self._since >= self.flush_interval
+            ):
+                await self.flush()
+
+
+class LogSinks:
+    """Opens log sinks and keeps track of the open ones."""
+
+    def __init__(
+        self,
+        flush_bytes: int = 65536,
+        flush_interval: float = 1.0,
+        storage: str = "segments",
+        segment_bytes: int = 1048576,
+        max_bytes: int = 0,
+    ):
+        self.sinks: Set[LogSink] = set()
+        self.configure(
+            flush_bytes, flush_interval, storage, segment_bytes, max_bytes
+        )
+
+    def configure(
+        self,
+        flush_bytes: int,
+        flush_interval: float,
+        storage: str = "segments",
+        segment_bytes: int = 1048576,
+        max_bytes: int = 0,
+    ) -> None:
+        if storage not in LOG_STORAGES:
+            raise ValueError(f"Unknown activation log storage: {storage}")
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.storage = storage
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+
+    @contextlib.asynccontextmanager
+    async def open(
+        self,
+        db_factory: Callable,
+        activation_instance_id: int,
+        large_data_id: Optional[int],
+    ) -> AsyncIterator[LogSink]:
+        """Capture the output of an activation, for the life of the block."""
+        async with db_factory() as db:
+            if self.storage == "segments":
+                store = SegmentStore(
+                    db,
+                    activation_instance_id,
+                    segment_bytes=self.segment_bytes,
+                    max_bytes=self.max_bytes,
+                )
+                await store.open()
+                async with self._sink(db, store) as sink:
+                    yield sink
+            else:
+                async with PGLargeObject(
+                    db, oid=large_data_id, mode="w"
+                ) as lobject:
+                    async with self._sink(
+                        db, LargeObjectStore(lobject)
+                    ) as sink:
+                        yield sink
+                # Closing truncates the large object to the written length.
+                await db.commit()
+
+    @contextlib.asynccontextmanager
+    async def _sink(self, db, store) -> AsyncIterator[LogSink]:
+        sink = LogSink(
+            db,
+            store,
+            flush_bytes=self.flush_bytes,
+            flush_interval=self.flush_interval,
+        )
+        sink.start()
+        self.sinks.add(sink)
+        try:
+            yield sink
+        finally:
+            self.sinks.discard(sink)
+            await sink.close()
+
+    async def flush(self) -> None:
+        """Write the output buffered by every open sink."""
+        await asyncio.gather(*(sink.flush() for sink in list(self.sinks)))
+
+
+logsinks = LogSinks()
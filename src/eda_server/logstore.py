@@ -0,0 +1,429 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Storage of activation output as compressed segments.
+
+The output of an activation instance is split into segments of at most
+``segment_bytes`` bytes, cut after a newline where possible, each stored
+zlib compressed in its own ``activation_instance_log_segment`` row. The
+byte offset and line number at which each segment starts are kept along
+with it, so that a range of the output is read from the few segments
+covering it. Once the output exceeds ``max_bytes``, the oldest segments
+are deleted; offsets keep counting from the start of the output.
+
+Output is first appended to the open segment, the one after the last
+stored, as uncompressed ``activation_instance_log_chunk`` rows, one per
+write. A segment is compressed and stored once, when it is full, and
+its chunks are then deleted.
+"""
+
+import bisect
+import zlib
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server.db.sql import activation as asql
+
+__all__ = (
+    "LargeObjectStore",
+    "LogReader",
+    "SegmentStore",
+    "read_tail",
+)
+
+# Segment number, start offset, start line, data and bytes written of the
+# open segment
+SegmentMark = Tuple[int, int, int, bytes, int]
+
+
+class LargeObjectStore:
+    """Appends output to a large object."""
+
+    def __init__(self, lobject):
+        self.lobject = lobject
+
+    async def append(self, data: bytes) -> None:
+        await self.lobject.write(data)
+
+    def mark(self) -> int:
+        return self.lobject.pos
+
+    def reset(self, mark: int) -> None:
+        self.lobject.pos = mark
+
+
+class SegmentStore:
+    """Appends output to the segments of an activation instance.
+
+    Each append writes a chunk of the open segment. The open segment is
+    also kept in memory, to be compressed once full. Output is appended
+    to what former runs of the activation instance left.
+    """
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        activation_instance_id: int,
+        *,
+        segment_bytes: int = 1048576,
+        max_bytes: int = 0,
+        level: int = 6,
+    ):
+        self.db = db
+        self.activation_instance_id = activation_instance_id
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.level = level
+
+        self.segment = 0
+        self.byte_start = 0
+        self.line_start = 0
+        self.data = bytearray()
+        # Bytes of the open segment stored as chunks
+        self.written = 0
+
+    async def open(self) -> None:
+        """Continue after the output stored."""
+        row = await asql.get_last_log_segment(
+            self.db, self.activation_instance_id
+        )
+        if row is not None:
+            self.segment = row.segment + 1
+            self.byte_start = row.byte_start + row.byte_count
+            self.line_start = row.line_start + row.line_count
+        chunks = await asql.list_log_chunks(
+            self.db, self.activation_instance_id
+        )
+        if chunks:
+            self.segment = chunks[0].segment
+            self.byte_start = chunks[0].byte_start
+            self.line_start = chunks[0].line_start
+            self.data = bytearray(b"".join(chunk.data for chunk in chunks))
+            self.written = len(self.data)
+
+    async def append(self, data: bytes) -> None:
+        self.data += data
+        sealed = False
+        while len(self.data) > self.segment_bytes:
+            cut = self.data.rfind(b"\n", 0, self.segment_bytes) + 1
+            if cut < self.segment_bytes // 2:
+                # No line ends late enough, cut through the line.
+                cut = self.segment_bytes
+            segment = bytes(self.data[:cut])
+            await self._seal(segment)
+            del self.data[:cut]
+            # What is left starts the next segment, chunks are rewritten.
+            self.written = 0
+            self.segment += 1
+            self.byte_start += len(segment)
+            self.line_start += segment.count(b"\n")
+            sealed = True
+        if len(self.data) > self.written:
+            await self._write_chunk()
+        if sealed and self.max_bytes > 0:
+            end = self.byte_start + len(self.data)
+            await asql.delete_log_segments_before(
+                self.db, self.activation_instance_id, end - self.max_bytes
+            )
+
+    def mark(self) -> SegmentMark:
+        return (
+            self.segment,
+            self.byte_start,
+            self.line_start,
+            bytes(self.data),
+            self.written,
+        )
+
+    def reset(self, mark: SegmentMark) -> None:
+        (
+            self.segment,
+            self.byte_start,
+            self.line_start,
+            data,
+            self.written,
+        ) = mark
+        self.data = bytearray(data)
+
+    async def _seal(self, segment: bytes) -> None:
+        await asql.upsert_log_segment(
+            self.db,
+            activation_instance_id=self.activation_instance_id,
+            segment=self.segment,
+            byte_start=self.byte_start,
+            byte_count=len(segment),
+            line_start=self.line_start,
+            line_count=segment.count(b"\n"),
+            data=zlib.compress(segment, self.level),
+        )
+        await asql.delete_log_chunks(
+            self.db, self.activation_instance_id, self.segment
+        )
+
+    async def _write_chunk(self) -> None:
+        chunk = bytes(self.data[self.written :])
+        await asql.insert_log_chunk(
+            self.db,
+            activation_instance_id=self.activation_instance_id,
+            segment=self.segment,
+            byte_start=self.byte_start + self.written,
+            line_start=self.line_start
+            + self.data.count(b"\n", 0, self.written),
+            line_count=chunk.count(b"\n"),
+            data=chunk,
+        )
+        self.written = len(self.data)
+
+
+async def list_segments(
+    db: AsyncSession, activation_instance_id: int
+) -> List["Segment"]:
+    """Return the index of the stored segments and of the open one."""
+    rows = await asql.list_log_segments(db, activation_instance_id)
+    index = [Segment(*row) for row in rows]
+    row = await asql.get_open_log_segment(db, activation_instance_id)
+    if row is not None and (not index or row.segment > index[-1].segment):
+        index.append(Segment(*row))
+    return index
+
+
+async def read_segments(
+    db: AsyncSession, activation_instance_id: int, segment_numbers: List[int]
+) -> bytes:
+    rows = await asql.get_log_segments_data(
+        db, activation_instance_id, segment_numbers
+    )
+    output = [zlib.decompress(row.data) for row in rows]
+    stored = {row.segment for row in rows}
+    for segment in segment_numbers:
+        # Only the open segment is missing, and comes last.
+        if segment not in stored:
+            output.extend(
+                await asql.get_log_chunks_data(
+                    db, activation_instance_id, segment
+                )
+            )
+    return b"".join(output)
+
+
+async def read_tail(
+    db: AsyncSession, activation_instance_id: int, tail: int
+) -> Optional[Tuple[bytes, bool]]:
+    """Return the last ``tail`` bytes of stored segments.
+
+    Also returns whether the output read starts in the middle of a line.
+    Returns None if the activation instance has no segments.
+    """
+    index = await list_segments(db, activation_instance_id)
+    if not index:
+        return None
+    end = index[-1].byte_start + index[-1].byte_count
+    start = max(end - tail, index[0].byte_start)
+    covering = [
+        row for row in index if row.byte_start + row.byte_count > start
+    ]
+    if not covering:
+        return b"", False
+    output = await read_segments(
+        db, activation_instance_id, [row.segment for row in covering]
+    )
+    offset = start - covering[0].byte_start
+    # Segments start on a new line, unless a line was too long to fit.
+    truncated = offset > 0 and output[offset - 1 : offset] != b"\n"
+    return output[offset:], truncated
+
+
+class Segment(NamedTuple):
+    """Index entry of a log segment."""
+
+    segment: int
+    byte_start: int
+    byte_count: int
+    line_start: int
+    line_count: int
+
+
+class LogReader:
+    """Reads ranges of the output of an activation instance.
+
+    Byte offsets and line numbers are located through the segment index,
+    so that only the segments covering a range are fetched and
+    decompressed, one at a time. Lines are numbered from 0, and counted
+    from the start of the output even once older segments are deleted.
+    Segments are fetched with the session the reader was opened with, or
+    bound to with :meth:`bind`.
+    """
+
+    def __init__(
+        self,
+        index: List[Segment],
+        load: Callable[[Optional[AsyncSession], int], Awaitable[bytes]],
+        db: Optional[AsyncSession] = None,
+    ):
+        self.index = index
+        self.db = db
+        self._load = load
+        # Segments decompressed to locate lines, reused when reading
+        self._cache: Dict[int, bytes] = {}
+
+    @classmethod
+    async def open(
+        cls, db: AsyncSession, activation_instance_id: int
+    ) -> Optional["LogReader"]:
+        """Return a reader of the segments, or None if there are none."""
+        index = await list_segments(db, activation_instance_id)
+        if not index:
+            return None
+
+        async def load(db: AsyncSession, segment: int) -> bytes:
+            return await read_segments(db, activation_instance_id, [segment])
+
+        return cls(index, load, db)
+
+    @classmethod
+    async def open_large_object(
+        cls,
+        db: AsyncSession,
+        oid: int,
+        length: int,
+        window: int = 1048576,
+    ) -> "LogReader":
+        """Return a reader of output stored in a large object.
+
+        The large object is indexed as windows of ``window`` bytes, whose
+        lines are counted by the database; only the windows covering a
+        range are fetched.
+        """
+        rows = await asql.list_large_object_windows(db, oid, length, window)
+        index = []
+        line_start = 0
+        for number, row in enumerate(rows):
+            byte_count = min(window, length - row.byte_start)
+            index.append(
+                Segment(
+                    number,
+                    row.byte_start,
+                    byte_count,
+                    line_start,
+                    row.line_count,
+                )
+            )
+            line_start += row.line_count
+
+        async def load(db: AsyncSession, segment: int) -> bytes:
+            entry = index[segment]
+            return await asql.read_large_object(
+                db, oid, entry.byte_start, entry.byte_count
+            )
+
+        return cls(index, load, db)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LogReader":
+        """Return a reader of output held in memory, as a single segment."""
+
+        async def load(db: Optional[AsyncSession], segment: int) -> bytes:
+            return data
+
+        return cls([Segment(0, 0, len(data), 0, data.count(b"\n"))], load)
+
+    def bind(self, db: AsyncSession) -> "LogReader":
+        """Return a reader of the same output, fetching it with ``db``."""
+        reader = LogReader(self.index, self._load, db)
+        reader._cache = self._cache
+        return reader
+
+    @property
+    def start(self) -> int:
+        """Offset of the oldest output stored."""
+        return self.index[0].byte_start
+
+    @property
+    def end(self) -> int:
+        return self.index[-1].byte_start + self.index[-1].byte_count
+
+    async def line_at(self, offset: int) -> int:
+        """Return the number of the line holding the byte at ``offset``."""
+        offset = min(max(offset, self.start), self.end)
+        position = bisect.bisect_right(
+            [segment.byte_start for segment in self.index], offset
+        )
+        segment = self.index[max(position - 1, 0)]
+        data = await self._data(segment)
+        return segment.line_start + data.count(
+            b"\n", 0, offset - segment.byte_start
+        )
+
+    async def line_offset(self, line: int) -> int:
+        """Return the offset at which ``line`` starts.
+
+        Lines no longer stored start at the oldest output stored, lines
+        not written yet at the end of the output.
+        """
+        if line <= self.index[0].line_start:
+            return self.start
+        # Line N starts after the Nth newline.
+        for segment in self.index:
+            if line <= segment.line_start + segment.line_count:
+                break
+        else:
+            return self.end
+        data = await self._data(segment)
+        position = -1
+        for _ in range(line - segment.line_start):
+            position = data.index(b"\n", position + 1)
+        return segment.byte_start + position + 1
+
+    async def tail_offset(self, lines: int) -> int:
+        """Return the offset at which the last ``lines`` lines start."""
+        last = self.index[-1]
+        total = last.line_start + last.line_count
+        data = await self._data(last)
+        if data and not data.endswith(b"\n"):
+            # The line being written counts as well.
+            total += 1
+        return await self.line_offset(max(total - lines, 0))
+
+    async def iter_bytes(self, start: int, end: int) -> AsyncIterator[bytes]:
+        """Yield the output from ``start`` up to ``end``, by segment."""
+        start = max(start, self.start)
+        for segment in self.index:
+            if segment.byte_start >= end:
+                break
+            if segment.byte_start + segment.byte_count <= start:
+                continue
+            data = self._cache.get(segment.segment)
+            if data is None:
+                data = await self._load(self.db, segment.segment)
+            yield data[
+                max(start - segment.byte_start, 0) : end - segment.byte_start
+            ]
+
+    async def _data(self, segment: Segment) -> bytes:
+        data = self._cache.get(segment.segment)
+        if data is None:
+            data = self._cache[segment.segment] = await self._load(
+                self.db, segment.segment
+            )
+        return data
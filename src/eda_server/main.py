@@ -13,6 +13,9 @@
 #  limitations under the License.
 
 import argparse
+import os
+import sys
+import tempfile
 
 import uvicorn
 
@@ -34,12 +37,27 @@ def parse_args() -> argparse.Namespace:
 def main():
     settings = load_settings()
     args = parse_args()
+    if settings.workers > 1 and settings.broadcast_backend == "memory":
+        sys.exit(
+            "Running several workers requires a shared broadcast backend,"
+            " set EDA_BROADCAST_BACKEND=postgres."
+        )
+    if settings.workers > 1:
+        # Workers write their metrics there, to be scraped from any of
+        # them.
+        os.environ.setdefault(
+            "PROMETHEUS_MULTIPROC_DIR",
+            tempfile.mkdtemp(prefix="eda-server-metrics-"),
+        )
     uvicorn.run(
         "eda_server.app:create_app",
         reload=args.reload,
         factory=True,
         host=settings.host,
         port=settings.port,
+        workers=settings.workers,
+        ws_ping_interval=settings.ws_ping_interval,
+        ws_ping_timeout=settings.ws_ping_timeout,
         log_config=default_log_config(),
         log_level=settings.log_level.lower(),
     )
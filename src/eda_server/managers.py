@@ -12,13 +12,74 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
+import inspect
+import json
 import logging
-from collections import defaultdict
+import time
+from collections import deque
+from enum import Enum
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from starlette.websockets import WebSocket
 
+from eda_server import metrics
+from eda_server.bus import Bus, MemoryBus
+from eda_server.messages import json_dumps
+from eda_server.utils.cache import LRUCache
+
 logger = logging.getLogger("eda_server")
 
+BROADCAST_SUBSCRIBERS = metrics.Gauge(
+    "eda_broadcast_subscribers",
+    "Number of websocket subscribers to page updates.",
+    multiprocess_mode="livesum",
+)
+BROADCAST_DROPPED_MESSAGES = metrics.Counter(
+    "eda_broadcast_dropped_messages_total",
+    "Page updates given up because a subscriber's queue was full.",
+    ["policy"],
+)
+
+BROADCAST_EVICTED_SUBSCRIBERS = metrics.Counter(
+    "eda_broadcast_evicted_subscribers_total",
+    "Websocket subscribers disconnected by the server, by reason.",
+    ["reason"],
+)
+BROADCAST_IDLE_SUBSCRIBERS = metrics.CallbackGauge(
+    "eda_broadcast_idle_subscribers",
+    "Websocket subscribers sent nothing for a heartbeat interval.",
+    [],
+    lambda: [((), updatemanager.count_idle())],
+)
+
+# Queued for a subscriber that must be disconnected
+_CLOSE = object()
+
+# Sent to multiplexed subscribers that have been silent for a heartbeat
+# interval, they answer with {"type": "Pong"}.
+PING = '{"type":"Ping"}'
+
+# An encoded JSON string, an object to encode, or a callable returning one
+Message = Union[str, Any, Callable[[], Any]]
+
+# Pages whose recent messages are replayed to new subscribers
+HISTORY_PAGES = ("/activation_instance/", "/job_instance/")
+
+# Carries commands between server processes, not a page of the UI
+COMMAND_PAGE = "!command"
+
 
 # TODO(cutwater): A more reliable, scalable and robust tasking system
 #   is probably needed.
@@ -31,27 +92,524 @@ class TaskManager:
 taskmanager = TaskManager()
 
 
-class UpdateManager:
+class OverflowPolicy(str, Enum):
+    """What to do when a subscriber's outbound queue is full."""
+
+    # Discard the oldest queued message to make room.
+    DROP_OLDEST = "drop-oldest"
+    # Discard the message being broadcast.
+    DROP_NEWEST = "drop-newest"
+    # Close the subscriber's websocket.
+    DISCONNECT = "disconnect"
+
+
+class Subscriber:
+    """A websocket subscribed to pages, with its own outbound queue.
+
+    A multiplexed subscriber may follow several pages, and each message
+    it is sent is wrapped as ``{"page": <page>, "message": <message>}``.
+    """
+
+    def __init__(
+        self, websocket: WebSocket, queue_size: int, multiplexed=False
+    ):
+        self.websocket = websocket
+        self.multiplexed = multiplexed
+        self.pages: Set[str] = set()
+        self.queue = asyncio.Queue(queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        # Monotonic time of the last message sent to and received from
+        # the client
+        self.last_sent = self.last_seen = time.monotonic()
+
+    def wrap(self, page: str, message: str) -> str:
+        if not self.multiplexed:
+            return message
+        return f'{{"page":{json_dumps(page)},"message":{message}}}'
+
+
+class StdoutBuffer:
+    """Stdout fragments of a page waiting to be sent as one message."""
+
     def __init__(self):
-        self.active_connections = defaultdict(list)
+        self.fragments: List[str] = []
+        self.size = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class StdoutRun:
+    """Stdout fragments broadcast in a row, not yet encoded."""
+
+    def __init__(self):
+        self.fragments: List[str] = []
+        self.size = 0
+
+    def encode(self) -> str:
+        return json_dumps(["Stdout", {"stdout": "".join(self.fragments)}])
+
+
+class PageHistory:
+    """Most recent messages sent to a page, up to a total size.
+
+    Messages broadcast while the page has no subscribers are kept as
+    given, stdout as raw fragments and other messages unbuilt, and are
+    only built and encoded if replayed. Unbuilt messages do not count
+    towards ``max_bytes``, at most ``max_messages`` messages are kept.
+    """
+
+    def __init__(self, max_bytes: int, max_messages: int = 1000):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.entries: Deque[Union[str, StdoutRun, Message]] = deque()
+        self.size = 0
+
+    def append(self, message: Message) -> None:
+        """Keep an encoded message, or one to build if replayed."""
+        self.entries.append(message)
+        if isinstance(message, str):
+            self.size += len(message)
+        self._trim()
+
+    def append_stdout(self, stdout: str) -> None:
+        run = self.entries[-1] if self.entries else None
+        if not isinstance(run, StdoutRun):
+            run = StdoutRun()
+            self.entries.append(run)
+        run.fragments.append(stdout)
+        run.size += len(stdout)
+        self.size += len(stdout)
+        self._trim()
+
+    def messages(self) -> List[str]:
+        """Return the messages kept, encoded."""
+        messages = []
+        for entry in self.entries:
+            if isinstance(entry, StdoutRun):
+                entry = entry.encode()
+            elif callable(entry):
+                entry = entry()
+            if not isinstance(entry, str):
+                entry = json_dumps(entry)
+            messages.append(entry)
+        return messages
+
+    def _trim(self) -> None:
+        while len(self.entries) > 1 and (
+            self.size > self.max_bytes or len(self.entries) > self.max_messages
+        ):
+            entry = self.entries.popleft()
+            if isinstance(entry, str):
+                self.size -= len(entry)
+            elif isinstance(entry, StdoutRun):
+                self.size -= entry.size
+        run = self.entries[0] if self.entries else None
+        if isinstance(run, StdoutRun):
+            # A single run larger than the history keeps its latest output.
+            while self.size > self.max_bytes and len(run.fragments) > 1:
+                size = len(run.fragments.pop(0))
+                run.size -= size
+                self.size -= size
+
+
+class UpdateManager:
+    """Fan-out of page updates to websocket subscribers.
+
+    Every subscriber has a bounded queue drained by its own writer task,
+    so :meth:`broadcast` never waits on a client. When the queue of a
+    subscriber is full, ``overflow_policy`` decides what is given up.
+
+    Stdout sent with :meth:`broadcast_stdout` is merged per page for up to
+    ``stdout_window`` seconds or ``stdout_max_bytes`` characters, and sent
+    before any other message broadcast to the same page.
+
+    The latest messages of activation and job instance pages are kept,
+    up to ``history_bytes`` characters for each of the ``history_pages``
+    most recently updated pages, and replayed to new subscribers of the
+    page before anything else, so a page opened late shows the tail of
+    its output. Messages broadcast to those pages while nobody follows
+    them are kept unbuilt, see :class:`PageHistory`.
+
+    A websocket follows a single page with :meth:`connect`, or any number
+    of pages with :meth:`connect_multiplexed` and :meth:`subscribe`.
+
+    Messages reach subscribers connected to other server processes
+    through the bus set up by :meth:`start`. Without a shared bus only
+    subscribers of this process are served. The bus also carries the
+    commands of :meth:`send_command` to the other processes.
+
+    Unresponsive subscribers are evicted: a send taking more than
+    ``send_timeout`` seconds closes the socket, and multiplexed
+    subscribers are pinged after ``heartbeat_interval`` seconds without
+    a message from the client and evicted after ``heartbeat_timeout``.
+    Subscribers of single page sockets, which never send anything, rely
+    on the websocket ping of the server instead.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 1000,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        stdout_window: float = 0.1,
+        stdout_max_bytes: int = 65536,
+        history_bytes: int = 65536,
+        history_pages: int = 256,
+        send_timeout: float = 10.0,
+        heartbeat_interval: float = 20.0,
+        heartbeat_timeout: float = 60.0,
+    ):
+        self.active_connections: Dict[str, List[Subscriber]] = {}
+        self.subscribers: Set[Subscriber] = set()
+        self.stdout_buffers: Dict[str, StdoutBuffer] = {}
+        self.bus: Bus = MemoryBus()
+        # Handlers of commands sent by other processes, by name
+        self.commands: Dict[str, Callable[..., Any]] = {}
+        self._command_tasks: Set[asyncio.Task] = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.configure(
+            queue_size,
+            overflow_policy,
+            stdout_window,
+            stdout_max_bytes,
+            history_bytes,
+            history_pages,
+            send_timeout,
+            heartbeat_interval,
+            heartbeat_timeout,
+        )
+
+    def configure(
+        self,
+        queue_size: int,
+        overflow_policy: str,
+        stdout_window: float = 0.1,
+        stdout_max_bytes: int = 65536,
+        history_bytes: int = 65536,
+        history_pages: int = 256,
+        send_timeout: float = 10.0,
+        heartbeat_interval: float = 20.0,
+        heartbeat_timeout: float = 60.0,
+    ) -> None:
+        self.queue_size = queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.stdout_window = stdout_window
+        self.stdout_max_bytes = stdout_max_bytes
+        self.history_bytes = history_bytes
+        self.history = LRUCache(maxsize=history_pages)
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+
+    async def start(self, bus: Bus) -> None:
+        self.bus = bus
+        await bus.start(self.deliver)
+        if self.heartbeat_interval > 0:
+            self._heartbeat = asyncio.create_task(
+                self._run_heartbeat(), name="update_heartbeat"
+            )
+
+    async def close(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        await self.bus.close()
+        self.bus = MemoryBus()
 
     async def connect(self, page, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[page].append(websocket)
-        logger.debug("connect %s %s", page, self.active_connections[page])
+        subscriber = await self._open(websocket, multiplexed=False)
+        self.subscribe(subscriber, page)
 
     def disconnect(self, page, websocket: WebSocket):
-        self.active_connections[page].remove(websocket)
-
-    async def broadcast(self, page, message: str):
-        logger.debug(
-            "broadcast %s %s -> %s",
-            page,
-            message,
-            self.active_connections[page],
+        for subscriber in self.active_connections.get(page, []):
+            if subscriber.websocket is websocket:
+                self.release(subscriber)
+                break
+
+    async def connect_multiplexed(self, websocket: WebSocket) -> Subscriber:
+        """Accept a websocket that subscribes to pages one by one."""
+        return await self._open(websocket, multiplexed=True)
+
+    async def _open(
+        self, websocket: WebSocket, multiplexed: bool
+    ) -> Subscriber:
+        await websocket.accept()
+        subscriber = Subscriber(websocket, self.queue_size, multiplexed)
+        subscriber.task = asyncio.create_task(
+            self._write(subscriber), name="update_writer"
+        )
+        self.subscribers.add(subscriber)
+        BROADCAST_SUBSCRIBERS.inc()
+        logger.debug("connect %s", websocket)
+        return subscriber
+
+    def subscribe(self, subscriber: Subscriber, page: str) -> None:
+        """Send the updates of a page to the subscriber.
+
+        The recent history of the page is queued first.
+        """
+        if subscriber.closed or page in subscriber.pages:
+            return
+        history = self.history.get(page)
+        if history is not None:
+            for message in history.messages()[-self.queue_size :]:
+                self._enqueue(subscriber, page, message)
+            if subscriber.closed:
+                return
+        subscriber.pages.add(page)
+        self.active_connections.setdefault(page, []).append(subscriber)
+        logger.debug("subscribe %s %s", page, subscriber.websocket)
+
+    def unsubscribe(self, subscriber: Subscriber, page: str) -> None:
+        if page not in subscriber.pages:
+            return
+        subscriber.pages.discard(page)
+        subscribers = self.active_connections.get(page, [])
+        if subscriber in subscribers:
+            subscribers.remove(subscriber)
+        if not subscribers:
+            self.active_connections.pop(page, None)
+        if not subscribers and not self.has_subscribers(page):
+            buffer = self.stdout_buffers.pop(page, None)
+            if buffer is not None:
+                buffer.timer.cancel()
+                # Nobody is left to send it to, but a subscriber coming
+                # back gets it with the history.
+                if self._keeps_history(page):
+                    history = self._history(page)
+                    for fragment in buffer.fragments:
+                        history.append_stdout(fragment)
+
+    def release(self, subscriber: Subscriber) -> None:
+        """Unsubscribe from all pages and stop the writer."""
+        self._remove(subscriber)
+        subscriber.task.cancel()
+
+    def touch(self, subscriber: Subscriber) -> None:
+        """Record that the client of the subscriber is alive."""
+        subscriber.last_seen = time.monotonic()
+
+    def count_idle(self) -> int:
+        """Count subscribers sent nothing for a heartbeat interval."""
+        since = time.monotonic() - self.heartbeat_interval
+        return sum(
+            subscriber.last_sent < since for subscriber in self.subscribers
+        )
+
+    async def reap(self) -> None:
+        """Ping silent multiplexed subscribers and evict dead ones."""
+        now = time.monotonic()
+        evicted = []
+        for subscriber in list(self.subscribers):
+            if not subscriber.multiplexed:
+                continue
+            silence = now - subscriber.last_seen
+            if silence > self.heartbeat_timeout:
+                logger.info(
+                    "Evicting unresponsive subscriber of %s",
+                    sorted(subscriber.pages),
+                )
+                BROADCAST_EVICTED_SUBSCRIBERS.labels(
+                    reason="heartbeat-timeout"
+                ).inc()
+                self.release(subscriber)
+                evicted.append(subscriber.websocket)
+            elif silence >= self.heartbeat_interval:
+                if not subscriber.queue.full():
+                    subscriber.queue.put_nowait(PING)
+        # 1001: Going away
+        await asyncio.gather(
+            *(self._close(websocket, 1001) for websocket in evicted)
         )
-        for connection in self.active_connections[page]:
-            await connection.send_text(message)
+
+    def has_subscribers(self, page) -> bool:
+        """Whether a message broadcast to the page may reach anyone."""
+        return self.bus.shared or bool(self.active_connections.get(page))
+
+    async def broadcast(self, page, message: Message):
+        """Send a message to the subscribers of a page.
+
+        ``message`` is an encoded JSON string, an object to encode, or a
+        callable returning either. It is only built and encoded when the
+        page has subscribers, and then once for all of them.
+        """
+        if not self.has_subscribers(page):
+            if self._keeps_history(page):
+                self.flush_stdout(page)
+                self._history(page).append(message)
+            return
+        self.flush_stdout(page)
+        if callable(message):
+            message = message()
+        if not isinstance(message, str):
+            message = json_dumps(message)
+        self._publish(page, message)
+
+    async def broadcast_stdout(self, page, stdout: str):
+        if not stdout:
+            return
+        if not self.has_subscribers(page):
+            if self._keeps_history(page):
+                self.flush_stdout(page)
+                self._history(page).append_stdout(stdout)
+            return
+        if self.stdout_window <= 0:
+            self._publish(page, json_dumps(["Stdout", {"stdout": stdout}]))
+            return
+
+        buffer = self.stdout_buffers.get(page)
+        if buffer is None:
+            buffer = self.stdout_buffers[page] = StdoutBuffer()
+            buffer.timer = asyncio.get_running_loop().call_later(
+                self.stdout_window, self.flush_stdout, page
+            )
+        buffer.fragments.append(stdout)
+        buffer.size += len(stdout)
+        if buffer.size >= self.stdout_max_bytes:
+            self.flush_stdout(page)
+
+    def flush_stdout(self, page) -> None:
+        """Send the stdout pending for a page, if any."""
+        buffer = self.stdout_buffers.pop(page, None)
+        if buffer is None:
+            return
+        buffer.timer.cancel()
+        stdout = "".join(buffer.fragments)
+        self._publish(page, json_dumps(["Stdout", {"stdout": stdout}]))
+
+    def deliver(self, page, message: str) -> None:
+        """Send a message published by another process to subscribers."""
+        if page == COMMAND_PAGE:
+            self._run_command(message)
+            return
+        self._send(page, message)
+
+    def send_command(self, command: str, **args: Any) -> None:
+        """Have the other server processes run a command, without waiting.
+
+        The handler registered in :attr:`commands` under ``command`` is
+        called with ``args`` by every process connected to the bus.
+        Commands are not run by this process, nor sent without a shared
+        bus.
+        """
+        if self.bus.shared:
+            self.bus.publish(COMMAND_PAGE, json_dumps([command, args]))
+
+    def _run_command(self, message: str) -> None:
+        try:
+            command, args = json.loads(message)
+            handler = self.commands[command]
+            result = handler(**args)
+        except Exception:
+            logger.exception("Failed to run command %s", message)
+            return
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._command_tasks.add(task)
+            task.add_done_callback(self._command_done)
+
+    def _command_done(self, task: asyncio.Task) -> None:
+        self._command_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Command failed", exc_info=task.exception())
+
+    def _publish(self, page, message: str) -> None:
+        self._send(page, message)
+        self.bus.publish(page, message)
+
+    def _keeps_history(self, page) -> bool:
+        return self.history_bytes > 0 and page.startswith(HISTORY_PAGES)
+
+    def _history(self, page) -> PageHistory:
+        history = self.history.get(page)
+        if history is None:
+            history = PageHistory(self.history_bytes, self.queue_size)
+            self.history.set(page, history)
+        return history
+
+    def _send(self, page, message: str) -> None:
+        if self._keeps_history(page):
+            self._history(page).append(message)
+        subscribers = self.active_connections.get(page, [])
+        logger.debug("broadcast %s -> %d subscribers", page, len(subscribers))
+        for subscriber in list(subscribers):
+            self._enqueue(subscriber, page, message)
+
+    def _enqueue(self, subscriber: Subscriber, page, message: str) -> None:
+        queue = subscriber.queue
+        message = subscriber.wrap(page, message)
+        if not queue.full():
+            queue.put_nowait(message)
+            return
+
+        BROADCAST_DROPPED_MESSAGES.labels(
+            policy=self.overflow_policy.value
+        ).inc()
+        if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            queue.get_nowait()
+            queue.put_nowait(message)
+        elif self.overflow_policy == OverflowPolicy.DISCONNECT:
+            logger.warning(
+                "Disconnecting slow subscriber of %s", sorted(subscriber.pages)
+            )
+            BROADCAST_EVICTED_SUBSCRIBERS.labels(reason="overflow").inc()
+            self._remove(subscriber)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_CLOSE)
+
+    def _remove(self, subscriber: Subscriber) -> None:
+        for page in list(subscriber.pages):
+            self.unsubscribe(subscriber, page)
+        if not subscriber.closed:
+            subscriber.closed = True
+            self.subscribers.discard(subscriber)
+            BROADCAST_SUBSCRIBERS.dec()
+
+    async def _close(self, websocket: WebSocket, code: int) -> None:
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=code), self.send_timeout or None
+            )
+        except Exception:
+            logger.debug("Failed to close %s", websocket)
+
+    async def _write(self, subscriber: Subscriber) -> None:
+        websocket = subscriber.websocket
+        try:
+            while True:
+                message = await subscriber.queue.get()
+                if message is _CLOSE:
+                    # 1013: Try again later
+                    await self._close(websocket, 1013)
+                    break
+                await asyncio.wait_for(
+                    websocket.send_text(message), self.send_timeout or None
+                )
+                subscriber.last_sent = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.info(
+                "Evicting subscriber of %s, send timed out",
+                sorted(subscriber.pages),
+            )
+            BROADCAST_EVICTED_SUBSCRIBERS.labels(reason="send-timeout").inc()
+            self._remove(subscriber)
+            # 1011: Internal error
+            await self._close(websocket, 1011)
+        except Exception:
+            logger.debug(
+                "Failed to send update to %s", sorted(subscriber.pages)
+            )
+        self._remove(subscriber)
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("Failed to check websocket subscribers")
 
 
 updatemanager = UpdateManager()
@@ -72,3 +630,81 @@ class SecretsManager:
 
 
 secretsmanager = SecretsManager()
+
+
+class ActivationBootstrap(NamedTuple):
+    activation_instance_id: int
+    project_id: Optional[int]
+    rulebook_id: Optional[int]
+    inventory_id: Optional[int]
+    extra_var_id: Optional[int]
+    project_large_data_id: Optional[int]
+    project_archive_hash: Optional[str]
+    digest: str
+    # Pre-encoded messages sent to a rulebook worker after the project
+    frames: Tuple[str, ...]
+
+
+class BootstrapCache:
+    """Payloads sent to rulebook workers, by activation instance.
+
+    Entries must be invalidated whenever the project, rulebook,
+    inventory or extra vars they were built from change.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.bundles = LRUCache(maxsize)
+
+    def get(
+        self, activation_instance_id: int
+    ) -> Optional[ActivationBootstrap]:
+        return self.bundles.get(activation_instance_id)
+
+    def set(self, bundle: ActivationBootstrap) -> None:
+        self.bundles.set(bundle.activation_instance_id, bundle)
+
+    def invalidate(self, **ids: int) -> None:
+        """Drop bundles built from any of the given objects.
+
+        Keyword arguments are id fields of ``ActivationBootstrap``,
+        e.g. ``invalidate(inventory_id=1)``. Bundles are dropped by the
+        other server processes as well.
+        """
+        self.drop(**ids)
+        updatemanager.send_command("invalidate_bootstrap", **ids)
+
+    def drop(self, **ids: int) -> None:
+        """Drop bundles built from any of the given objects, here only."""
+        for key, bundle in self.bundles.items():
+            fields = bundle._asdict()
+            if any(fields[name] == value for name, value in ids.items()):
+                self.bundles.pop(key)
+
+
+bootstrapcache = BootstrapCache()
+
+
+class IngestManager:
+    """Job event buffers of connected rulebook workers.
+
+    Used to report the ingest lag of each activation instance.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def register(self, activation_instance_id: int, buffer) -> None:
+        self.buffers[activation_instance_id] = buffer
+
+    def unregister(self, activation_instance_id: int, buffer) -> None:
+        if self.buffers.get(activation_instance_id) is buffer:
+            del self.buffers[activation_instance_id]
+
+    def get_stats(self, activation_instance_id: int) -> Optional[dict]:
+        buffer = self.buffers.get(activation_instance_id)
+        if buffer is None:
+            return None
+        return buffer.stats()
+
+
+ingestmanager = IngestManager()
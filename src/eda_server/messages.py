@@ -12,15 +12,79 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from typing import NamedTuple
+import json
+from typing import Any, Dict, NamedTuple, Tuple, Union
 
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 
 class JobEnd(NamedTuple):
     job_id: str
 
 
+class MessageDecodeError(ValueError):
+    pass
+
+
+if orjson is not None:
+    json_loads = orjson.loads
+
+    def json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+else:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+
+# Fields required by each message type sent by ansible-rulebook workers
+# over /api/ws2, together with the accepted value types.
+WORKER_MESSAGE_SCHEMAS: Dict[str, Tuple[Tuple[str, Tuple[type, ...]], ...]] = {
+    "Worker": (("activation_id", (int, str)),),
+    "Job": (
+        ("job_id", (str,)),
+        ("ansible_rulebook_id", (int, str)),
+    ),
+    "AnsibleEvent": (("event", (dict,)),),
+    "Action": (
+        ("activation_id", (int, str)),
+        ("action", (str,)),
+        ("run_at", (str,)),
+    ),
+}
+
+
+def decode_worker_message(raw: Union[str, bytes]) -> dict:
+    """Decode and validate a message received from a rulebook worker.
+
+    :raises MessageDecodeError: If the message is not valid JSON, has an
+        unknown type or misses a required field.
+    """
+    try:
+        data = json_loads(raw)
+    except ValueError as exc:
+        raise MessageDecodeError(f"Invalid JSON: {exc}") from None
+    if not isinstance(data, dict):
+        raise MessageDecodeError("Message must be a JSON object.")
+
+    message_type = data.get("type")
+    schema = WORKER_MESSAGE_SCHEMAS.get(message_type)
+    if schema is None:
+        raise MessageDecodeError(f"Unknown message type: {message_type!r}")
+    for field, types in schema:
+        if not isinstance(data.get(field), types):
+            raise MessageDecodeError(
+                f"{message_type} message field {field!r} is missing"
+                " or has invalid type."
+            )
+    return data
+
+
 class ActivationErrorMessage(BaseModel):
     message: str
     detail: str
@@ -0,0 +1,159 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Process metrics, exposed in the Prometheus text format.
+
+Counters, gauges and histograms are those of ``prometheus_client``. When
+the server runs several worker processes, ``PROMETHEUS_MULTIPROC_DIR``
+is set and each process writes its samples to that directory; the
+process serving a scrape renders those of all of them.
+
+Gauges computed from the state of a process, :class:`CallbackGauge`, are
+refreshed on scrape, and periodically by every process in multiprocess
+mode, their values then being summed over the processes.
+"""
+
+import asyncio
+import os
+from typing import Callable, Iterable, List, Optional, Sequence, Set, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST as CONTENT_TYPE,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    disable_created_metrics,
+    generate_latest,
+    multiprocess,
+)
+
+__all__ = (
+    "CONTENT_TYPE",
+    "Counter",
+    "Gauge",
+    "CallbackGauge",
+    "Histogram",
+    "callbackgauges",
+    "is_multiprocess",
+    "render",
+)
+
+LabelValues = Tuple[str, ...]
+
+# The *_created series are of no use to the dashboards.
+disable_created_metrics()
+
+
+def is_multiprocess() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+class CallbackGauge:
+    """Gauge whose values are collected from the state of the process.
+
+    ``callback`` returns pairs of label values and value.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Iterable[Tuple[Sequence, float]]],
+        *,
+        registry: Optional[CollectorRegistry] = REGISTRY,
+    ):
+        self.gauge = Gauge(
+            name,
+            documentation,
+            labelnames,
+            registry=registry,
+            multiprocess_mode="livesum",
+        )
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._reported: Set[LabelValues] = set()
+        callbackgauges.gauges.append(self)
+
+    def refresh(self) -> None:
+        reported = set()
+        for key, value in self.callback():
+            key = tuple(map(str, key))
+            self._child(key).set(value)
+            reported.add(key)
+        for key in self._reported - reported:
+            if is_multiprocess():
+                # Samples written by the process cannot be removed.
+                self._child(key).set(0)
+            else:
+                self.gauge.remove(*key)
+        self._reported = reported
+
+    def _child(self, key: LabelValues) -> Gauge:
+        return self.gauge.labels(*key) if key else self.gauge
+
+
+class CallbackGauges:
+    """Refreshes the callback gauges of the process."""
+
+    def __init__(self):
+        self.gauges: List[CallbackGauge] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self) -> None:
+        for gauge in self.gauges:
+            gauge.refresh()
+
+    def start(self, interval: float) -> None:
+        """Refresh the gauges every ``interval`` seconds.
+
+        For scrapes served by other processes, in multiprocess mode.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(
+                self._run(interval), name="refresh_callback_gauges"
+            )
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if is_multiprocess():
+            multiprocess.mark_process_dead(os.getpid())
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            self.refresh()
+            await asyncio.sleep(interval)
+
+
+callbackgauges = CallbackGauges()
+
+
+def render(registry: Optional[CollectorRegistry] = None) -> bytes:
+    """Render the metrics of the process, or of all of them.
+
+    In multiprocess mode, unless a registry is given, the metrics of all
+    processes are rendered.
+    """
+    callbackgauges.refresh()
+    if registry is None:
+        registry = REGISTRY
+        if is_multiprocess():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
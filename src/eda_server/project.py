@@ -13,10 +13,12 @@
 #  limitations under the License.
 
 import asyncio
+import hashlib
 import logging
 import os
 import shutil
 import tempfile
+from typing import Dict, List
 
 import sqlalchemy as sa
 import yaml
@@ -274,11 +276,36 @@ async def tar_project(db: AsyncSession, large_data_id: int, project_dir: str):
 
         logger.critical(tarfile_name)
 
+        digest = hashlib.sha256()
         async with PGLargeObject(db, oid=large_data_id, mode="w") as lobject:
             with open(tarfile_name, "rb") as f:
                 while data := f.read(CHUNK_SIZE):
+                    digest.update(data)
                     await lobject.write(data)
 
+        await set_archive_hash(db, large_data_id, digest.hexdigest())
+
+
+async def set_archive_hash(
+    db: AsyncSession, large_data_id: int, archive_hash: str
+):
+    await db.execute(
+        sa.update(models.projects)
+        .where(models.projects.c.large_data_id == large_data_id)
+        .values(archive_hash=archive_hash)
+    )
+
+
+async def compute_archive_hash(db: AsyncSession, large_data_id: int) -> str:
+    """Hash and store the archive of a project imported without one."""
+    digest = hashlib.sha256()
+    async with PGLargeObject(db, oid=large_data_id, mode="r") as lobject:
+        async for buff in lobject:
+            digest.update(buff)
+    archive_hash = digest.hexdigest()
+    await set_archive_hash(db, large_data_id, archive_hash)
+    return archive_hash
+
 
 async def import_project_file(
     db: AsyncSession,
@@ -312,21 +339,31 @@ async def update_project_file(
     await update_project_file[file_type](db, file_content, existing_file_id)
 
 
-async def sync_existing_project(db: AsyncSession, project: sa.engine.row.Row):
+async def sync_existing_project(
+    db: AsyncSession, project: sa.engine.row.Row
+) -> List[Dict[str, int]]:
+    """Sync the files of a project with its repository.
+
+    Returns the ids of the files updated that activation bootstraps are
+    built from, to invalidate once the transaction is committed.
+    """
     with tempfile.TemporaryDirectory(prefix="eda-sync-project") as repo_dir:
         commit_id = await clone_project(project.url, repo_dir)
-        if commit_id != project.git_hash:
-            await sync_new_project_files(db, project.id, repo_dir)
-            await db.execute(
-                sa.update(models.projects)
-                .where(models.projects.c.id == project.id)
-                .values(git_hash=commit_id)
-            )
+        if commit_id == project.git_hash:
+            return []
+        updated = await sync_new_project_files(db, project.id, repo_dir)
+        await db.execute(
+            sa.update(models.projects)
+            .where(models.projects.c.id == project.id)
+            .values(git_hash=commit_id)
+        )
+        return updated
 
 
 async def sync_new_project_files(
     db: AsyncSession, project_id: int, repo_dir: str
-):
+) -> List[Dict[str, int]]:
+    updated = []
     new_project_files = find_project_files(repo_dir)
     existing_project_files = await retrieve_existing_project_files(
         db, project_id
@@ -353,11 +390,14 @@ async def sync_new_project_files(
                     await update_project_file(
                         db, file_content, file_type, existing_file_id
                     )
+                    if file_type != "playbook":
+                        updated.append({f"{file_type}_id": existing_file_id})
             # if the file is new
             else:
                 await import_project_file(
                     db, filename, file_content, file_type, project_id
                 )
+    return updated
 
 
 async def retrieve_existing_project_files(
@@ -26,7 +26,11 @@ Functions:
         - rulesets
         - inventory
         - extravars
-    Returns a tuple of the command run and the process
+    Returns the process or container started
+* wait_rulesets
+    Arguments:
+        - activation_id
+    Returns the exit code of the process or container
 * inactivate_ruleset
     Arguments:
         - activation_id
@@ -34,29 +38,38 @@ Functions:
 """
 
 import asyncio
-import concurrent.futures
-import json
+import codecs
 import logging
 import os
 import shutil
 import tempfile
-from functools import partial
 
-import aiodocker
-import aiodocker.images
+import aiodocker.exceptions
 import ansible_runner
-from asyncpg_lostream.lostream import CHUNK_SIZE, PGLargeObject
-from sqlalchemy import insert
+from asyncpg_lostream.lostream import CHUNK_SIZE
 
 from eda_server.managers import taskmanager
 
-from .db.models import job_instance_events
+from .containers import containerclient
+from .ingest import (
+    INGEST_DROPPED_EVENTS,
+    INGEST_FLUSH_EVENTS,
+    INGEST_FLUSH_SECONDS,
+    store_job_events,
+)
+from .jobengine import jobengine
+from .logsink import logsinks
 from .managers import updatemanager
 from .messages import JobEnd
+from .workerpool import workerpool
 
 logger = logging.getLogger("eda_server")
 
 activated_rulesets = {}
+# Tasks writing the output of the last run of activated rulesets
+output_tasks = {}
+# Seconds the output of a stopped run may take to be written
+OUTPUT_TIMEOUT = 30
 ansible_rulebook = shutil.which("ansible-rulebook")
 if ansible_rulebook is None:
     raise Exception("ansible-rulebook not found")
@@ -73,6 +86,52 @@ def ensure_directory(directory):
         return directory
 
 
+def local_worker_command(activation_id: str):
+    """Return the command line of a local worker reporting activation_id."""
+    return [
+        ssh_agent,
+        ansible_rulebook,
+        "--worker",
+        "--websocket-address",
+        "ws://localhost:8080/api/ws2",
+        "--id",
+        activation_id,
+    ]
+
+
+def capture_output(activation_id, coro, name):
+    """Write the output of a run in the background."""
+    task = asyncio.create_task(coro, name=name)
+    taskmanager.tasks.append(task)
+    output_tasks[activation_id] = task
+
+    def forget(task):
+        if output_tasks.get(activation_id) is task:
+            del output_tasks[activation_id]
+
+    task.add_done_callback(forget)
+    return task
+
+
+async def wait_output(activation_id):
+    """Wait until the output of the last run is written and its log closed.
+
+    The output of a run that is still being written after
+    ``OUTPUT_TIMEOUT`` seconds is given up on.
+    """
+    task = output_tasks.get(activation_id)
+    if task is None:
+        return
+    done, _ = await asyncio.wait([task], timeout=OUTPUT_TIMEOUT)
+    if not done:
+        logger.warning(
+            "Output of activation instance %s is still being written",
+            activation_id,
+        )
+        task.cancel()
+        await asyncio.wait([task])
+
+
 # TODO(cutwater): Move database query outside of this function
 async def activate_rulesets(
     deployment_type,
@@ -89,6 +148,8 @@ async def activate_rulesets(
 ):
     local_working_directory = working_directory
     ensure_directory(local_working_directory)
+    # The output of a new run must not interleave with the previous one.
+    await wait_output(activation_id)
 
     logger.debug("activate_rulesets %s %s", activation_id, deployment_type)
 
@@ -96,47 +157,39 @@ async def activate_rulesets(
     if deployment_type == "local":
 
         # for local development this is better
-        cmd_args = [
-            ansible_rulebook,
-            "--worker",
-            "--websocket-address",
-            "ws://localhost:8080/api/ws2",
-            "--id",
-            str(activation_id),
-        ]
-        logger.debug(ansible_rulebook)
-        logger.debug(cmd_args)
-
-        proc = await asyncio.create_subprocess_exec(
-            ssh_agent,
-            *cmd_args,
-            cwd=local_working_directory,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
+        proc = workerpool.acquire(activation_id)
+        if proc is None:
+            cmd_args = local_worker_command(str(activation_id))
+            logger.debug(cmd_args)
+
+            proc = await asyncio.create_subprocess_exec(
+                *cmd_args,
+                cwd=local_working_directory,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
 
         activated_rulesets[activation_id] = proc
 
-        task = asyncio.create_task(
+        capture_output(
+            activation_id,
             read_output(proc, activation_id, large_data_id, db_factory),
-            name=f"read_output {proc.pid}",
+            f"read_output {proc.pid}",
         )
-        taskmanager.tasks.append(task)
+        return proc
 
     elif deployment_type == "docker" or deployment_type == "podman":
 
-        docker = aiodocker.Docker()
+        docker = containerclient.docker
 
         host = "eda-server"
 
-        try:
-            await aiodocker.images.DockerImages(docker).pull(
-                execution_environment
-            )
+        await containerclient.ensure_image(execution_environment)
 
-            logger.debug("Creating container")
-            logger.debug("Host: %s", host)
-            logger.debug("Port: %s", port)
+        logger.debug("Creating container")
+        logger.debug("Host: %s", host)
+        logger.debug("Port: %s", port)
+        try:
             container = await docker.containers.create(
                 {
                     "Cmd": [
@@ -159,23 +212,30 @@ async def activate_rulesets(
                     },
                 }
             )
+        except aiodocker.exceptions.DockerError as e:
+            logger.error("Failed to create container: %s", e)
+            if e.status == 404:
+                # The image was removed behind our back.
+                containerclient.forget(execution_environment)
+            raise
+        try:
             logger.debug("Starting container")
             await container.start()
         except aiodocker.exceptions.DockerError as e:
             logger.error("Failed to start container: %s", e)
             await container.delete()
-            await docker.close()
             raise
 
         activated_rulesets[activation_id] = container
 
-        task = asyncio.create_task(
+        capture_output(
+            activation_id,
             read_log(
                 docker, container, activation_id, large_data_id, db_factory
             ),
-            name=f"read_log {container}",
+            f"read_log {container}",
         )
-        taskmanager.tasks.append(task)
+        return container
 
     elif deployment_type == "k8s":
         # Calls to the k8s apis.
@@ -184,11 +244,30 @@ async def activate_rulesets(
         raise Exception("Unsupported deployment_type")
 
 
-async def inactivate_rulesets(activation_id):
+async def wait_rulesets(activation_id):
+    activated = activated_rulesets[activation_id]
     try:
-        activated_rulesets[activation_id].kill()
-    except ProcessLookupError:
-        pass
+        if isinstance(activated, asyncio.subprocess.Process):
+            return await activated.wait()
+        result = await activated.wait()
+        return result["StatusCode"]
+    finally:
+        if activated_rulesets.get(activation_id) is activated:
+            del activated_rulesets[activation_id]
+
+
+async def inactivate_rulesets(activation_id):
+    """Kill an activation, returning once its output is written."""
+    activated = activated_rulesets.get(activation_id)
+    if activated is not None:
+        try:
+            if isinstance(activated, asyncio.subprocess.Process):
+                activated.kill()
+            else:
+                await activated.kill()
+        except (ProcessLookupError, aiodocker.exceptions.DockerError):
+            pass
+    await wait_output(activation_id)
 
 
 async def read_output(
@@ -202,22 +281,21 @@ async def read_output(
             activation_instance_id,
             activation_instance_large_data_id,
         )
-        async with db_factory() as db:
-            async with PGLargeObject(
-                db, oid=activation_instance_large_data_id, mode="w"
-            ) as lobject:
-                while True:
-                    buff = await proc.stdout.read(CHUNK_SIZE)
-                    if not buff:
-                        break
-                    buff = buff.decode()
-                    logger.debug("read_output %s", buff)
-                    await lobject.write(buff)
-                    await db.commit()
-                    await updatemanager.broadcast(
-                        f"/activation_instance/{activation_instance_id}",
-                        json.dumps(["Stdout", {"stdout": buff.decode()}]),
-                    )
+        page = f"/activation_instance/{activation_instance_id}"
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async with logsinks.open(
+            db_factory,
+            activation_instance_id,
+            activation_instance_large_data_id,
+        ) as sink:
+            while True:
+                buff = await proc.stdout.read(CHUNK_SIZE)
+                if not buff:
+                    break
+                await sink.write(buff)
+                stdout = decoder.decode(buff)
+                logger.debug("read_output %s", stdout)
+                await updatemanager.broadcast_stdout(page, stdout)
 
     except Exception as e:
         logger.error("read_output %s", e)
@@ -233,29 +311,39 @@ async def read_log(
     db_factory,
 ):
     try:
-        async with db_factory() as db:
-            async with PGLargeObject(
-                db, oid=activation_instance_large_data_id, mode="w"
-            ) as lobject:
-                async for chunk in container.log(
-                    stdout=True, stderr=True, follow=True
-                ):
-                    await lobject.write(chunk.encode())
-                    await db.commit()
-                    await updatemanager.broadcast(
-                        f"/activation_instance/{activation_instance_id}",
-                        json.dumps(["Stdout", {"stdout": chunk}]),
-                    )
-                await docker.close()
+        page = f"/activation_instance/{activation_instance_id}"
+        async with logsinks.open(
+            db_factory,
+            activation_instance_id,
+            activation_instance_large_data_id,
+        ) as sink:
+            async for chunk in container.log(
+                stdout=True, stderr=True, follow=True
+            ):
+                await sink.write(chunk.encode())
+                await updatemanager.broadcast_stdout(page, chunk)
     except Exception as e:
         logger.error("read_log %s", e)
 
 
-async def run_job(
-    job_uuid, event_log, playbook, inventory, extravars, db_factory
+def submit_job(
+    job_uuid,
+    event_log,
+    playbook,
+    inventory,
+    extravars,
+    *,
+    priority=0,
+    timeout=None,
 ):
+    """Queue a playbook run on the job engine.
+
+    Events are put in ``event_log`` as they are emitted, followed by a
+    ``JobEnd`` once the run is over; see :func:`run_job`.
+
+    :raises JobQueueFull: If the job queue is at capacity.
+    """
     loop = asyncio.get_running_loop()
-    task_pool = concurrent.futures.ThreadPoolExecutor()
 
     host_limit = "localhost"
     verbosity = 0
@@ -263,55 +351,101 @@ async def run_job(
 
     def event_callback(event, *args, **kwargs):
         event["job_id"] = job_uuid
-        event_log.put_nowait(event)
+        # Called on the thread of the job
+        loop.call_soon_threadsafe(event_log.put_nowait, event)
 
-    temp = tempfile.mkdtemp(prefix="run_playbook")
-
-    os.mkdir(os.path.join(temp, "env"))
-    with open(os.path.join(temp, "env", "extravars"), "w") as f:
-        f.write(extravars)
-    os.mkdir(os.path.join(temp, "inventory"))
-    with open(os.path.join(temp, "inventory", "hosts"), "w") as f:
-        f.write(inventory)
-    os.mkdir(os.path.join(temp, "project"))
-    with open(os.path.join(temp, "project", "playbook.yml"), "w") as f:
-        f.write(playbook)
-
-    await loop.run_in_executor(
-        task_pool,
-        partial(
-            ansible_runner.run,
-            playbook="playbook.yml",
-            private_data_dir=temp,
-            limit=host_limit,
-            verbosity=verbosity,
-            event_handler=event_callback,
-            json_mode=json_mode,
-        ),
-    )
+    def run(cancelled):
+        temp = tempfile.mkdtemp(prefix="run_playbook")
+        try:
+            os.mkdir(os.path.join(temp, "env"))
+            with open(os.path.join(temp, "env", "extravars"), "w") as f:
+                f.write(extravars)
+            os.mkdir(os.path.join(temp, "inventory"))
+            with open(os.path.join(temp, "inventory", "hosts"), "w") as f:
+                f.write(inventory)
+            os.mkdir(os.path.join(temp, "project"))
+            with open(os.path.join(temp, "project", "playbook.yml"), "w") as f:
+                f.write(playbook)
+
+            runner = ansible_runner.run(
+                playbook="playbook.yml",
+                private_data_dir=temp,
+                limit=host_limit,
+                verbosity=verbosity,
+                event_handler=event_callback,
+                cancel_callback=cancelled,
+                json_mode=json_mode,
+            )
+            return runner.status
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
 
-    await event_log.put(JobEnd(job_uuid))
+    return jobengine.submit(job_uuid, run, priority=priority, timeout=timeout)
 
 
-async def write_job_events(event_log, job_instance_id, db_factory):
+async def run_job(job, event_log):
+    """Wait for a job submitted with :func:`submit_job` to finish."""
+    try:
+        # Not raising if the job is cancelled while queued
+        await asyncio.wait([job.future])
+        if not job.future.cancelled() and job.future.exception() is None:
+            logger.info(
+                "Job %s %s: %s", job.key, job.result, job.future.result()
+            )
+    finally:
+        # Events are put ahead of the result, JobEnd comes after them.
+        await event_log.put(JobEnd(job.key))
 
-    while True:
 
+async def write_job_events(
+    event_log, job_instance_id, db_factory, batch_size=500
+):
+    """Write the events of a job run until its ``JobEnd``.
+
+    Every event already queued, up to ``batch_size``, is written with a
+    single insert and commit, so batches grow as events come in faster
+    than they are written. Events queued ahead of ``JobEnd`` are written
+    before returning.
+    """
+    ended = False
+    while not ended:
+        batch = []
         event = await event_log.get()
-
-        if isinstance(event, JobEnd):
-            break
-
-        if event.get("stdout"):
-            await updatemanager.broadcast(
-                f"/job_instance/{job_instance_id}",
-                json.dumps(["Stdout", {"stdout": event.get("stdout")}]),
+        while True:
+            if isinstance(event, JobEnd):
+                ended = True
+                break
+            batch.append(event)
+            if len(batch) >= batch_size or event_log.empty():
+                break
+            event = event_log.get_nowait()
+        if not batch:
+            continue
+
+        for event in batch:
+            if event.get("stdout"):
+                await updatemanager.broadcast_stdout(
+                    f"/job_instance/{job_instance_id}", event.get("stdout")
+                )
+
+        rows = [
+            (
+                {
+                    "job_uuid": event.get("job_id"),
+                    "counter": event.get("counter"),
+                    "stdout": event.get("stdout"),
+                },
+                None,
             )
-
-        query = insert(job_instance_events).values(
-            job_uuid=event.get("job_id"),
-            counter=event.get("counter"),
-            stdout=event.get("stdout"),
-        )
-        await db_factory.execute(query)
-        await db_factory.commit()
+            for event in batch
+        ]
+        with INGEST_FLUSH_SECONDS.time():
+            failed = await store_job_events(db_factory, rows)
+        if failed:
+            logger.error(
+                "Dropped %d events of job instance %s",
+                len(failed),
+                job_instance_id,
+            )
+            INGEST_DROPPED_EVENTS.inc(len(failed))
+        INGEST_FLUSH_EVENTS.observe(len(rows) - len(failed))
@@ -17,6 +17,7 @@ from .activation import (
     ActivationCreate,
     ActivationInstanceBaseRead,
     ActivationInstanceCreate,
+    ActivationInstanceIngest,
     ActivationInstanceJobInstance,
     ActivationInstanceRead,
     ActivationLog,
@@ -85,6 +86,7 @@ __all__ = [
     "ActivationInstanceCreate",
     "ActivationInstanceBaseRead",
     "ActivationInstanceRead",
+    "ActivationInstanceIngest",
     "ActivationInstanceJobInstance",
     "ActivationLog",
     "ActivationUpdate",
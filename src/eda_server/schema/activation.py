@@ -74,6 +74,7 @@ class ActivationInstanceCreate(BaseModel):
     working_directory: StrictStr
     execution_environment: StrictStr = "quay.io/aizquier/ansible-rulebook"
     project_id: Optional[int]
+    restart_policy: RestartPolicy = RestartPolicy.ON_FAILURE
 
 
 class ActivationInstanceBaseRead(ActivationInstanceCreate):
@@ -91,6 +92,16 @@ class ActivationInstanceRead(BaseModel):
     extra_var_name: StrictStr
 
 
+class ActivationInstanceIngest(BaseModel):
+    activation_instance_id: int
+    connected: bool
+    received: int = 0
+    written: int = 0
+    dropped: int = 0
+    pending: int = 0
+    lag: float = 0.0
+
+
 class ActivationLog(BaseModel):
     activation_instance_id: int
     log: StrictStr
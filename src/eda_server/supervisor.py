@@ -0,0 +1,410 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Supervision of activation instance processes and containers.
+
+The supervisor starts activation instances, waits for them to exit,
+records their exit status and starts them again according to their
+restart policy.
+"""
+
+import asyncio
+import logging
+import random
+import uuid
+from typing import Callable, Dict, NamedTuple, Optional
+
+import sqlalchemy as sa
+
+from eda_server import ruleset
+from eda_server.db import models
+from eda_server.db.models.activation import ActivationStatus, RestartPolicy
+from eda_server.db.sql import activation as asql
+from eda_server.managers import updatemanager
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "ActivationSpec",
+    "Supervisor",
+    "supervisor",
+)
+
+
+class ActivationSpec(NamedTuple):
+    """Arguments of :func:`eda_server.ruleset.activate_rulesets`."""
+
+    deployment_type: str
+    activation_instance_id: int
+    large_data_id: int
+    execution_environment: str
+    rulesets: str
+    inventory: str
+    extravars: str
+    working_directory: str
+    host: str
+    port: int
+    restart_policy: RestartPolicy = RestartPolicy.ON_FAILURE
+
+
+class Supervised:
+    """An activation instance kept running by the supervisor."""
+
+    def __init__(self, spec: ActivationSpec, db_factory: Callable):
+        self.spec = spec
+        self.db_factory = db_factory
+        self.task: Optional[asyncio.Task] = None
+        # Failed runs in a row, drives the restart backoff
+        self.failures = 0
+
+
+def should_restart(
+    restart_policy: RestartPolicy, exit_code: Optional[int]
+) -> bool:
+    if restart_policy == RestartPolicy.ALWAYS:
+        return True
+    if restart_policy == RestartPolicy.ON_FAILURE:
+        return exit_code != 0
+    return False
+
+
+class Supervisor:
+    """Keeps activation instances running according to their policy.
+
+    At most ``max_concurrent_starts`` activation instances are started at
+    once, so that recovering from a reboot or a mass failure does not pull
+    images and spawn workers all at the same time.
+
+    Restarts are delayed by an exponential backoff, from ``backoff_base``
+    up to ``backoff_max`` seconds, of which a random half is waited so
+    that instances failing together do not restart together. A run lasting
+    longer than ``backoff_max`` resets the backoff.
+
+    Each activation instance started holds a lease in its row, renewed
+    every third of ``lease`` seconds while it is supervised. Instances
+    whose lease expired, left behind by a server process that is gone,
+    are claimed and restarted by :meth:`recover`, so that several server
+    processes never start the same instance.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_starts: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        lease: float = 30.0,
+    ):
+        self.id = uuid.uuid4().hex
+        self.supervised: Dict[int, Supervised] = {}
+        self._starts: Optional[asyncio.Semaphore] = None
+        self._lease_task: Optional[asyncio.Task] = None
+        self._db_factory: Optional[Callable] = None
+        self.configure(max_concurrent_starts, backoff_base, backoff_max, lease)
+
+    def configure(
+        self,
+        max_concurrent_starts: int,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        lease: float = 30.0,
+    ) -> None:
+        self.max_concurrent_starts = max_concurrent_starts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self._starts = None
+
+    @property
+    def starts(self) -> asyncio.Semaphore:
+        # Created on first use, within the running event loop.
+        if self._starts is None:
+            self._starts = asyncio.Semaphore(self.max_concurrent_starts)
+        return self._starts
+
+    async def start(self, spec: ActivationSpec, db_factory: Callable) -> None:
+        """Start an activation instance and supervise it.
+
+        Errors of the first start are raised, the activation instance is
+        then not supervised.
+        """
+        activation_instance_id = spec.activation_instance_id
+        await self.stop(activation_instance_id, record=False)
+        supervised = Supervised(spec, db_factory)
+        self.supervised[activation_instance_id] = supervised
+        try:
+            started = await self._launch(supervised)
+        except Exception:
+            self.supervised.pop(activation_instance_id, None)
+            await self._record(supervised, status=ActivationStatus.FAILED)
+            raise
+        if not started:
+            self.supervised.pop(activation_instance_id, None)
+            return
+        supervised.task = asyncio.create_task(
+            self._watch(supervised), name=f"supervise {activation_instance_id}"
+        )
+
+    async def stop(self, activation_instance_id: int, record=True) -> None:
+        """Stop an activation instance, without restarting it.
+
+        The instance is stopped by whichever server process supervises
+        it, see :meth:`stop_local`.
+        """
+        await self.stop_local(activation_instance_id, record=record)
+        updatemanager.send_command(
+            "stop_activation",
+            activation_instance_id=activation_instance_id,
+            record=record,
+        )
+
+    async def stop_local(
+        self, activation_instance_id: int, record=True
+    ) -> None:
+        """Stop an activation instance if this process supervises it.
+
+        Returns once the output of the stopped run is written, so that a
+        run started next does not interleave its output with it.
+        """
+        supervised = self.supervised.pop(activation_instance_id, None)
+        if supervised is not None and supervised.task is not None:
+            supervised.task.cancel()
+        await ruleset.inactivate_rulesets(activation_instance_id)
+        if supervised is not None and record:
+            await self._record(supervised, status=ActivationStatus.STOPPED)
+
+    async def close(self) -> None:
+        """Stop supervising, leaving activation instances running.
+
+        Their leases are released, for the next server process to claim
+        them without waiting for the leases to expire.
+        """
+        tasks = [s.task for s in self.supervised.values() if s.task]
+        if self._lease_task is not None:
+            tasks.append(self._lease_task)
+            self._lease_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.supervised.clear()
+        if self._db_factory is not None:
+            try:
+                async with self._db_factory() as db:
+                    await asql.release_supervisor_lease(db, self.id)
+                    await db.commit()
+            except Exception:
+                logger.exception("Failed to release supervisor leases")
+
+    def keep_leases(
+        self,
+        db_factory: Callable,
+        deployment_type: str,
+        host: str,
+        port: int,
+        recover: bool = True,
+    ) -> None:
+        """Renew leases in the background, and claim expired ones."""
+        self._db_factory = db_factory
+        if self._lease_task is None:
+            self._lease_task = asyncio.create_task(
+                self._keep_leases(
+                    db_factory, deployment_type, host, port, recover
+                ),
+                name="supervisor_leases",
+            )
+
+    async def recover(
+        self, db_factory: Callable, deployment_type: str, host: str, port: int
+    ) -> int:
+        """Restart activation instances whose supervisor lease expired.
+
+        Returns the number of activation instances being restarted.
+        """
+        async with db_factory() as db:
+            ids = await asql.claim_activation_instances_to_recover(
+                db, self.id, self.lease
+            )
+            await db.commit()
+            rows = await asql.list_activation_instance_run_data(db, ids)
+        for row in rows:
+            if row.id in self.supervised:
+                continue
+            spec = ActivationSpec(
+                deployment_type,
+                row.id,
+                row.large_data_id,
+                row.execution_environment,
+                row.rulesets,
+                row.inventory,
+                row.extra_var,
+                row.working_directory,
+                host,
+                port,
+                row.restart_policy,
+            )
+            supervised = Supervised(spec, db_factory)
+            self.supervised[row.id] = supervised
+            supervised.task = asyncio.create_task(
+                self._restart(supervised), name=f"supervise {row.id}"
+            )
+        if rows:
+            logger.info("Recovering %d activation instances", len(rows))
+        return len(rows)
+
+    async def _keep_leases(
+        self,
+        db_factory: Callable,
+        deployment_type: str,
+        host: str,
+        port: int,
+        recover: bool,
+    ) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if self.supervised:
+                    async with db_factory() as db:
+                        await asql.renew_supervisor_lease(
+                            db, self.id, list(self.supervised)
+                        )
+                        await db.commit()
+                if recover:
+                    await self.recover(db_factory, deployment_type, host, port)
+            except Exception:
+                logger.exception("Failed to renew supervisor leases")
+
+    def backoff(self, failures: int) -> float:
+        delay = min(
+            self.backoff_max, self.backoff_base * 2 ** min(failures, 32)
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _launch(self, supervised: Supervised, restart=False) -> bool:
+        """Start an activation instance, return whether it can be watched."""
+        spec = supervised.spec
+        async with self.starts:
+            values = {
+                "status": ActivationStatus.STARTING,
+                "supervisor_id": self.id,
+                "supervised_at": sa.func.now(),
+            }
+            if restart:
+                restart_count = models.activation_instances.c.restart_count
+                values.update(
+                    restart_count=restart_count + 1,
+                    restarted_at=sa.func.now(),
+                )
+            await self._record(supervised, **values)
+            await ruleset.activate_rulesets(*spec[:-1], supervised.db_factory)
+        await self._record(supervised, status=ActivationStatus.RUNNING)
+        return spec.activation_instance_id in ruleset.activated_rulesets
+
+    async def _watch(self, supervised: Supervised) -> None:
+        spec = supervised.spec
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                exit_code = await ruleset.wait_rulesets(
+                    spec.activation_instance_id
+                )
+            except Exception:
+                logger.exception(
+                    "Failed to wait for activation instance %d",
+                    spec.activation_instance_id,
+                )
+                exit_code = None
+            if loop.time() - started >= self.backoff_max:
+                supervised.failures = 0
+            logger.info(
+                "Activation instance %d exited with %s",
+                spec.activation_instance_id,
+                exit_code,
+            )
+            if not should_restart(spec.restart_policy, exit_code):
+                if exit_code == 0:
+                    status = ActivationStatus.COMPLETED
+                else:
+                    status = ActivationStatus.FAILED
+            else:
+                status = ActivationStatus.RESTARTING
+            await self._record(
+                supervised,
+                status=status,
+                exit_code=exit_code,
+                exited_at=sa.func.now(),
+            )
+            if status != ActivationStatus.RESTARTING:
+                break
+            if not await self._restart(supervised, watch=False):
+                break
+        self._forget(supervised)
+
+    async def _restart(self, supervised: Supervised, watch=True) -> bool:
+        """Start an activation instance again, until it succeeds."""
+        while True:
+            delay = self.backoff(supervised.failures)
+            supervised.failures += 1
+            logger.info(
+                "Restarting activation instance %d in %.1f seconds",
+                supervised.spec.activation_instance_id,
+                delay,
+            )
+            await asyncio.sleep(delay)
+            try:
+                started = await self._launch(supervised, restart=True)
+                break
+            except Exception:
+                logger.exception(
+                    "Failed to restart activation instance %d",
+                    supervised.spec.activation_instance_id,
+                )
+                await self._record(
+                    supervised, status=ActivationStatus.RESTARTING
+                )
+        if watch and started:
+            await self._watch(supervised)
+        elif watch:
+            self._forget(supervised)
+        return started
+
+    def _forget(self, supervised: Supervised) -> None:
+        activation_instance_id = supervised.spec.activation_instance_id
+        if self.supervised.get(activation_instance_id) is supervised:
+            del self.supervised[activation_instance_id]
+
+    async def _record(self, supervised: Supervised, **values) -> None:
+        """Update the activation instance row, ignoring database errors."""
+        for key, value in values.items():
+            if isinstance(value, ActivationStatus):
+                values[key] = value.value
+        query = (
+            sa.update(models.activation_instances)
+            .where(
+                models.activation_instances.c.id
+                == supervised.spec.activation_instance_id
+            )
+            .values(**values)
+        )
+        try:
+            async with supervised.db_factory() as db:
+                await db.execute(query)
+                await db.commit()
+        except Exception:
+            logger.exception(
+                "Failed to record status of activation instance %d",
+                supervised.spec.activation_instance_id,
+            )
+
+
+supervisor = Supervisor()
@@ -0,0 +1,229 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Pool of pre-started rulebook workers for the local deployment.
+
+Starting ``ansible-rulebook --worker`` takes a while, most of it spent
+importing Python modules before the worker connects back to /api/ws2.
+The pool keeps ``size`` workers started ahead of time under a placeholder
+id, ``pool-<token>``. Such a worker is parked by /api/ws2 as soon as it
+sends its Worker message, until :meth:`WorkerPool.acquire` assigns it an
+activation instance; it is then bootstrapped as if it had been started
+for that activation instance.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+
+from eda_server import metrics
+
+logger = logging.getLogger("eda_server")
+
+__all__ = (
+    "POOL_ID_PREFIX",
+    "WorkerPool",
+    "workerpool",
+)
+
+POOL_ID_PREFIX = "pool-"
+
+WORKER_POOL_IDLE = metrics.CallbackGauge(
+    "eda_worker_pool_idle",
+    "Pre-started rulebook workers waiting for an activation instance.",
+    [],
+    lambda: [((), len(workerpool.idle))],
+)
+WORKER_POOL_ACQUISITIONS = metrics.Counter(
+    "eda_worker_pool_acquisitions_total",
+    "Local activation starts, by whether a pooled worker was available.",
+    ["result"],
+)
+
+
+class PooledWorker:
+    """A pre-started rulebook worker."""
+
+    def __init__(self, token: str, proc: asyncio.subprocess.Process):
+        self.token = token
+        self.proc = proc
+        # Resolved with the activation instance id, or None if the
+        # worker is gone.
+        self.assigned: asyncio.Future = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.task: Optional[asyncio.Task] = None
+
+
+class WorkerPool:
+    """Keeps ``size`` idle rulebook workers started.
+
+    ``command`` returns the command line of a worker reporting the given
+    id. A pool of size 0 is disabled.
+    """
+
+    def __init__(
+        self,
+        size: int = 0,
+        command: Optional[Callable[[str], List[str]]] = None,
+        respawn_delay: float = 5.0,
+    ):
+        self.idle: Dict[str, PooledWorker] = OrderedDict()
+        # Workers that did not connect to /api/ws2 yet, by token
+        self.unparked: Dict[str, PooledWorker] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._closed = False
+        self.configure(size, command, respawn_delay)
+
+    def configure(
+        self,
+        size: int,
+        command: Optional[Callable[[str], List[str]]] = None,
+        respawn_delay: float = 5.0,
+    ) -> None:
+        self.size = size
+        self.command = command
+        self.respawn_delay = respawn_delay
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and self.command is not None
+
+    async def start(self) -> None:
+        self._closed = False
+        for _ in range(self.size - len(self.idle)):
+            await self._spawn()
+
+    async def close(self) -> None:
+        """Stop replenishing the pool and kill the idle workers."""
+        self._closed = True
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while self.idle:
+            _, worker = self.idle.popitem(last=False)
+            self._discard(worker)
+            try:
+                worker.proc.kill()
+            except ProcessLookupError:
+                pass
+        self.unparked.clear()
+
+    @staticmethod
+    def is_pool_id(activation_id) -> bool:
+        return isinstance(activation_id, str) and activation_id.startswith(
+            POOL_ID_PREFIX
+        )
+
+    async def park(self, activation_id: str) -> Optional[int]:
+        """Wait until the worker reporting ``activation_id`` is assigned.
+
+        Returns the activation instance id, or None if the worker is not
+        known or went away first.
+        """
+        worker = self.unparked.pop(activation_id[len(POOL_ID_PREFIX) :], None)
+        if worker is None:
+            return None
+        return await asyncio.shield(worker.assigned)
+
+    def acquire(
+        self, activation_instance_id: int
+    ) -> Optional[asyncio.subprocess.Process]:
+        """Assign an idle worker to an activation instance.
+
+        Returns the worker process, or None if the pool is empty. The
+        output the worker produced while idle is discarded, the caller
+        reads the rest. A new worker is started in its place.
+        """
+        if not self.enabled:
+            return None
+        worker = None
+        while self.idle and worker is None:
+            _, worker = self.idle.popitem(last=False)
+            if worker.proc.returncode is not None:
+                self.unparked.pop(worker.token, None)
+                self._discard(worker)
+                worker = None
+        if worker is None:
+            WORKER_POOL_ACQUISITIONS.labels(result="miss").inc()
+            self._background(self._spawn())
+            return None
+        WORKER_POOL_ACQUISITIONS.labels(result="hit").inc()
+        worker.task.cancel()
+        worker.assigned.set_result(activation_instance_id)
+        logger.info(
+            "Assigned pooled worker %s to activation instance %d",
+            worker.proc.pid,
+            activation_instance_id,
+        )
+        self._background(self._spawn())
+        return worker.proc
+
+    async def _spawn(self) -> None:
+        if self._closed or len(self.idle) >= self.size:
+            return
+        token = uuid.uuid4().hex
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *self.command(POOL_ID_PREFIX + token),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        except Exception:
+            logger.exception("Failed to start pooled rulebook worker")
+            return
+        worker = PooledWorker(token, proc)
+        self.idle[token] = self.unparked[token] = worker
+        worker.task = asyncio.create_task(
+            self._idle(worker), name=f"pooled_worker {proc.pid}"
+        )
+
+    async def _idle(self, worker: PooledWorker) -> None:
+        """Drain the output of an idle worker and replace it if it exits."""
+        while await worker.proc.stdout.read(65536):
+            pass
+        await worker.proc.wait()
+        if self.idle.get(worker.token) is not worker:
+            return
+        del self.idle[worker.token]
+        self.unparked.pop(worker.token, None)
+        worker.assigned.set_result(None)
+        logger.warning(
+            "Pooled rulebook worker %s exited with %s",
+            worker.proc.pid,
+            worker.proc.returncode,
+        )
+        self._background(self._respawn())
+
+    async def _respawn(self) -> None:
+        # Do not spin if workers fail right away.
+        await asyncio.sleep(self.respawn_delay)
+        await self._spawn()
+
+    def _discard(self, worker: PooledWorker) -> None:
+        if not worker.assigned.done():
+            worker.assigned.set_result(None)
+        if worker.task is not None:
+            worker.task.cancel()
+
+    def _background(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+workerpool = WorkerPool()
@@ -16,15 +16,18 @@ from unittest import mock
 
 import sqlalchemy as sa
 from asyncpg_lostream.lostream import PGLargeObject
-from fastapi import status as status_codes
+from fastapi import FastAPI, status as status_codes
 from httpx import AsyncClient
 from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from eda_server import logstore
 from eda_server.db import models
+from eda_server.db.dependency import get_db_session_factory
 from eda_server.db.models.activation import RestartPolicy
 from eda_server.db.sql import base as bsql
 from eda_server.types import Action, InventorySource, ResourceType
+from tests.integration.utils.app import override_dependencies
 
 TEST_ACTIVATION = {
     "name": "test-activation",
@@ -198,8 +201,15 @@ async def test_delete_activation_instance(
 
     await db.commit()
 
-    response = await client.delete(f"/api/activation_instance/{inserted_id}")
+    with mock.patch(
+        "eda_server.api.activation.supervisor.stop",
+        new_callable=mock.AsyncMock,
+    ) as stop:
+        response = await client.delete(
+            f"/api/activation_instance/{inserted_id}"
+        )
     assert response.status_code == status_codes.HTTP_204_NO_CONTENT
+    stop.assert_awaited_once_with(inserted_id, record=False)
 
     num_activation_instances = await db.scalar(
         sa.select(func.count()).select_from(models.activation_instances)
@@ -211,6 +221,34 @@ async def test_delete_activation_instance(
     )
 
 
+async def test_deactivate_activation_instance_supervised_elsewhere(
+    client: AsyncClient, db: AsyncSession
+):
+    (inserted_id,) = (
+        await db.execute(
+            sa.insert(models.activation_instances).values(
+                name="test-activation",
+                status="running",
+                supervisor_id="elsewhere",
+            )
+        )
+    ).inserted_primary_key
+    await db.commit()
+
+    response = await client.post(
+        "/api/deactivate", params={"activation_instance_id": inserted_id}
+    )
+    assert response.status_code == status_codes.HTTP_200_OK
+
+    # Not recovered once the process supervising it is gone.
+    status = await db.scalar(
+        sa.select(models.activation_instances.c.status).where(
+            models.activation_instances.c.id == inserted_id
+        )
+    )
+    assert status == "stopped"
+
+
 async def test_ins_del_activation_instance_manages_log_lob(db: AsyncSession):
     foreign_keys = await _create_activation_dependent_objects(db)
     activation_id = await _create_activation(db, foreign_keys)
@@ -448,3 +486,156 @@ async def test_list_activation_instance_job_instances(
     activation_instance_job_instances = response.json()
 
     assert type(activation_instance_job_instances) is list
+
+
+async def test_read_activation_instance_ingest(client: AsyncClient):
+    response = await client.get("/api/activation_instance/1/ingest")
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert response.json() == {
+        "activation_instance_id": 1,
+        "connected": False,
+        "received": 0,
+        "written": 0,
+        "dropped": 0,
+        "pending": 0,
+        "lag": 0.0,
+    }
+
+
+async def test_list_activation_instance_logs_tail(
+    client: AsyncClient, db: AsyncSession
+):
+    foreign_keys = await _create_activation_dependent_objects(db)
+    query = (
+        sa.insert(models.activation_instances)
+        .values(
+            name="test-activation",
+            rulebook_id=foreign_keys["rulebook_id"],
+            inventory_id=foreign_keys["inventory_id"],
+            extra_var_id=foreign_keys["extra_var_id"],
+        )
+        .returning(
+            models.activation_instances.c.id,
+            models.activation_instances.c.large_data_id,
+        )
+    )
+    instance_id, large_data_id = (await db.execute(query)).first()
+    async with PGLargeObject(db, oid=large_data_id, mode="w") as lobject:
+        await lobject.write(b"first line\nsecond line\nthird line\n")
+    await db.commit()
+
+    response = await client.get(
+        "/api/activation_instance_logs",
+        params={"activation_instance_id": instance_id, "tail": 20},
+    )
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert [log["log"] for log in response.json()] == ["third line\n"]
+
+    response = await client.get(
+        "/api/activation_instance_logs",
+        params={"activation_instance_id": instance_id},
+    )
+    assert [log["log"] for log in response.json()] == [
+        "first line\n",
+        "second line\n",
+        "third line\n",
+    ]
+
+
+async def test_list_activation_instance_logs_not_found(client: AsyncClient):
+    response = await client.get(
+        "/api/activation_instance_logs",
+        params={"activation_instance_id": 42},
+    )
+    assert response.status_code == status_codes.HTTP_404_NOT_FOUND
+
+
+async def _create_activation_instance_with_log(db: AsyncSession) -> int:
+    query = sa.insert(models.activation_instances).values(name="test")
+    (instance_id,) = (await db.execute(query)).inserted_primary_key
+    store = logstore.SegmentStore(db, instance_id, segment_bytes=40)
+    await store.append(b"".join(b"line %02d\n" % i for i in range(20)))
+    await db.commit()
+    return instance_id
+
+
+async def test_read_activation_instance_log_ranges(
+    client: AsyncClient, db: AsyncSession
+):
+    instance_id = await _create_activation_instance_with_log(db)
+    url = f"/api/activation_instance/{instance_id}/log"
+
+    response = await client.get(url, params={"tail_lines": 2})
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert response.text == "line 18\nline 19\n"
+    assert response.headers["X-Log-Offset"] == "144"
+    assert response.headers["X-Log-Line"] == "18"
+    assert response.headers["X-Log-End"] == "160"
+
+    response = await client.get(url, params={"start_line": 4, "end_line": 6})
+    assert response.text == "line 04\nline 05\n"
+    assert response.headers["X-Log-Line"] == "4"
+
+    response = await client.get(url, params={"offset": 37, "limit": 8})
+    assert response.text == "04\nline "
+    assert response.headers["X-Log-Line"] == "4"
+
+    response = await client.get(url, params={"offset": 152})
+    assert response.text == "line 19\n"
+
+
+async def test_read_activation_instance_log_streams_with_own_session(
+    app: FastAPI, client: AsyncClient, db: AsyncSession
+):
+    instance_id = await _create_activation_instance_with_log(db)
+    opened = []
+
+    def session_factory():
+        opened.append(db)
+        return db
+
+    with override_dependencies(
+        app, {get_db_session_factory: lambda: session_factory}
+    ):
+        response = await client.get(
+            f"/api/activation_instance/{instance_id}/log",
+            params={"tail_lines": 2},
+        )
+    assert response.text == "line 18\nline 19\n"
+    # One session for the request, one for streaming the output.
+    assert len(opened) == 2
+
+
+async def test_read_activation_instance_log_events(
+    client: AsyncClient, db: AsyncSession
+):
+    instance_id = await _create_activation_instance_with_log(db)
+    response = await client.get(
+        f"/api/activation_instance/{instance_id}/log",
+        params={"tail_lines": 2},
+        headers={"Accept": "text/event-stream"},
+    )
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        "id: 152\ndata: line 18\n\nid: 160\ndata: line 19\n\n"
+    )
+
+    response = await client.get(
+        f"/api/activation_instance/{instance_id}/log",
+        headers={"Last-Event-ID": "152"},
+    )
+    assert response.text == "line 19\n"
+
+
+async def test_read_activation_instance_log_errors(
+    client: AsyncClient, db: AsyncSession
+):
+    instance_id = await _create_activation_instance_with_log(db)
+    response = await client.get(
+        f"/api/activation_instance/{instance_id}/log",
+        params={"offset": 0, "tail_lines": 2},
+    )
+    assert response.status_code == status_codes.HTTP_400_BAD_REQUEST
+
+    response = await client.get("/api/activation_instance/42/log")
+    assert response.status_code == status_codes.HTTP_404_NOT_FOUND
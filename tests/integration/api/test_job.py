@@ -136,3 +136,29 @@ async def test_rerun_job_with_exception(client: AsyncClient, db: AsyncSession):
         assert (
             response.status_code == status_codes.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+async def test_cancel_job_not_queued(
+    client: AsyncClient, db: AsyncSession, check_permission_spy: mock.Mock
+):
+    query = sa.insert(models.job_instances).values(
+        uuid="f4c87c90-254e-11ed-861d-0242ac120002", name="dummy-playbooks"
+    )
+    job_instance_id = (await db.execute(query)).inserted_primary_key[0]
+
+    response = await client.post(f"/api/job_instance/{job_instance_id}/cancel")
+    assert response.status_code == status_codes.HTTP_409_CONFLICT
+    check_permission_spy.assert_called_once_with(
+        mock.ANY, mock.ANY, ResourceType.JOB, Action.UPDATE
+    )
+
+    response = await client.post(
+        f"/api/job_instance/{job_instance_id + 1}/cancel"
+    )
+    assert response.status_code == status_codes.HTTP_404_NOT_FOUND
+
+
+async def test_read_job_queue(client: AsyncClient):
+    response = await client.get("/api/job_instances/queue")
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert response.json() == {"workers": 4, "queued": [], "running": []}
@@ -239,6 +239,34 @@ async def test_sync_project(
     )
 
 
+@mock.patch("eda_server.api.project.bootstrapcache")
+@mock.patch("eda_server.api.project.sync_existing_project")
+async def test_sync_project_invalidates_bootstrap_after_commit(
+    sync_existing_project: mock.Mock,
+    bootstrapcache: mock.Mock,
+    client: AsyncClient,
+    db: AsyncSession,
+):
+    query = sa.insert(models.projects).values(
+        url=TEST_PROJECT["url"], name=TEST_PROJECT["name"]
+    )
+    (project_id,) = (await db.execute(query)).inserted_primary_key
+    sync_existing_project.return_value = [{"rulebook_id": 7}]
+    calls = []
+    commit = db.commit
+
+    async def recording_commit():
+        calls.append("commit")
+        await commit()
+
+    bootstrapcache.invalidate.side_effect = lambda **ids: calls.append(ids)
+    with mock.patch.object(db, "commit", recording_commit):
+        response = await client.post(f"/api/projects/{project_id}")
+
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert calls == ["commit", {"rulebook_id": 7}]
+
+
 async def test_create_project_bad_entity(client: AsyncClient):
     bad_project = {
         "url": None,
@@ -437,6 +465,7 @@ async def test_update_project_unique_name(
     assert response.status_code == status_codes.HTTP_200_OK
     data = response.json()
     del test_project["large_data_id"]
+    del test_project["archive_hash"]
     assert data == test_project
 
     # Rename project.name to same name as a different project will conflict
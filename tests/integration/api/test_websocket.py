@@ -0,0 +1,240 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import datetime
+import hashlib
+import json
+
+import sqlalchemy as sa
+from asyncpg_lostream.lostream import PGLargeObject
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server.api.websocket import (
+    PROJECT_DATA_OFFSET,
+    build_bootstrap,
+    handle_actions,
+    parse_event_time,
+    send_project,
+)
+from eda_server.db import models
+from eda_server.db.sql import (
+    activation as asql,
+    base as bsql,
+    rulebook as rsql,
+)
+
+PROJECT_ARCHIVE = bytes(range(256)) * 1024
+
+JOB_UUID = "f4c87c90-254e-11ed-861d-0242ac120002"
+
+TEST_RULEBOOK_DATA = [
+    {
+        "name": "Test playbook",
+        "hosts": "all",
+        "sources": [{"range": {"limit": 5}}],
+        "rules": [
+            {
+                "name": "Run hello",
+                "condition": "event.i == 1",
+                "action": {"run_playbook": {"name": "hello.yml"}},
+            },
+            {
+                "name": "Run other",
+                "condition": "event.i == 2",
+                "action": {"run_playbook": {"name": "other.yml"}},
+            },
+        ],
+    }
+]
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+
+async def _create_bootstrap(db: AsyncSession):
+    (project_id,) = (
+        await bsql.insert_object(
+            db,
+            models.projects,
+            values={"url": "https://git.example.com/test", "name": "test"},
+        )
+    ).inserted_primary_key
+    large_data_id = await db.scalar(
+        sa.select(models.projects.c.large_data_id).where(
+            models.projects.c.id == project_id
+        )
+    )
+    async with PGLargeObject(db, oid=large_data_id, mode="w") as lobject:
+        await lobject.write(PROJECT_ARCHIVE)
+
+    (activation_instance_id,) = (
+        await bsql.insert_object(
+            db,
+            models.activation_instances,
+            values={"name": "test", "project_id": project_id},
+        )
+    ).inserted_primary_key
+    row = await asql.get_activation_instance_bootstrap(
+        db, activation_instance_id
+    )
+    return build_bootstrap(row)
+
+
+def _received_archive(sent: list) -> bytes:
+    data = b""
+    for frame in sent:
+        if isinstance(frame, bytes):
+            (offset,) = PROJECT_DATA_OFFSET.unpack_from(frame)
+            assert offset == len(data)
+            data += frame[PROJECT_DATA_OFFSET.size :]
+    return data
+
+
+async def test_send_project_legacy(db: AsyncSession):
+    bootstrap = await _create_bootstrap(db)
+    websocket = FakeWebSocket()
+
+    await send_project(bootstrap, {}, websocket, db)
+
+    assert all(isinstance(frame, dict) for frame in websocket.sent)
+    assert websocket.sent[-1] == {
+        "type": "ProjectData",
+        "data": None,
+        "more": False,
+    }
+
+
+async def test_send_project_binary(db: AsyncSession):
+    bootstrap = await _create_bootstrap(db)
+    archive_hash = hashlib.sha256(PROJECT_ARCHIVE).hexdigest()
+    websocket = FakeWebSocket()
+
+    await send_project(
+        bootstrap, {"project_transfer": "binary"}, websocket, db
+    )
+
+    assert websocket.sent[0]["hash"] == archive_hash
+    assert websocket.sent[0]["offset"] == 0
+    assert _received_archive(websocket.sent) == PROJECT_ARCHIVE
+    assert websocket.sent[-1]["more"] is False
+    assert websocket.sent[-1]["size"] == len(PROJECT_ARCHIVE)
+    stored_hash = await db.scalar(
+        sa.select(models.projects.c.archive_hash).where(
+            models.projects.c.id == bootstrap.project_id
+        )
+    )
+    assert stored_hash == archive_hash
+
+
+async def test_send_project_binary_skip_and_resume(db: AsyncSession):
+    bootstrap = await _create_bootstrap(db)
+    archive_hash = hashlib.sha256(PROJECT_ARCHIVE).hexdigest()
+    bootstrap = bootstrap._replace(project_archive_hash=archive_hash)
+
+    websocket = FakeWebSocket()
+    data = {"project_transfer": "binary", "project_hash": archive_hash}
+    await send_project(bootstrap, data, websocket, db)
+    assert websocket.sent == [
+        {
+            "type": "ProjectData",
+            "hash": archive_hash,
+            "data": None,
+            "more": False,
+            "skip": True,
+        }
+    ]
+
+    websocket = FakeWebSocket()
+    offset = len(PROJECT_ARCHIVE) - 1000
+    await send_project(
+        bootstrap, {**data, "project_offset": offset}, websocket, db
+    )
+    assert websocket.sent[0]["offset"] == offset
+    (first_offset,) = PROJECT_DATA_OFFSET.unpack_from(websocket.sent[1])
+    assert first_offset == offset
+    assert websocket.sent[1][PROJECT_DATA_OFFSET.size :] == (
+        PROJECT_ARCHIVE[offset:]
+    )
+    assert websocket.sent[-1]["size"] == len(PROJECT_ARCHIVE)
+
+
+async def test_handle_actions(db: AsyncSession):
+    (rulebook_id,) = (
+        await bsql.insert_object(
+            db, models.rulebooks, values={"name": "ruleset.yml"}
+        )
+    ).inserted_primary_key
+    await rsql.insert_rulebook_related_data(
+        db, rulebook_id, TEST_RULEBOOK_DATA
+    )
+    (activation_instance_id,) = (
+        await bsql.insert_object(
+            db,
+            models.activation_instances,
+            values={"name": "test", "rulebook_id": rulebook_id},
+        )
+    ).inserted_primary_key
+    (job_instance_id,) = (
+        await bsql.insert_object(
+            db, models.job_instances, values={"uuid": JOB_UUID}
+        )
+    ).inserted_primary_key
+
+    for _ in range(2):
+        await handle_actions(
+            {
+                "type": "Action",
+                "action": "run_playbook",
+                "activation_id": activation_instance_id,
+                "playbook_name": "hello.yml",
+                "job_id": JOB_UUID,
+                "run_at": "2022-10-18 13:35:00.000000",
+                "status": "successful",
+            },
+            db,
+        )
+
+    audit_rules = (await db.execute(sa.select(models.audit_rules))).all()
+    assert len(audit_rules) == 2
+    for audit_rule in audit_rules:
+        assert audit_rule.name == "Run hello"
+        assert audit_rule.definition == {"run_playbook": {"name": "hello.yml"}}
+        assert audit_rule.activation_instance_id == activation_instance_id
+        assert audit_rule.job_instance_id == job_instance_id
+        assert audit_rule.status == "successful"
+
+
+def test_parse_event_time():
+    assert parse_event_time("2022-08-24T10:11:12.5") == datetime.datetime(
+        2022, 8, 24, 10, 11, 12, 500000
+    )
+    assert parse_event_time("2022-08-24T10:11:12.12345") == datetime.datetime(
+        2022, 8, 24, 10, 11, 12, 123450
+    )
+    assert parse_event_time(
+        "2022-08-24T10:11:12.1234567+00:00"
+    ) == datetime.datetime(
+        2022, 8, 24, 10, 11, 12, 123456, tzinfo=datetime.timezone.utc
+    )
+    assert parse_event_time("2022-08-24T10:11:12") == datetime.datetime(
+        2022, 8, 24, 10, 11, 12
+    )
@@ -0,0 +1,66 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server.db import models
+from eda_server.db.sql import activation as asql, base as bsql
+from eda_server.types import InventorySource
+
+TEST_INVENTORY = "all: {}"  # noqa
+
+
+async def test_get_activation_instance_bootstrap(db: AsyncSession):
+    (rulebook_id,) = (
+        await bsql.insert_object(
+            db,
+            models.rulebooks,
+            values={"name": "ruleset.yml", "rulesets": "--- []"},
+        )
+    ).inserted_primary_key
+    (inventory_id,) = (
+        await bsql.insert_object(
+            db,
+            models.inventories,
+            values={
+                "name": "inventory.yml",
+                "inventory": TEST_INVENTORY,
+                "inventory_source": InventorySource.USER_DEFINED.value,
+            },
+        )
+    ).inserted_primary_key
+    (activation_instance_id,) = (
+        await bsql.insert_object(
+            db,
+            models.activation_instances,
+            values={
+                "name": "test",
+                "rulebook_id": rulebook_id,
+                "inventory_id": inventory_id,
+            },
+        )
+    ).inserted_primary_key
+
+    row = await asql.get_activation_instance_bootstrap(
+        db, activation_instance_id
+    )
+
+    assert row.id == activation_instance_id
+    assert row.rulesets == "--- []"
+    assert row.inventory == TEST_INVENTORY
+    assert row.extra_var_id is None
+    assert row.extra_var is None
+    assert row.project_large_data_id is None
+
+    assert await asql.get_activation_instance_bootstrap(db, -1) is None
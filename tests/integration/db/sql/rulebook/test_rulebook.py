@@ -59,6 +59,25 @@ TEST_RULESET_BAD = """
         debug:
 """
 
+TEST_RULESET_PLAYBOOK = """
+---
+- name: Test playbook
+  hosts: all
+  sources:
+    - range:
+        limit: 5
+  rules:
+    - name: Run hello
+      condition: event.i == 1
+      action:
+        run_playbook:
+          name: hello.yml
+    - name: Debug
+      condition: event.i == 2
+      action:
+        debug:
+"""
+
 DBTestData = namedtuple(
     "DBTestData",
     (
@@ -292,6 +311,44 @@ async def test_process_ruleset_sources_no_config(db: AsyncSession):
     assert ruleset.sources[0]["config"] is None
 
 
+async def test_insert_rulebook_rule_actions(db: AsyncSession):
+    project = await insert_project(db)
+    rulebooks = await insert_rulebooks(db, project)
+    rulebook_data = yaml.safe_load(TEST_RULESET_PLAYBOOK)
+    await rsql.insert_rulebook_related_data(db, rulebooks[0].id, rulebook_data)
+    (activation_instance_id,) = (
+        await bsql.insert_object(
+            db,
+            models.activation_instances,
+            values={"name": "test", "rulebook_id": rulebooks[0].id},
+        )
+    ).inserted_primary_key
+
+    rule_actions = (
+        await db.execute(
+            sa.select(
+                models.rule_actions.c.action_type,
+                models.rule_actions.c.action_name,
+            )
+            .where(models.rule_actions.c.rulebook_id == rulebooks[0].id)
+            .order_by(models.rule_actions.c.id)
+        )
+    ).all()
+    assert rule_actions == [("run_playbook", "hello.yml"), ("debug", None)]
+
+    actions = await rsql.get_activation_instance_rule_actions(
+        db, activation_instance_id, "run_playbook", "hello.yml"
+    )
+    assert len(actions) == 1
+    assert actions[0].name == "Run hello"
+    assert actions[0].definition == {"run_playbook": {"name": "hello.yml"}}
+
+    actions = await rsql.get_activation_instance_rule_actions(
+        db, activation_instance_id, "run_playbook", "other.yml"
+    )
+    assert actions == []
+
+
 # -------------------------------------------------------------------------
 #  Test Data
 # -------------------------------------------------------------------------
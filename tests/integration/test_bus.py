@@ -0,0 +1,173 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+
+import asyncpg
+import pytest
+
+from eda_server.bus import MemoryBus, PostgresBus, create_bus
+from eda_server.managers import UpdateManager
+
+from .test_managers import FakeWebSocket
+
+PAGE = "/activation_instance/1"
+
+
+@pytest.fixture
+def database_url(db_engine, db_url):
+    return db_url.render_as_string(hide_password=False)
+
+
+async def _receive(messages: list, count: int):
+    for _ in range(100):
+        if len(messages) >= count:
+            return
+        await asyncio.sleep(0.05)
+
+
+def test_encode_splits_on_character_boundaries():
+    sender = PostgresBus("postgresql://localhost/eda")
+    receiver = PostgresBus("postgresql://localhost/eda")
+    message = "é" * 10000
+
+    payloads = sender.encode(PAGE, message)
+    assert len(payloads) == 3
+    assert all(len(payload.encode()) < 8000 for payload in payloads)
+
+    assert sender.decode(payloads[0]) is None
+    decoded = [receiver.decode(payload) for payload in reversed(payloads)]
+    assert decoded == [None, None, (PAGE, message)]
+
+
+async def test_postgres_bus_delivers_to_other_processes(database_url):
+    first, second = PostgresBus(database_url), PostgresBus(database_url)
+    first_received, second_received = [], []
+    await first.start(lambda *args: first_received.append(args))
+    await second.start(lambda *args: second_received.append(args))
+    try:
+        large = "x" * 20000
+        first.publish(PAGE, "small")
+        first.publish(PAGE, large)
+        await _receive(second_received, 2)
+    finally:
+        await first.close()
+        await second.close()
+
+    assert second_received == [(PAGE, "small"), (PAGE, large)]
+    assert first_received == []
+
+
+async def test_update_manager_publishes_without_local_subscribers(
+    database_url,
+):
+    publisher, subscriber = UpdateManager(), UpdateManager()
+    await publisher.start(PostgresBus(database_url))
+    await subscriber.start(PostgresBus(database_url))
+    websocket = FakeWebSocket()
+    await subscriber.connect(PAGE, websocket)
+    try:
+        await publisher.broadcast(PAGE, lambda: ["Job", {"id": 1}])
+        await _receive(websocket.sent, 1)
+    finally:
+        subscriber.disconnect(PAGE, websocket)
+        await publisher.close()
+        await subscriber.close()
+
+    assert websocket.sent == ['["Job",{"id":1}]']
+
+
+async def test_update_manager_runs_commands_of_other_processes(
+    database_url,
+):
+    sender, receiver = UpdateManager(), UpdateManager()
+    received = []
+
+    async def stop(activation_instance_id, record=True):
+        received.append((activation_instance_id, record))
+
+    sender.commands["stop"] = receiver.commands["stop"] = stop
+    await sender.start(PostgresBus(database_url))
+    await receiver.start(PostgresBus(database_url))
+    try:
+        sender.send_command("stop", activation_instance_id=1, record=False)
+        await _receive(received, 1)
+    finally:
+        await sender.close()
+        await receiver.close()
+
+    assert received == [(1, False)]
+
+
+async def test_memory_bus_skips_pages_without_subscribers():
+    updatemanager = UpdateManager()
+    await updatemanager.start(create_bus("memory", ""))
+    assert isinstance(updatemanager.bus, MemoryBus)
+    assert not updatemanager.has_subscribers("/jobs")
+
+    with pytest.raises(ValueError):
+        create_bus("redis", "")
+
+
+async def test_postgres_bus_reconnects_lost_listener(database_url):
+    sender = PostgresBus(database_url)
+    receiver = PostgresBus(database_url, health_check_interval=0.5)
+    received = []
+    await sender.start(lambda *args: None)
+    await receiver.start(lambda *args: received.append(args))
+    try:
+        listener = receiver._listener
+        await sender._publisher.execute(
+            "SELECT pg_terminate_backend($1)", listener.get_server_pid()
+        )
+        for _ in range(100):
+            if receiver._listener is not listener:
+                break
+            await asyncio.sleep(0.05)
+
+        sender.publish(PAGE, "after reconnect")
+        await _receive(received, 1)
+    finally:
+        await sender.close()
+        await receiver.close()
+
+    assert received == [(PAGE, "after reconnect")]
+
+
+async def test_postgres_bus_health_check_detects_dead_listener(
+    database_url, monkeypatch
+):
+    bus = PostgresBus(database_url, health_check_interval=0.2)
+    await bus.start(lambda *args: None)
+    try:
+        listener = bus._listener
+        fetchval = asyncpg.Connection.fetchval
+
+        # A connection dropped by the network stops answering queries.
+        async def hang(connection, *args, **kwargs):
+            if connection is listener:
+                await asyncio.sleep(10)
+            return await fetchval(connection, *args, **kwargs)
+
+        monkeypatch.setattr(asyncpg.Connection, "fetchval", hang)
+        for _ in range(100):
+            if bus._listener is not listener:
+                break
+            await asyncio.sleep(0.05)
+
+        assert bus._listener is not listener
+        assert listener.is_closed()
+        assert not bus._listener.is_closed()
+    finally:
+        await bus.close()
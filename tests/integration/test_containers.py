@@ -0,0 +1,96 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+
+import pytest
+from aiodocker.exceptions import DockerError
+
+from eda_server.containers import ContainerClient, ImageNotPresentError
+
+
+class FakeImages:
+    def __init__(self, present=()):
+        self.present = set(present)
+        self.pulls = 0
+        self.inspects = 0
+
+    async def inspect(self, name):
+        self.inspects += 1
+        await asyncio.sleep(0)
+        if name not in self.present:
+            raise DockerError(404, "No such image")
+        return {"Id": f"sha256:{name}"}
+
+    async def pull(self, name):
+        self.pulls += 1
+        await asyncio.sleep(0.01)
+        self.present.add(name)
+
+
+class FakeDocker:
+    def __init__(self, present=()):
+        self.images = FakeImages(present)
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def _client(pull_policy, present=()):
+    docker = FakeDocker(present)
+    return ContainerClient(pull_policy, lambda: docker), docker
+
+
+async def test_concurrent_starts_pull_once():
+    client, docker = _client("if-not-present")
+
+    image_ids = await asyncio.gather(
+        *(client.ensure_image("ee:latest") for _ in range(50))
+    )
+
+    assert set(image_ids) == {"sha256:ee:latest"}
+    assert docker.images.pulls == 1
+    inspects = docker.images.inspects
+    await client.ensure_image("ee:latest")
+    assert docker.images.inspects == inspects
+
+    await client.close()
+    assert docker.closed
+    assert not client.images
+
+
+async def test_present_image_is_not_pulled():
+    client, docker = _client("if-not-present", present=["ee:latest"])
+    assert await client.ensure_image("ee:latest") == "sha256:ee:latest"
+    assert docker.images.pulls == 0
+
+
+async def test_pull_policy_always():
+    client, docker = _client("always", present=["ee:latest"])
+    await client.ensure_image("ee:latest")
+    await client.ensure_image("ee:latest")
+    assert docker.images.pulls == 2
+
+
+async def test_pull_policy_never():
+    client, docker = _client("never")
+    with pytest.raises(ImageNotPresentError):
+        await client.ensure_image("ee:latest")
+    assert docker.images.pulls == 0
+
+
+def test_unknown_pull_policy():
+    with pytest.raises(ValueError):
+        ContainerClient("sometimes")
@@ -0,0 +1,273 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from eda_server.db import models
+from eda_server.db.session import create_session_factory
+from eda_server.ingest import (
+    CreditWindow,
+    IngestContext,
+    JobEventBuffer,
+    insert_job_events,
+)
+from eda_server.messages import JobEnd
+from eda_server.ruleset import write_job_events
+
+JOB_UUID = "f4c87c90-254e-11ed-861d-0242ac120002"
+
+
+def make_event(counter: int) -> dict:
+    return {
+        "job_uuid": JOB_UUID,
+        "counter": counter,
+        "stdout": f"line {counter}",
+        "type": "runner_on_ok",
+        "created_at": None,
+    }
+
+
+def make_host() -> dict:
+    return {
+        "job_uuid": JOB_UUID,
+        "host": "localhost",
+        "playbook": "playbook.yml",
+        "play": "play",
+        "task": "task",
+        "status": "ok",
+    }
+
+
+async def test_job_event_buffer_flush_on_close(db: AsyncSession):
+    job_events = JobEventBuffer(
+        lambda: db, batch_size=3, flush_interval=60, max_pending=5
+    )
+    job_events.start()
+    for counter in range(10):
+        host = make_host() if counter % 2 else None
+        await job_events.add(make_event(counter), host)
+    await job_events.close()
+
+    assert job_events.pending == 0
+    counters = (
+        await db.scalars(
+            sa.select(models.job_instance_events.c.counter).order_by(
+                models.job_instance_events.c.counter
+            )
+        )
+    ).all()
+    assert counters == list(range(10))
+    hosts = (await db.execute(sa.select(models.job_instance_hosts))).all()
+    assert len(hosts) == 5
+
+
+@mock.patch("eda_server.ruleset.updatemanager")
+async def test_write_job_events_in_batches(
+    updatemanager: mock.Mock, db: AsyncSession
+):
+    updatemanager.broadcast_stdout = mock.AsyncMock()
+    commits = []
+    commit = db.commit
+
+    async def counting_commit():
+        query = sa.select(sa.func.count()).select_from(
+            models.job_instance_events
+        )
+        commits.append(await db.scalar(query))
+        await commit()
+
+    event_log = asyncio.Queue()
+    for counter in range(7):
+        event_log.put_nowait(
+            {"job_id": JOB_UUID, "counter": counter, "stdout": "ok"}
+        )
+    event_log.put_nowait(JobEnd(JOB_UUID))
+
+    with mock.patch.object(db, "commit", counting_commit):
+        await write_job_events(event_log, 1, lambda: db, batch_size=3)
+
+    # Everything queued ahead of JobEnd is written, 3 events at a time.
+    assert commits == [3, 6, 7]
+    assert updatemanager.broadcast_stdout.await_count == 7
+
+
+async def test_job_event_buffer_drops_only_failing_events(db: AsyncSession):
+    flushed = []
+
+    async def on_flush(events, written):
+        flushed.append(([event["counter"] for event in events], written))
+
+    job_events = JobEventBuffer(
+        lambda: db, batch_size=5, flush_interval=60, on_flush=on_flush
+    )
+    for counter in range(5):
+        event = make_event(counter)
+        if counter == 2:
+            event["counter"] = "two"
+        await job_events.add(event)
+    await job_events.close()
+
+    counters = (
+        await db.scalars(
+            sa.select(models.job_instance_events.c.counter).order_by(
+                models.job_instance_events.c.counter
+            )
+        )
+    ).all()
+    assert counters == [0, 1, 3, 4]
+    assert job_events.written == 4
+    assert job_events.dropped == 1
+    assert flushed == [([0, 1, 3, 4], True), (["two"], False)]
+
+
+@mock.patch("eda_server.ruleset.updatemanager")
+async def test_write_job_events_retries_failing_batch(
+    updatemanager: mock.Mock, db: AsyncSession
+):
+    updatemanager.broadcast_stdout = mock.AsyncMock()
+    commit = db.commit
+    failures = [True]
+
+    async def failing_commit():
+        if failures:
+            failures.pop()
+            raise sa.exc.OperationalError("COMMIT", {}, Exception("gone"))
+        await commit()
+
+    event_log = asyncio.Queue()
+    for counter in range(4):
+        event_log.put_nowait(
+            {
+                "job_id": JOB_UUID,
+                "counter": "three" if counter == 3 else counter,
+                "stdout": "ok",
+            }
+        )
+    event_log.put_nowait(JobEnd(JOB_UUID))
+
+    with mock.patch.object(db, "commit", failing_commit):
+        await write_job_events(event_log, 1, lambda: db, batch_size=10)
+
+    # The batch is retried, then written in halves without the bad event.
+    counters = (
+        await db.scalars(
+            sa.select(models.job_instance_events.c.counter).order_by(
+                models.job_instance_events.c.counter
+            )
+        )
+    ).all()
+    assert counters == [0, 1, 2]
+
+
+async def test_insert_job_events_skips_replayed_events(db: AsyncSession):
+    events = [(make_event(counter), make_host()) for counter in range(3)]
+    assert await insert_job_events(db, events) == 3
+
+    replayed = events[1:] + [(make_event(3), make_host())] * 2
+    assert await insert_job_events(db, replayed) == 1
+
+    counters = (
+        await db.scalars(
+            sa.select(models.job_instance_events.c.counter).order_by(
+                models.job_instance_events.c.counter
+            )
+        )
+    ).all()
+    assert counters == [0, 1, 2, 3]
+    hosts = (await db.execute(sa.select(models.job_instance_hosts))).all()
+    assert len(hosts) == 4
+
+
+async def test_credit_window_acks_flushed_events(db: AsyncSession):
+    sent = []
+
+    async def send(message: dict):
+        sent.append(message)
+
+    credits = CreditWindow(send, 4)
+    job_events = JobEventBuffer(
+        lambda: db, batch_size=3, flush_interval=60, on_flush=credits.on_flush
+    )
+    credits.consume()
+    assert credits.outstanding == 0
+
+    await credits.enable()
+    for counter in range(4):
+        credits.consume()
+        await job_events.add(make_event(counter))
+    assert credits.outstanding == 4
+    await job_events.close()
+
+    assert sent == [
+        {"type": "Credit", "credits": 4},
+        {"type": "Ack", "credits": 3, "events": {JOB_UUID: 2}},
+        {"type": "Ack", "credits": 1, "events": {JOB_UUID: 3}},
+    ]
+    assert credits.outstanding == 0
+    assert job_events.stats() == {
+        "received": 4,
+        "written": 4,
+        "dropped": 0,
+        "pending": 0,
+        "lag": 0.0,
+    }
+
+
+async def test_ingest_context_reuses_session(db: AsyncSession):
+    opened = []
+
+    def session_factory():
+        opened.append(db)
+        return db
+
+    ingest = IngestContext(session_factory)
+    async with ingest.session() as session:
+        assert session is db
+    async with ingest.session() as session:
+        assert session is db
+    assert len(opened) == 1
+
+    with pytest.raises(ValueError):
+        async with ingest.session():
+            raise ValueError
+    async with ingest.session() as session:
+        assert session is db
+    assert len(opened) == 2
+
+    await ingest.close()
+
+
+async def test_ingest_context_releases_connection(db_engine, db_url):
+    engine = create_async_engine(db_url, pool_size=1, max_overflow=0)
+    session_factory = create_session_factory(engine)
+    contexts = [IngestContext(session_factory) for _ in range(2)]
+    try:
+        for ingest in contexts:
+            async with ingest.session() as session:
+                assert await session.scalar(sa.text("SELECT 1")) == 1
+            # The transaction is over and the connection is back.
+            assert not session.in_transaction()
+            assert engine.pool.checkedout() == 0
+
+        async with session_factory() as session:
+            assert await session.scalar(sa.text("SELECT 1")) == 1
+    finally:
+        for ingest in contexts:
+            await ingest.close()
+        await engine.dispose()
@@ -0,0 +1,94 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+
+import pytest
+
+from eda_server.jobengine import JobEngine, JobQueueFull
+
+
+def _blocking(started: list, release: threading.Event, name: str):
+    def run(cancelled):
+        started.append(name)
+        while not release.wait(0.01):
+            if cancelled():
+                return "stopped"
+        return name
+
+    return run
+
+
+async def test_jobs_run_by_priority():
+    engine = JobEngine(workers=1, queue_size=3)
+    started = []
+    release = threading.Event()
+    try:
+        first = engine.submit("first", _blocking(started, release, "first"))
+        await asyncio.sleep(0.05)
+        low = engine.submit("low", _blocking(started, release, "low"))
+        high = engine.submit(
+            "high", _blocking(started, release, "high"), priority=1
+        )
+        later = engine.submit("later", _blocking(started, release, "later"))
+        stats = engine.stats()
+        assert [job["key"] for job in stats["running"]] == ["first"]
+        assert [job["key"] for job in stats["queued"]] == [
+            "low",
+            "high",
+            "later",
+        ]
+        with pytest.raises(JobQueueFull):
+            engine.submit("full", _blocking(started, release, "full"))
+
+        release.set()
+        results = await asyncio.gather(
+            first.future, low.future, high.future, later.future
+        )
+        assert results == ["first", "low", "high", "later"]
+        assert started == ["first", "high", "low", "later"]
+        assert not engine.queued and not engine.running
+    finally:
+        release.set()
+        await engine.close()
+
+
+async def test_cancel_and_timeout():
+    engine = JobEngine(workers=1)
+    started = []
+    release = threading.Event()
+    try:
+        running = engine.submit(
+            "running", _blocking(started, release, "running")
+        )
+        queued = engine.submit("queued", _blocking(started, release, "queued"))
+        await asyncio.sleep(0.05)
+
+        assert engine.cancel("queued")
+        assert queued.future.cancelled()
+        assert engine.cancel("running")
+        assert await running.future == "stopped"
+        assert running.result == "canceled"
+        assert not engine.cancel("running")
+
+        timed_out = engine.submit(
+            "timed_out", _blocking(started, release, "late"), timeout=0.05
+        )
+        assert await timed_out.future == "stopped"
+        assert timed_out.result == "timeout"
+        assert started == ["running", "late"]
+    finally:
+        release.set()
+        await engine.close()
@@ -0,0 +1,85 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import contextlib
+
+from asyncpg_lostream.lostream import PGLargeObject
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server.logsink import LogSinks
+
+
+class CountingSession:
+    """Counts the commits of a session."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.commits = 0
+
+    async def commit(self):
+        self.commits += 1
+        await self.db.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def _session_factory(session):
+    @contextlib.asynccontextmanager
+    async def factory():
+        yield session
+
+    return factory
+
+
+async def _read(db: AsyncSession, large_data_id: int) -> bytes:
+    async with PGLargeObject(db, oid=large_data_id, mode="r") as lobject:
+        return await lobject.read()
+
+
+async def test_output_is_written_in_batches(db: AsyncSession):
+    large_data_id = await PGLargeObject.create_large_object(db)
+    session = CountingSession(db)
+    sinks = LogSinks(flush_bytes=10, flush_interval=60, storage="large-object")
+
+    async with sinks.open(
+        _session_factory(session), None, large_data_id
+    ) as sink:
+        assert sinks.sinks == {sink}
+        for _ in range(4):
+            await sink.write(b"line\n")
+        assert session.commits == 2
+        await sink.write(b"tail\n")
+        assert sink.pending == 5
+
+    assert not sinks.sinks
+    assert await _read(db, large_data_id) == b"line\n" * 4 + b"tail\n"
+
+
+async def test_output_is_flushed_on_interval(db: AsyncSession):
+    large_data_id = await PGLargeObject.create_large_object(db)
+    sinks = LogSinks(
+        flush_bytes=65536, flush_interval=0.05, storage="large-object"
+    )
+
+    async with sinks.open(_session_factory(db), None, large_data_id) as sink:
+        await sink.write(b"output\n")
+        assert sink.pending == 7
+        for _ in range(50):
+            if not sink.pending:
+                break
+            await asyncio.sleep(0.01)
+        assert sink.pending == 0
+        assert await _read(db, large_data_id) == b"output\n"
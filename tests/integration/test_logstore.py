@@ -0,0 +1,182 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import sqlalchemy as sa
+from asyncpg_lostream.lostream import PGLargeObject
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server import logstore
+from eda_server.db import models
+from eda_server.db.sql import activation as asql
+
+LINES = b"".join(b"line %02d\n" % i for i in range(20))
+
+
+async def _create_activation_instance(db: AsyncSession) -> int:
+    query = sa.insert(models.activation_instances).values(name="test")
+    (activation_instance_id,) = (await db.execute(query)).inserted_primary_key
+    return activation_instance_id
+
+
+async def test_segments_index(db: AsyncSession):
+    activation_instance_id = await _create_activation_instance(db)
+    store = logstore.SegmentStore(db, activation_instance_id, segment_bytes=40)
+
+    await store.append(LINES[:30])
+    await store.append(LINES[30:])
+
+    index = await logstore.list_segments(db, activation_instance_id)
+    # Segments are cut after the last line that fits.
+    assert [
+        (row.byte_start, row.byte_count, row.line_start, row.line_count)
+        for row in index
+    ] == [(i * 40, 40, i * 5, 5) for i in range(4)]
+    output = await logstore.read_segments(
+        db, activation_instance_id, [row.segment for row in index]
+    )
+    assert output == LINES
+
+
+async def test_open_segment_is_written_as_chunks(db: AsyncSession):
+    activation_instance_id = await _create_activation_instance(db)
+    store = logstore.SegmentStore(db, activation_instance_id, segment_bytes=40)
+    for start in range(0, 32, 8):
+        await store.append(LINES[start : start + 8])
+
+    # Nothing is compressed until the segment is full.
+    assert await asql.list_log_segments(db, activation_instance_id) == []
+    chunks = await asql.list_log_chunks(db, activation_instance_id)
+    assert [(row.byte_start, row.line_start) for row in chunks] == [
+        (0, 0),
+        (8, 1),
+        (16, 2),
+        (24, 3),
+    ]
+    output, _ = await logstore.read_tail(db, activation_instance_id, 100)
+    assert output == LINES[:32]
+
+    store = logstore.SegmentStore(db, activation_instance_id, segment_bytes=40)
+    await store.open()
+    await store.append(LINES[32:48])
+
+    index = await asql.list_log_segments(db, activation_instance_id)
+    assert [(row.segment, row.byte_count) for row in index] == [(0, 40)]
+    chunks = await asql.list_log_chunks(db, activation_instance_id)
+    assert [(row.segment, row.byte_start, row.data) for row in chunks] == [
+        (1, 40, LINES[40:48])
+    ]
+    output, _ = await logstore.read_tail(db, activation_instance_id, 100)
+    assert output == LINES[:48]
+
+
+async def test_segments_continue_and_retention(db: AsyncSession):
+    activation_instance_id = await _create_activation_instance(db)
+    store = logstore.SegmentStore(
+        db, activation_instance_id, segment_bytes=40, max_bytes=100
+    )
+    await store.append(LINES[:100])
+
+    store = logstore.SegmentStore(
+        db, activation_instance_id, segment_bytes=40, max_bytes=100
+    )
+    await store.open()
+    await store.append(LINES[100:])
+
+    index = await logstore.list_segments(db, activation_instance_id)
+    # At least the last 100 bytes are kept.
+    assert [row.segment for row in index] == [1, 2, 3]
+    assert index[0].byte_start == 40
+    assert index[0].line_start == 5
+
+    output, truncated = await logstore.read_tail(
+        db, activation_instance_id, 1000
+    )
+    assert output == LINES[40:]
+    assert not truncated
+
+
+async def test_read_tail(db: AsyncSession):
+    activation_instance_id = await _create_activation_instance(db)
+    assert await logstore.read_tail(db, activation_instance_id, 10) is None
+    store = logstore.SegmentStore(db, activation_instance_id, segment_bytes=40)
+    await store.append(LINES)
+
+    output, truncated = await logstore.read_tail(
+        db, activation_instance_id, 12
+    )
+    assert output == LINES[-12:]
+    assert truncated
+
+    output, truncated = await logstore.read_tail(
+        db, activation_instance_id, 16
+    )
+    assert output == b"line 18\nline 19\n"
+    assert not truncated
+
+
+async def test_log_reader_lines():
+    reader = logstore.LogReader.from_bytes(b"a\nbb\nccc")
+
+    assert await reader.line_offset(0) == 0
+    assert await reader.line_offset(2) == 5
+    assert await reader.line_offset(9) == 8
+    assert await reader.line_at(6) == 2
+    # The line being written counts as a line.
+    assert await reader.tail_offset(1) == 5
+    assert await reader.tail_offset(5) == 0
+    assert b"".join([chunk async for chunk in reader.iter_bytes(2, 5)]) == (
+        b"bb\n"
+    )
+
+
+async def test_log_reader_large_object(db: AsyncSession):
+    oid = await PGLargeObject.create_large_object(db)
+    async with PGLargeObject(db, oid=oid, mode="w") as lobject:
+        await lobject.write(LINES)
+
+    reader = await logstore.LogReader.open_large_object(
+        db, oid, len(LINES), window=25
+    )
+    # Windows cut lines anywhere.
+    assert [(row.byte_start, row.line_count) for row in reader.index] == [
+        (0, 3),
+        (25, 3),
+        (50, 3),
+        (75, 3),
+        (100, 3),
+        (125, 3),
+        (150, 2),
+    ]
+    assert reader.end == 160
+    assert await reader.line_offset(7) == 56
+    assert await reader.line_at(60) == 7
+    assert await reader.tail_offset(2) == 144
+    chunks = [chunk async for chunk in reader.iter_bytes(144, 160)]
+    # Only the windows covering the range are fetched.
+    assert chunks == [b"line 1", b"8\nline 19\n"]
+
+
+async def test_log_reader_after_retention(db: AsyncSession):
+    activation_instance_id = await _create_activation_instance(db)
+    store = logstore.SegmentStore(
+        db, activation_instance_id, segment_bytes=40, max_bytes=60
+    )
+    await store.append(LINES)
+
+    reader = await logstore.LogReader.open(db, activation_instance_id)
+    assert reader.start == 80
+    # Lines no longer stored start at the oldest output.
+    assert await reader.line_offset(3) == 80
+    assert await reader.line_offset(12) == 96
+    assert await reader.line_at(96) == 12
@@ -0,0 +1,315 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import json
+
+import pytest
+
+from eda_server.managers import OverflowPolicy, UpdateManager
+
+PAGE = "/job_instance/1"
+
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent = []
+        self.closed_with = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def test_broadcast_does_not_wait_for_slow_subscriber():
+    updatemanager = UpdateManager(queue_size=2)
+    fast, slow = FakeWebSocket(), FakeWebSocket(blocked=True)
+    await updatemanager.connect(PAGE, fast)
+    await updatemanager.connect(PAGE, slow)
+
+    for i in range(4):
+        await updatemanager.broadcast(PAGE, str(i))
+        await _settle()
+    assert fast.sent == ["0", "1", "2", "3"]
+    assert slow.sent == []
+
+    slow.unblocked.set()
+    await _settle()
+    # The writer was blocked sending "0" when "1" was dropped.
+    assert slow.sent == ["0", "2", "3"]
+
+    updatemanager.disconnect(PAGE, fast)
+    updatemanager.disconnect(PAGE, slow)
+    assert PAGE not in updatemanager.active_connections
+
+
+@pytest.mark.parametrize(
+    "overflow_policy, expected",
+    [
+        (OverflowPolicy.DROP_OLDEST, ["0", "2", "3"]),
+        (OverflowPolicy.DROP_NEWEST, ["0", "1", "2"]),
+    ],
+)
+async def test_broadcast_drop_policies(overflow_policy, expected):
+    updatemanager = UpdateManager(
+        queue_size=2, overflow_policy=overflow_policy
+    )
+    websocket = FakeWebSocket(blocked=True)
+    await updatemanager.connect(PAGE, websocket)
+    await _settle()
+
+    for i in range(4):
+        await updatemanager.broadcast(PAGE, str(i))
+        await _settle()
+    websocket.unblocked.set()
+    await _settle()
+    assert websocket.sent == expected
+    updatemanager.disconnect(PAGE, websocket)
+
+
+async def test_broadcast_disconnects_slow_subscriber():
+    updatemanager = UpdateManager(
+        queue_size=1, overflow_policy=OverflowPolicy.DISCONNECT
+    )
+    websocket = FakeWebSocket(blocked=True)
+    await updatemanager.connect(PAGE, websocket)
+    await _settle()
+
+    for i in range(3):
+        await updatemanager.broadcast(PAGE, str(i))
+        await _settle()
+    assert PAGE not in updatemanager.active_connections
+
+    websocket.unblocked.set()
+    await _settle()
+    assert websocket.sent == ["0"]
+    assert websocket.closed_with == 1013
+    # The endpoint still calls disconnect once the socket is closed.
+    updatemanager.disconnect(PAGE, websocket)
+
+
+async def test_broadcast_stdout_coalesces_fragments():
+    updatemanager = UpdateManager(stdout_window=60, stdout_max_bytes=10)
+    websocket = FakeWebSocket()
+    await updatemanager.connect(PAGE, websocket)
+
+    await updatemanager.broadcast_stdout(PAGE, "one\n")
+    await updatemanager.broadcast_stdout(PAGE, "two\n")
+    await _settle()
+    assert websocket.sent == []
+
+    # Reaching the size limit sends everything pending.
+    await updatemanager.broadcast_stdout(PAGE, "three\n")
+    # Pending stdout is sent ahead of any other message.
+    await updatemanager.broadcast_stdout(PAGE, "four\n")
+    await updatemanager.broadcast(PAGE, '["Job", {}]')
+    await _settle()
+    assert [json.loads(message) for message in websocket.sent] == [
+        ["Stdout", {"stdout": "one\ntwo\nthree\n"}],
+        ["Stdout", {"stdout": "four\n"}],
+        ["Job", {}],
+    ]
+    updatemanager.disconnect(PAGE, websocket)
+
+
+async def test_unsubscribe_keeps_pending_stdout_in_history():
+    updatemanager = UpdateManager(stdout_window=60)
+    websocket = FakeWebSocket()
+    await updatemanager.connect(PAGE, websocket)
+    await updatemanager.broadcast_stdout(PAGE, "one\n")
+    await updatemanager.broadcast_stdout(PAGE, "two\n")
+    updatemanager.disconnect(PAGE, websocket)
+    assert PAGE not in updatemanager.stdout_buffers
+
+    late = FakeWebSocket()
+    await updatemanager.connect(PAGE, late)
+    await _settle()
+    assert [json.loads(message) for message in late.sent] == [
+        ["Stdout", {"stdout": "one\ntwo\n"}],
+    ]
+    updatemanager.disconnect(PAGE, late)
+
+
+async def test_broadcast_stdout_flushes_after_window():
+    updatemanager = UpdateManager(stdout_window=0.01)
+    websocket = FakeWebSocket()
+    await updatemanager.connect(PAGE, websocket)
+
+    await updatemanager.broadcast_stdout(PAGE, "one\n")
+    await updatemanager.broadcast_stdout(PAGE, "two\n")
+    await asyncio.sleep(0.05)
+    assert [json.loads(message) for message in websocket.sent] == [
+        ["Stdout", {"stdout": "one\ntwo\n"}]
+    ]
+
+    # Nothing is buffered for pages without subscribers or history.
+    await updatemanager.broadcast_stdout("/jobs", "one\n")
+    assert updatemanager.stdout_buffers == {}
+    updatemanager.disconnect(PAGE, websocket)
+
+
+async def test_broadcast_builds_message_only_for_subscribers():
+    updatemanager = UpdateManager(history_bytes=0)
+    built = []
+
+    def build_message():
+        built.append(True)
+        return ["Job", {"id": 1}]
+
+    await updatemanager.broadcast(PAGE, build_message)
+    assert built == []
+    assert updatemanager.active_connections == {}
+
+    websocket = FakeWebSocket()
+    await updatemanager.connect(PAGE, websocket)
+    await updatemanager.broadcast(PAGE, build_message)
+    await updatemanager.broadcast(PAGE, '["Job", {"id": 2}]')
+    await _settle()
+    assert built == [True]
+    assert [json.loads(message) for message in websocket.sent] == [
+        ["Job", {"id": 1}],
+        ["Job", {"id": 2}],
+    ]
+    updatemanager.disconnect(PAGE, websocket)
+
+
+async def test_connect_replays_page_history():
+    updatemanager = UpdateManager(stdout_window=0, history_bytes=40)
+    websocket = FakeWebSocket()
+    await updatemanager.connect(PAGE, websocket)
+
+    for line in ("one\n", "two\n", "three\n"):
+        await updatemanager.broadcast_stdout(PAGE, line)
+    await _settle()
+    updatemanager.disconnect(PAGE, websocket)
+    assert len(websocket.sent) == 3
+
+    # Messages broadcast while nobody watches are kept too, but only
+    # built and encoded when replayed.
+    built = []
+
+    def build_message():
+        built.append(True)
+        return ["Job", {"id": 1}]
+
+    await updatemanager.broadcast_stdout(PAGE, "four\n")
+    await updatemanager.broadcast(PAGE, build_message)
+    await updatemanager.broadcast_stdout(PAGE, "fi")
+    await updatemanager.broadcast_stdout(PAGE, "ve\n")
+    assert built == []
+
+    late = FakeWebSocket()
+    await updatemanager.connect(PAGE, late)
+    await updatemanager.broadcast_stdout(PAGE, "six\n")
+    await _settle()
+    # Only the latest 40 characters of the history are replayed.
+    assert built == [True]
+    assert [json.loads(message) for message in late.sent] == [
+        ["Stdout", {"stdout": "four\n"}],
+        ["Job", {"id": 1}],
+        ["Stdout", {"stdout": "five\n"}],
+        ["Stdout", {"stdout": "six\n"}],
+    ]
+    updatemanager.disconnect(PAGE, late)
+
+    await updatemanager.broadcast("/jobs", '["Job", {}]')
+    assert "/jobs" not in updatemanager.history
+
+
+async def test_multiplexed_subscriber_receives_tagged_messages():
+    updatemanager = UpdateManager(stdout_window=0)
+    websocket = FakeWebSocket()
+    subscriber = await updatemanager.connect_multiplexed(websocket)
+    updatemanager.subscribe(subscriber, "/jobs")
+    updatemanager.subscribe(subscriber, PAGE)
+    # Subscribing twice does not duplicate messages.
+    updatemanager.subscribe(subscriber, "/jobs")
+
+    await updatemanager.broadcast("/jobs", '["Job", {"id": 1}]')
+    await updatemanager.broadcast_stdout(PAGE, "one\n")
+    updatemanager.unsubscribe(subscriber, "/jobs")
+    await updatemanager.broadcast("/jobs", '["Job", {"id": 2}]')
+    await _settle()
+    assert [json.loads(message) for message in websocket.sent] == [
+        {"page": "/jobs", "message": ["Job", {"id": 1}]},
+        {"page": PAGE, "message": ["Stdout", {"stdout": "one\n"}]},
+    ]
+
+    # The history of a page is replayed on subscription.
+    other = FakeWebSocket()
+    late = await updatemanager.connect_multiplexed(other)
+    updatemanager.subscribe(late, PAGE)
+    await _settle()
+    assert [json.loads(message) for message in other.sent] == [
+        {"page": PAGE, "message": ["Stdout", {"stdout": "one\n"}]},
+    ]
+
+    updatemanager.release(subscriber)
+    updatemanager.release(late)
+    assert updatemanager.active_connections == {}
+
+
+async def test_reap_pings_and_evicts_silent_subscribers():
+    updatemanager = UpdateManager(
+        heartbeat_interval=0.01, heartbeat_timeout=0.05
+    )
+    websocket = FakeWebSocket()
+    subscriber = await updatemanager.connect_multiplexed(websocket)
+    updatemanager.subscribe(subscriber, "/jobs")
+
+    await asyncio.sleep(0.02)
+    await updatemanager.reap()
+    await _settle()
+    assert [json.loads(message) for message in websocket.sent] == [
+        {"type": "Ping"}
+    ]
+    assert updatemanager.count_idle() == 0
+
+    # Answering keeps the subscriber connected.
+    await asyncio.sleep(0.04)
+    updatemanager.touch(subscriber)
+    await updatemanager.reap()
+    assert subscriber in updatemanager.subscribers
+
+    await asyncio.sleep(0.06)
+    await updatemanager.reap()
+    assert updatemanager.subscribers == set()
+    assert updatemanager.active_connections == {}
+    assert websocket.closed_with == 1001
+
+
+async def test_send_timeout_evicts_subscriber():
+    updatemanager = UpdateManager(send_timeout=0.01)
+    websocket = FakeWebSocket(blocked=True)
+    await updatemanager.connect(PAGE, websocket)
+
+    await updatemanager.broadcast(PAGE, '["Job", {}]')
+    await asyncio.sleep(0.05)
+    assert updatemanager.subscribers == set()
+    assert PAGE not in updatemanager.active_connections
+    assert websocket.closed_with == 1011
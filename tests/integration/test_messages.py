@@ -0,0 +1,43 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from eda_server.messages import MessageDecodeError, decode_worker_message
+
+
+def test_decode_worker_message():
+    data = decode_worker_message(
+        '{"type": "AnsibleEvent", "event": {"job_id": "1", "counter": 1}}'
+    )
+    assert data == {
+        "type": "AnsibleEvent",
+        "event": {"job_id": "1", "counter": 1},
+    }
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "not json",
+        "[]",
+        '{"type": "Unknown"}',
+        '{"type": "Worker"}',
+        '{"type": "AnsibleEvent", "event": "text"}',
+        '{"type": "Job", "job_id": 1, "ansible_rulebook_id": 1}',
+    ],
+)
+def test_decode_worker_message_invalid(raw):
+    with pytest.raises(MessageDecodeError):
+        decode_worker_message(raw)
@@ -0,0 +1,117 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from eda_server import metrics
+
+
+def test_render():
+    registry = CollectorRegistry()
+    counter = metrics.Counter(
+        "test_messages_total", "Messages.", ["type"], registry=registry
+    )
+    pending = {1: 3}
+    gauge = metrics.CallbackGauge(
+        "test_pending",
+        "Pending.",
+        ["id"],
+        lambda: [((key,), value) for key, value in pending.items()],
+        registry=registry,
+    )
+    histogram = metrics.Histogram(
+        "test_seconds", "Seconds.", buckets=(0.1, 1.0), registry=registry
+    )
+    counter.labels(type="Job").inc()
+    counter.labels(type='"quoted"').inc(2)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert metrics.render(registry).decode().splitlines() == [
+        "# HELP test_messages_total Messages.",
+        "# TYPE test_messages_total counter",
+        'test_messages_total{type="Job"} 1.0',
+        'test_messages_total{type="\\"quoted\\""} 2.0',
+        "# HELP test_pending Pending.",
+        "# TYPE test_pending gauge",
+        'test_pending{id="1"} 3.0',
+        "# HELP test_seconds Seconds.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1.0',
+        'test_seconds_bucket{le="1.0"} 2.0',
+        'test_seconds_bucket{le="+Inf"} 3.0',
+        "test_seconds_count 3.0",
+        "test_seconds_sum 5.55",
+    ]
+    assert gauge.labelnames == ("id",)
+
+    # Values no longer reported are removed.
+    pending = {2: 1}
+    assert 'test_pending{id="1"}' not in metrics.render(registry).decode()
+    assert 'test_pending{id="2"} 1.0' in metrics.render(registry).decode()
+
+
+def test_metric_labels_are_checked():
+    registry = CollectorRegistry()
+    counter = metrics.Counter(
+        "test_total", "Test.", ["type"], registry=registry
+    )
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        metrics.Counter("test_total", "Test.", registry=registry)
+
+
+def test_render_metrics_of_all_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    worker = textwrap.dedent("""
+        import asyncio
+        import sys
+
+        from eda_server import metrics
+
+        counter = metrics.Counter("test_total", "Test.", ["type"])
+        metrics.CallbackGauge("test_pending", "Test.", [], lambda: [((), 2)])
+        counter.labels(type="Job").inc()
+        metrics.callbackgauges.refresh()
+        if sys.argv[1] == "stop":
+            asyncio.run(metrics.callbackgauges.close())
+        """)
+    for stop in ("stop", "keep"):
+        subprocess.run(
+            [sys.executable, "-c", worker, stop], env=env, check=True
+        )
+    scrape = textwrap.dedent("""
+        from eda_server import metrics
+
+        print(metrics.render().decode())
+        """)
+    output = subprocess.run(
+        [sys.executable, "-c", scrape],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    # Counters add up, gauges of stopped processes no longer count.
+    assert 'test_total{type="Job"} 2.0' in output.splitlines()
+    assert "test_pending 2.0" in output.splitlines()
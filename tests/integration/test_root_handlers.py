@@ -12,10 +12,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import threading
+
 import yaml
 from fastapi import status as status_codes
 from httpx import AsyncClient
 
+from eda_server import metrics
+
 
 async def test_ping(client: AsyncClient):
     response = await client.get("/ping")
@@ -28,3 +32,27 @@ async def test_openapi_yaml(client: AsyncClient):
     assert response.status_code == status_codes.HTTP_200_OK
     data = yaml.safe_load(response.text)
     assert data["info"]["title"] == "Ansible Events API"
+
+
+async def test_metrics(client: AsyncClient):
+    response = await client.get("/metrics")
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE eda_ws2_messages_total counter" in response.text
+
+
+async def test_metrics_collected_on_event_loop(client: AsyncClient):
+    threads = []
+    gauge = metrics.CallbackGauge(
+        "test_threads",
+        "Test.",
+        [],
+        lambda: threads.append(threading.current_thread()) or [],
+        registry=None,
+    )
+    try:
+        response = await client.get("/metrics")
+    finally:
+        metrics.callbackgauges.gauges.remove(gauge)
+    assert response.status_code == status_codes.HTTP_200_OK
+    assert threads == [threading.current_thread()]
@@ -0,0 +1,321 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import contextlib
+import datetime
+from typing import List
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from eda_server import ruleset
+from eda_server.db import models
+from eda_server.db.models.activation import ActivationStatus, RestartPolicy
+from eda_server.db.sql import activation as asql
+from eda_server.supervisor import ActivationSpec, Supervisor, should_restart
+
+
+class FakeRuleset:
+    """Stands in for the processes started by ``eda_server.ruleset``."""
+
+    def __init__(self, exit_codes: List[int]):
+        self.exit_codes = exit_codes
+        self.started = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def activate_rulesets(self, deployment_type, activation_id, *args):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        self.started += 1
+        ruleset.activated_rulesets[activation_id] = object()
+
+    async def wait_rulesets(self, activation_id):
+        await asyncio.sleep(0)
+        del ruleset.activated_rulesets[activation_id]
+        return self.exit_codes.pop(0)
+
+
+@pytest.fixture
+def fake_ruleset(monkeypatch):
+    fake = FakeRuleset([])
+    monkeypatch.setattr(ruleset, "activate_rulesets", fake.activate_rulesets)
+    monkeypatch.setattr(ruleset, "wait_rulesets", fake.wait_rulesets)
+    return fake
+
+
+def _session_factory(db: AsyncSession):
+    """Share the test session between supervised instances, in turn."""
+    lock = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def session():
+        async with lock:
+            yield db
+
+    return session
+
+
+async def _create_activation_instance(
+    db: AsyncSession, restart_policy: RestartPolicy, **values
+) -> int:
+    query = sa.insert(models.activation_instances).values(
+        name="test-activation",
+        restart_policy=restart_policy,
+        **values,
+    )
+    (activation_instance_id,) = (await db.execute(query)).inserted_primary_key
+    await db.commit()
+    return activation_instance_id
+
+
+def _spec(activation_instance_id: int, restart_policy: RestartPolicy):
+    return ActivationSpec(
+        "local",
+        activation_instance_id,
+        None,
+        "quay.io/ansible/ansible-rulebook",
+        "",
+        "",
+        "",
+        "/tmp",
+        "localhost",
+        9000,
+        restart_policy,
+    )
+
+
+async def _wait_supervised(supervisor: Supervisor):
+    for _ in range(100):
+        if not supervisor.supervised:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize(
+    "restart_policy, exit_code, expected",
+    [
+        (RestartPolicy.ALWAYS, 0, True),
+        (RestartPolicy.ON_FAILURE, 0, False),
+        (RestartPolicy.ON_FAILURE, 1, True),
+        (RestartPolicy.NEVER, 1, False),
+    ],
+)
+def test_should_restart(restart_policy, exit_code, expected):
+    assert should_restart(restart_policy, exit_code) is expected
+
+
+def test_backoff_is_bounded_and_jittered():
+    supervisor = Supervisor(backoff_base=1.0, backoff_max=10.0)
+    assert 0.5 <= supervisor.backoff(0) <= 1.0
+    assert 4.0 <= supervisor.backoff(3) <= 8.0
+    assert 5.0 <= supervisor.backoff(100) <= 10.0
+
+
+async def test_supervisor_restarts_on_failure(
+    db: AsyncSession, fake_ruleset: FakeRuleset
+):
+    fake_ruleset.exit_codes = [1, 2, 0]
+    activation_instance_id = await _create_activation_instance(
+        db, RestartPolicy.ON_FAILURE
+    )
+    supervisor = Supervisor(backoff_base=0.001)
+
+    await supervisor.start(
+        _spec(activation_instance_id, RestartPolicy.ON_FAILURE), lambda: db
+    )
+    await _wait_supervised(supervisor)
+
+    assert fake_ruleset.started == 3
+    row = (
+        await db.execute(
+            sa.select(models.activation_instances).where(
+                models.activation_instances.c.id == activation_instance_id
+            )
+        )
+    ).first()
+    assert row.status == ActivationStatus.COMPLETED.value
+    assert row.exit_code == 0
+    assert row.restart_count == 2
+    assert row.restarted_at is not None
+
+
+async def test_supervisor_stop_does_not_restart(
+    db: AsyncSession, fake_ruleset: FakeRuleset, monkeypatch
+):
+    activation_instance_id = await _create_activation_instance(
+        db, RestartPolicy.ALWAYS
+    )
+    stopped = asyncio.Event()
+
+    async def wait_rulesets(activation_id):
+        await stopped.wait()
+        return -9
+
+    async def inactivate_rulesets(activation_id):
+        stopped.set()
+
+    monkeypatch.setattr(ruleset, "wait_rulesets", wait_rulesets)
+    monkeypatch.setattr(ruleset, "inactivate_rulesets", inactivate_rulesets)
+    supervisor = Supervisor(backoff_base=0.001)
+
+    await supervisor.start(
+        _spec(activation_instance_id, RestartPolicy.ALWAYS), lambda: db
+    )
+    await supervisor.stop(activation_instance_id)
+    await asyncio.sleep(0.05)
+
+    assert fake_ruleset.started == 1
+    assert supervisor.supervised == {}
+    status = await db.scalar(
+        sa.select(models.activation_instances.c.status).where(
+            models.activation_instances.c.id == activation_instance_id
+        )
+    )
+    assert status == ActivationStatus.STOPPED.value
+
+
+async def test_supervisor_recovers_running_instances(
+    db: AsyncSession, fake_ruleset: FakeRuleset
+):
+    fake_ruleset.exit_codes = [0, 0, 0]
+    running = [
+        await _create_activation_instance(
+            db, RestartPolicy.ON_FAILURE, status="running"
+        )
+        for _ in range(3)
+    ]
+    never = await _create_activation_instance(
+        db, RestartPolicy.NEVER, status="running"
+    )
+    completed = await _create_activation_instance(
+        db, RestartPolicy.ALWAYS, status="completed"
+    )
+    supervisor = Supervisor(max_concurrent_starts=1, backoff_base=0.001)
+
+    recovered = await supervisor.recover(
+        _session_factory(db), "local", "localhost", 9000
+    )
+    assert recovered == 3
+    await _wait_supervised(supervisor)
+
+    assert fake_ruleset.started == 3
+    assert fake_ruleset.max_running == 1
+    rows = (
+        await db.execute(
+            sa.select(
+                models.activation_instances.c.id,
+                models.activation_instances.c.status,
+                models.activation_instances.c.restart_count,
+            ).where(
+                models.activation_instances.c.id.in_(
+                    running + [never, completed]
+                )
+            )
+        )
+    ).all()
+    statuses = {row.id: (row.status, row.restart_count) for row in rows}
+    assert statuses == {
+        **{id_: ("completed", 1) for id_ in running},
+        never: ("failed", 0),
+        completed: ("completed", 0),
+    }
+
+
+async def test_claim_activation_instances_once(db: AsyncSession):
+    orphaned = await _create_activation_instance(
+        db, RestartPolicy.ON_FAILURE, status="running"
+    )
+    expired = await _create_activation_instance(
+        db,
+        RestartPolicy.ON_FAILURE,
+        status="running",
+        supervisor_id="gone",
+        supervised_at=sa.func.now() - datetime.timedelta(minutes=5),
+    )
+    await _create_activation_instance(
+        db,
+        RestartPolicy.ON_FAILURE,
+        status="running",
+        supervisor_id="alive",
+        supervised_at=sa.func.now(),
+    )
+
+    claimed = await asql.claim_activation_instances_to_recover(db, "a", 30)
+    assert sorted(claimed) == [orphaned, expired]
+    # Claimed instances hold a fresh lease, for this process or another.
+    assert await asql.claim_activation_instances_to_recover(db, "a", 30) == []
+    assert await asql.claim_activation_instances_to_recover(db, "b", 30) == []
+
+    await asql.release_supervisor_lease(db, "a")
+    claimed = await asql.claim_activation_instances_to_recover(db, "b", 30)
+    assert sorted(claimed) == [orphaned, expired]
+
+
+async def test_inactivate_rulesets_waits_for_output():
+    activation_instance_id = 1000
+    proc = await asyncio.create_subprocess_exec(
+        "sh",
+        "-c",
+        "echo output; exec sleep 10",
+        stdout=asyncio.subprocess.PIPE,
+    )
+    ruleset.activated_rulesets[activation_instance_id] = proc
+    written = []
+
+    async def read_output():
+        # Reads until the process is killed, then writes slowly.
+        written.append(await proc.stdout.read())
+        await asyncio.sleep(0.1)
+        written.append(b"flushed")
+
+    try:
+        ruleset.capture_output(
+            activation_instance_id, read_output(), "read_output"
+        )
+        await ruleset.inactivate_rulesets(activation_instance_id)
+        assert written == [b"output\n", b"flushed"]
+        assert activation_instance_id not in ruleset.output_tasks
+    finally:
+        await ruleset.wait_rulesets(activation_instance_id)
+
+
+async def test_activate_rulesets_waits_for_previous_output(tmp_path):
+    activation_instance_id = 1001
+    written = []
+
+    async def read_output():
+        await asyncio.sleep(0.1)
+        written.append("previous")
+
+    ruleset.capture_output(activation_instance_id, read_output(), "previous")
+    with pytest.raises(Exception, match="Unsupported deployment_type"):
+        await ruleset.activate_rulesets(
+            "unknown",
+            activation_instance_id,
+            None,
+            "",
+            "",
+            "",
+            "",
+            str(tmp_path),
+            "localhost",
+            9000,
+            None,
+        )
+    assert written == ["previous"]
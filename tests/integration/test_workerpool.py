@@ -0,0 +1,118 @@
+#  Copyright 2022 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import sys
+
+import pytest
+
+from eda_server.api.websocket import WorkerConnection
+from eda_server.workerpool import POOL_ID_PREFIX, WorkerPool
+
+
+def sleeping_worker(activation_id: str):
+    return [sys.executable, "-c", "import time; time.sleep(60)", activation_id]
+
+
+def exiting_worker(activation_id: str):
+    return [sys.executable, "-c", "pass", activation_id]
+
+
+def _pool_ids(pool: WorkerPool):
+    return [POOL_ID_PREFIX + token for token in pool.idle]
+
+
+async def test_acquire_assigns_parked_worker():
+    pool = WorkerPool(2, sleeping_worker)
+    await pool.start()
+    try:
+        assert len(pool.idle) == 2
+        pool_id = _pool_ids(pool)[0]
+        parked = asyncio.create_task(pool.park(pool_id))
+        await asyncio.sleep(0)
+        assert not parked.done()
+
+        proc = pool.acquire(42)
+
+        assert await parked == 42
+        assert proc.returncode is None
+        assert pool_id[len(POOL_ID_PREFIX) :] not in pool.idle
+        # The pool is replenished in the background.
+        for _ in range(50):
+            if len(pool.idle) == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert len(pool.idle) == 2
+        proc.kill()
+        await proc.wait()
+    finally:
+        await pool.close()
+    assert not pool.idle
+
+
+async def test_park_after_acquire():
+    pool = WorkerPool(1, sleeping_worker)
+    await pool.start()
+    try:
+        pool_id = _pool_ids(pool)[0]
+        proc = pool.acquire(7)
+        assert await pool.park(pool_id) == 7
+        # A placeholder id is only parked once.
+        assert await pool.park(pool_id) is None
+        proc.kill()
+        await proc.wait()
+    finally:
+        await pool.close()
+
+
+async def test_acquire_disabled_or_empty():
+    assert WorkerPool(0, sleeping_worker).acquire(1) is None
+    pool = WorkerPool(1, exiting_worker, respawn_delay=60)
+    await pool.start()
+    try:
+        worker = next(iter(pool.idle.values()))
+        for _ in range(500):
+            if not pool.idle:
+                break
+            await asyncio.sleep(0.01)
+        assert not pool.idle
+        assert await pool.park(POOL_ID_PREFIX + worker.token) is None
+        assert pool.acquire(1) is None
+    finally:
+        await pool.close()
+
+
+@pytest.mark.parametrize(
+    ("data", "expected"),
+    [
+        (
+            {"type": "Job", "ansible_rulebook_id": "pool-abc"},
+            {"type": "Job", "ansible_rulebook_id": 3},
+        ),
+        (
+            {"type": "Action", "activation_id": "pool-abc"},
+            {"type": "Action", "activation_id": 3},
+        ),
+        (
+            {"type": "Action", "activation_id": 5},
+            {"type": "Action", "activation_id": 5},
+        ),
+    ],
+)
+def test_worker_connection_translate(data, expected):
+    connection = WorkerConnection(None, None)
+    connection.pool_id = "pool-abc"
+    connection.activation_instance_id = 3
+    connection.translate(data)
+    assert data == expected
@@ -8,17 +8,28 @@ import { ActivationType } from '@app/Activations/Activations';
 import { fetchActivationOutput } from '@app/API/Activation';
 import { LogViewer } from '@patternfly/react-log-viewer';
 
+// Output received over the websocket starts with the recent output the
+// server replays, which overlaps the end of the stored output.
+const mergeOutput = (stored: string, live: string): string => {
+  const probe = live.slice(0, Math.min(live.indexOf('\n') + 1 || live.length, 64));
+  let index = probe ? stored.indexOf(probe) : -1;
+  while (index >= 0) {
+    if (live.startsWith(stored.slice(index))) {
+      return stored.slice(0, index) + live;
+    }
+    index = stored.indexOf(probe, index + 1);
+  }
+  return stored + live;
+};
+
 const ActivationStdout: React.FunctionComponent<{ activation: ActivationType }> = ({ activation }) => {
   const intl = useIntl();
-  const [stdout, setStdout] = useState<string[]>([]);
-  const [newStdout, setNewStdout] = useState<string>('');
-
-  useEffect(() => {
-    fetchActivationOutput(activation.id);
-  }, []);
+  const [stdout, setStdout] = useState<string>('');
 
   const [update_client, setUpdateClient] = useState<WebSocket | unknown>({});
   useEffect(() => {
+    // Live output is held back until the stored output is fetched.
+    let live: string | undefined = '';
     const uc = new WebSocket('ws://' + getServer() + '/api/ws-activation/' + activation.id);
     setUpdateClient(uc);
     uc.onopen = () => {
@@ -28,14 +39,26 @@ const ActivationStdout: React.FunctionComponent<{ activation: ActivationType }>
       const [messageType, data] = JSON.parse(message.data);
       if (messageType === 'Stdout') {
         const { stdout: dataStdout } = data;
-        setNewStdout(dataStdout);
+        if (live === undefined) {
+          setStdout((output) => output + dataStdout);
+        } else {
+          live += dataStdout;
+        }
       }
     };
-  }, []);
-
-  useEffect(() => {
-    setStdout([...stdout, newStdout]);
-  }, [newStdout]);
+    const showOutput = (stored: string) => {
+      setStdout(mergeOutput(stored, live || ''));
+      live = undefined;
+    };
+    fetchActivationOutput(activation.id).then(
+      (response) => {
+        const lines: { log: string }[] = response.data;
+        showOutput(lines.map((line) => line.log).join(''));
+      },
+      () => showOutput('')
+    );
+    return () => uc.close();
+  }, [activation.id]);
 
   return (
     <PageSection page-type={'activation-details'} id={'activation-details'}>
@@ -44,7 +67,7 @@ const ActivationStdout: React.FunctionComponent<{ activation: ActivationType }>
         <StackItem>
           <Card>
             <CardTitle>Standard Out</CardTitle>
-            <CardBody>{stdout && stdout.length > 0 && <LogViewer hasLineNumbers={false} data={stdout} />}</CardBody>
+            <CardBody>{stdout.length > 0 && <LogViewer hasLineNumbers={false} data={stdout} />}</CardBody>
           </Card>
         </StackItem>
       </Stack>